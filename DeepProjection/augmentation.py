@@ -0,0 +1,232 @@
+"""
+
+Batched augmentation and noise for diffraction thumbnails.
+
+add_noise() applies the same transformations as addNoise() in
+examples/twin_network_for_diffraction.ipynb to a whole batch at once:
+the rotation, flips and zoom of every image are composed into one affine
+matrix per image and applied with a single bilinear warp over the batch,
+and the fluence reduction, Poisson noise, Gaussian noise and variance
+normalization are fused into a few in-place array operations. All random
+draws come from an explicit numpy.random.Generator.
+
+    rng = np.random.default_rng(0)
+    x_train[ind] = add_noise(f['photons'][0:len(ind)], rng=rng)
+
+"""
+import time
+
+import numpy as np
+
+
+def _as_generator(rng):
+    return rng if isinstance(rng, np.random.Generator) else np.random.default_rng(rng)
+
+
+def random_affine_matrices(n, rotation_range=360, zoom_range=(0.9, 1.1), flips=True, rng=None):
+    """
+    Draws the 2x2 matrices mapping output pixel coordinates to input coordinates, relative to the image centre.
+
+    The transformations follow addNoise(): a rotation by an angle drawn uniformly from
+    (-rotation_range, rotation_range) degrees, left-right and up-down flips with probability 0.5 each,
+    and independent row and column zoom factors drawn uniformly from zoom_range, as in
+    tf.keras.preprocessing.image.random_zoom.
+
+    Return
+    ------
+    numpy.array of shape (n, 2, 2) acting on (row, column) coordinates.
+    """
+    rng = _as_generator(rng)
+    theta = np.deg2rad(rng.uniform(-rotation_range, rotation_range, n))
+    cos, sin = np.cos(theta), np.sin(theta)
+    rotation = np.stack([np.stack([cos, -sin], axis=1), np.stack([sin, cos], axis=1)], axis=1)
+
+    flip = np.ones((n, 2))
+    if flips:
+        flip = np.where(rng.random((n, 2)) < 0.5, -1.0, 1.0)
+    zoom = rng.uniform(zoom_range[0], zoom_range[1], (n, 2))
+
+    # Output pixel -> zoom -> flips -> rotation -> input pixel.
+    return rotation * (flip * zoom)[:, None, :]
+
+
+def affine_warp(images, matrices):
+    """
+    Warps a batch of images with per-image affine matrices using bilinear interpolation.
+
+    Pixels sampled from outside the image are 0, as with fill_mode='constant', cval=0.0 in addNoise().
+
+    Parameters
+    ----------
+    images: numpy.array
+        Shape (N, H, W).
+    matrices: numpy.array
+        Shape (N, 2, 2), mapping centred output (row, column) coordinates to input coordinates.
+
+    Return
+    ------
+    float32 numpy.array of shape (N, H, W).
+    """
+    images = np.asarray(images, dtype=np.float32)
+    n, h, w = images.shape
+    centre = np.array([h / 2 - 0.5, w / 2 - 0.5], dtype=np.float32)
+    rows, cols = np.meshgrid(np.arange(h, dtype=np.float32) - centre[0],
+                             np.arange(w, dtype=np.float32) - centre[1], indexing='ij')
+    grid = np.stack([rows.ravel(), cols.ravel()])                                   # (2, H*W)
+    coords = np.matmul(matrices.astype(np.float32), grid) + centre[None, :, None]   # (N, 2, H*W)
+
+    # Pad with one row/column of zeros before and two after, and clamp the coordinates to [-1, size]:
+    # every bilinear neighbour then falls inside the padded image, and those outside the original
+    # image read zeros, without masking.
+    padded = np.zeros((n, h + 3, w + 3), dtype=np.float32)
+    padded[:, 1:h + 1, 1:w + 1] = images
+    r = np.clip(coords[:, 0], -1, h) + 1
+    c = np.clip(coords[:, 1], -1, w) + 1
+    r0, c0 = np.floor(r), np.floor(c)
+    fr, fc = r - r0, c - c0
+    stride = w + 3
+    index = (np.arange(n) * ((h + 3) * stride))[:, None] + r0.astype(np.intp) * stride + c0.astype(np.intp)
+
+    flat = padded.reshape(-1)
+    top = flat[index] + fc * (flat[index + 1] - flat[index])
+    bottom = flat[index + stride] + fc * (flat[index + stride + 1] - flat[index + stride])
+    out = top + fr * (bottom - top)
+    return out.reshape(n, h, w)
+
+
+def apply_noise(images, fluence_reduction_factor=100, flux_jitter=0.9, gaussian_noise=0.15, rng=None):
+    """
+    Reduces the fluence with flux jitter, then adds Poisson and Gaussian noise and variance-normalizes each image.
+
+    Same noise model as addNoise(): every image is scaled by alpha / fluence_reduction_factor with
+    alpha ~ N(1, flux_jitter) (0.1 when alpha <= 0), Poisson-sampled, offset by Gaussian noise of
+    standard deviation gaussian_noise and normalized to mean 0 and variance 1 (all zeros if constant).
+
+    Return
+    ------
+    float32 numpy.array of the same shape as images.
+    """
+    rng = _as_generator(rng)
+    images = np.asarray(images, dtype=np.float32)
+    n = len(images)
+    alpha = rng.normal(1, flux_jitter, n)
+    alpha[alpha <= 0] = 0.1
+    scale = (alpha / fluence_reduction_factor).astype(np.float32).reshape((n,) + (1,) * (images.ndim - 1))
+
+    out = rng.poisson(images * scale).astype(np.float32)
+    out += gaussian_noise * rng.standard_normal(out.shape, dtype=np.float32)
+
+    axes = tuple(range(1, out.ndim))
+    mean = out.mean(axis=axes, keepdims=True)
+    std = out.std(axis=axes, keepdims=True)
+    out -= mean
+    # Constant images are all zeros after subtracting the mean and are left as is.
+    np.divide(out, std, out=out, where=std > 0)
+    return out
+
+
+def add_noise(images, fluence_reduction_factor=100, flux_jitter=0.9, gaussian_noise=0.15,
+              rotation_range=360, zoom_range=(0.9, 1.1), flips=True, rng=None):
+    """
+    Adds augmentations and noise to a batch of diffraction images.
+
+    Vectorized equivalent of addNoise() in examples/twin_network_for_diffraction.ipynb.
+    Unlike addNoise(), the input batch is not modified.
+
+    Parameters
+    ----------
+    images: numpy.array
+        Batch of diffraction images, shape (N, H, W).
+    fluence_reduction_factor: float
+        Factor by which the fluence of the images is reduced.
+    flux_jitter: float
+        Flux jitter to include when reducing fluence of images.
+    gaussian_noise: float
+        Sigma of the Gaussian noise.
+    rotation_range: float
+        Rotations are drawn uniformly from (-rotation_range, rotation_range) degrees.
+    zoom_range: tuple(float, float)
+        Range of the zoom factors.
+    flips: bool
+        If True, apply random left-right and up-down flips.
+    rng: numpy.random.Generator or int (optional)
+        Source of randomness, or a seed for one.
+
+    Return
+    ------
+    float32 numpy.array of shape (N, H, W).
+    """
+    rng = _as_generator(rng)
+    images = np.asarray(images, dtype=np.float32)
+    warped = affine_warp(images, random_affine_matrices(len(images), rotation_range, zoom_range, flips, rng))
+    return apply_noise(warped, fluence_reduction_factor, flux_jitter, gaussian_noise, rng)
+
+
+def add_noise_per_image(orig_img, fluence_reduction_factor=100, flux_jitter=0.9, gaussian_noise=0.15):
+    """
+    addNoise() from examples/twin_network_for_diffraction.ipynb, kept as the reference for benchmark().
+
+    Requires tensorflow and draws from the global NumPy and TensorFlow random states.
+    """
+    import tensorflow as tf
+
+    def transform(img):
+        img = tf.keras.preprocessing.image.random_rotation(x=img[:, :, None], rg=360, row_axis=0, col_axis=1,
+                                                           channel_axis=2, fill_mode='constant', cval=0.0)
+        img = tf.image.random_flip_left_right(img).numpy()
+        img = tf.image.random_flip_up_down(img).numpy()
+        img = tf.keras.preprocessing.image.random_zoom(x=img, zoom_range=(0.9, 1.1), row_axis=0, col_axis=1,
+                                                       channel_axis=2, fill_mode='constant', cval=0.0)
+        img = np.squeeze(img)
+
+        alpha = np.random.normal(1, flux_jitter)
+        if alpha <= 0:
+            alpha = 0.1
+        img = alpha * np.sum(img) / fluence_reduction_factor * (img / np.sum(img))
+        img = np.random.poisson(img)
+        img = img + gaussian_noise * np.random.randn(*img.shape)
+        std = np.std(img)
+        return np.zeros_like(img) if std == 0 else (img - np.mean(img)) / std
+
+    for i in range(orig_img.shape[0]):
+        orig_img[i] = transform(orig_img[i])
+    return orig_img
+
+
+def benchmark(images, batch_size=64, repeats=3, reference=True, seed=0):
+    """
+    Measures images/s of add_noise() and, if reference is True, of add_noise_per_image().
+
+    Parameters
+    ----------
+    images: numpy.array
+        Pool of (N, H, W) images; batches are cut from its start.
+    batch_size: int
+        Images per call.
+    repeats: int
+        Timed calls per implementation; the best is reported.
+    reference: bool
+        Also time the per-image reference (requires tensorflow).
+    seed: int
+        Seed for add_noise().
+
+    Return
+    ------
+    dict with 'batched' and, if measured, 'per_image' images/s, and their 'speedup'.
+    """
+    batch = np.ascontiguousarray(images[:batch_size], dtype=np.float32)
+    rng = np.random.default_rng(seed)
+
+    def images_per_sec(fn):
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn(batch.copy())
+            timings.append(time.perf_counter() - start)
+        return len(batch) / min(timings)
+
+    results = {'batched': images_per_sec(lambda x: add_noise(x, rng=rng))}
+    if reference:
+        results['per_image'] = images_per_sec(add_noise_per_image)
+        results['speedup'] = results['batched'] / results['per_image']
+    return results
@@ -0,0 +1,250 @@
+"""
+
+Generates the multi-hit thumbnail training corpus with skopi across a process pool.
+
+Every worker process builds one Simulator, which keeps the beam, detector,
+detector mask, and a particle and SPIExperiment per PDB and particle count,
+so they are set up once per worker rather than once per image as in
+utils.img_to_thumbnail(). The work is split into chunks of frames, each
+simulated with its own seed, derived from the base seed and the (particle,
+count, chunk) it belongs to: the corpus is the same for any number of
+workers. The main process writes the thumbnails as they arrive into one
+chunked HDF5 file per particle and count, named by training.thumbnail_file():
+
+    {output_dir}/SPI_{particle}_{n}k_{count}_thumbnail.h5      (the exact count if n is not a multiple of 1000)
+        photons            (N, H, W) float32 thumbnails
+        attrs: particle, count, n_part_per_shot, seed
+
+Example
+-------
+    python dataset_generator.py --pdb-dir ./pdbs --beam-file amo86615.beam --output-dir ./thumbnails \
+        --detector 1024 0.1 0.2 --workers 32
+
+"""
+import argparse
+import contextlib
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import h5py
+import numpy as np
+import skopi as sk
+
+from pdb_cache import read_pdb
+from utils import downsample
+
+# The particles, counts and file names of the datasets are those the training pipeline in resnet/ reads.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resnet'))
+from training import PARTICLES, COUNTS, thumbnail_file
+
+
+N_PART_PER_SHOT = {'single': 1, 'double': 2, 'triple': 3, 'quadruple': 4}
+
+# Held while a simulation uses NumPy's global RNG, so simulations in threads of one process do not interleave.
+GLOBAL_RNG_LOCK = threading.Lock()
+
+
+@contextlib.contextmanager
+def seeded_global_rng(seed):
+    """
+    Seeds NumPy's global RNG for the draws inside the block, holding GLOBAL_RNG_LOCK, and then
+    restores the state it had before, so the caller's own random stream carries on unchanged.
+    """
+    with GLOBAL_RNG_LOCK:
+        state = np.random.get_state()
+        np.random.seed(seed)
+        try:
+            yield
+        finally:
+            np.random.set_state(state)
+
+
+def output_file(output_dir, particle, count, n):
+    """ Path of the dataset of n thumbnails; see training.thumbnail_file(). """
+    return thumbnail_file(output_dir, particle, count, n)
+
+
+def chunk_seed(seed, particle_index, count_index, chunk_index):
+    """ Seed of one chunk of frames, independent of which worker simulates it. """
+    return int(np.random.SeedSequence(seed, spawn_key=(particle_index, count_index, chunk_index))
+               .generate_state(1)[0])
+
+
+class Simulator:
+    """
+    Simulates thumbnails with skopi, reusing the beam, detector, particles and experiments between calls.
+    """
+
+    def __init__(self, pdb_files, beam_file, detector_dimensions, thumbnail_shape=(128, 128), increase_factor=1000):
+        """
+        Parameters
+        ----------
+        pdb_files: dict(str, str)
+            Path of the PDB file of each particle.
+        beam_file: str
+            Path to the beam file.
+        detector_dimensions: tuple(int, float, float)
+            (num pixels for row and col, detector size, detector distance), as in utils.img_to_thumbnail().
+        thumbnail_shape: tuple(int, int)
+            Shape of the thumbnails; must divide the detector shape.
+        increase_factor: int
+            Multiplies the number of photons/pulse, as in utils.img_to_thumbnail().
+        """
+        n_pixels, det_size, det_dist = detector_dimensions
+        self.pdb_files = pdb_files
+        self.beam = sk.Beam(beam_file)
+        self.beam.set_photons_per_pulse(increase_factor * self.beam.get_photons_per_pulse())
+        self.det = sk.SimpleSquareDetector(int(n_pixels), float(det_size), float(det_dist), beam=self.beam)
+        self.mask = self.det.assemble_image_stack(np.ones(self.det.shape))
+        self.bins = (self.mask.shape[0] // thumbnail_shape[0], self.mask.shape[1] // thumbnail_shape[1])
+        self._particles = {}
+        self._experiments = {}
+
+    def experiment(self, particle, n_part_per_shot):
+        """ SPIExperiment of n_part_per_shot copies of particle, created on first use. """
+        key = (particle, n_part_per_shot)
+        if key not in self._experiments:
+            if particle not in self._particles:
+                self._particles[particle] = read_pdb(self.pdb_files[particle], ff='WK')
+            self._experiments[key] = sk.SPIExperiment(self.det, self.beam, self._particles[particle], n_part_per_shot)
+        return self._experiments[key]
+
+    def simulate(self, particle, n_part_per_shot, n, seed):
+        """
+        Simulates n thumbnails of n_part_per_shot particles per shot.
+
+        skopi draws orientations and positions from NumPy's global RNG, which is seeded with seed
+        inside seeded_global_rng(); the caller's RNG state is restored afterwards.
+
+        Return
+        ------
+        numpy.array of shape (n, H, W), float32.
+        """
+        experiment = self.experiment(particle, n_part_per_shot)
+        thumbnails = np.empty((n,) + (self.mask.shape[0] // self.bins[0], self.mask.shape[1] // self.bins[1]),
+                              dtype=np.float32)
+        with seeded_global_rng(seed):
+            for i in range(n):
+                pattern = experiment.generate_image_stack(return_photons=True, return_intensities=False)
+                thumbnails[i] = downsample(self.det.assemble_image_stack(pattern), bin_row=self.bins[0],
+                                           bin_col=self.bins[1], mask=self.mask)
+        return thumbnails
+
+
+# The Simulator of a worker process, built once by _init_worker().
+_simulator = None
+
+
+def _init_worker(simulator_cls, kwargs):
+    global _simulator
+    _simulator = simulator_cls(**kwargs)
+
+
+def _simulate_chunk(task):
+    particle, count, start, n, seed = task
+    return particle, count, start, _simulator.simulate(particle, N_PART_PER_SHOT[count], n, seed)
+
+
+def generate(pdb_files, beam_file, detector_dimensions, output_dir, particles=PARTICLES, counts=COUNTS,
+             n_single=4000, n_multi=1000, thumbnail_shape=(128, 128), increase_factor=1000, chunk_size=50,
+             workers=None, seed=0, simulator_cls=Simulator, verbose=False):
+    """
+    Simulates the thumbnail datasets of every particle and count in a process pool.
+
+    Parameters
+    ----------
+    pdb_files: dict(str, str)
+        Path of the PDB file of each particle.
+    beam_file: str
+        Path to the beam file.
+    detector_dimensions: tuple(int, float, float)
+        See Simulator.
+    output_dir: str
+        Directory the datasets are written to.
+    particles: list(str)
+        PDB IDs to simulate.
+    counts: list(str)
+        Count types to simulate, keys of N_PART_PER_SHOT.
+    n_single, n_multi: int
+        Thumbnails per single-hit and per multi-hit dataset.
+    thumbnail_shape: tuple(int, int)
+        Shape of the thumbnails.
+    increase_factor: int
+        See Simulator.
+    chunk_size: int
+        Frames per task, and rows per HDF5 chunk.
+    workers: int (optional)
+        Worker processes; defaults to the number of CPUs.
+    seed: int
+        Base seed of the corpus.
+    simulator_cls: type
+        Class built once per worker with Simulator's arguments; its simulate() produces the thumbnails.
+    verbose: bool
+        Print progress.
+
+    Return
+    ------
+    dict mapping (particle, count) to the path of its dataset.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    simulator_kwargs = {'pdb_files': pdb_files, 'beam_file': beam_file, 'detector_dimensions': detector_dimensions,
+                        'thumbnail_shape': thumbnail_shape, 'increase_factor': increase_factor}
+
+    files, tasks = {}, []
+    for i, particle in enumerate(particles):
+        for j, count in enumerate(counts):
+            n = n_single if count == 'single' else n_multi
+            path = output_file(output_dir, particle, count, n)
+            with h5py.File(path, 'w') as f:
+                f.create_dataset('photons', shape=(n,) + tuple(thumbnail_shape), dtype=np.float32,
+                                 chunks=(min(chunk_size, n),) + tuple(thumbnail_shape))
+                f.attrs.update({'particle': particle, 'count': count, 'n_part_per_shot': N_PART_PER_SHOT[count],
+                                'seed': seed})
+            files[(particle, count)] = path
+            for k, start in enumerate(range(0, n, chunk_size)):
+                tasks.append((particle, count, start, min(chunk_size, n - start), chunk_seed(seed, i, j, k)))
+
+    start_time = time.time()
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(simulator_cls, simulator_kwargs)) as pool:
+        futures = [pool.submit(_simulate_chunk, task) for task in tasks]
+        for future in as_completed(futures):
+            particle, count, start, thumbnails = future.result()
+            with h5py.File(files[(particle, count)], 'r+') as f:
+                f['photons'][start:start + len(thumbnails)] = thumbnails
+            done += len(thumbnails)
+            if verbose:
+                elapsed = time.time() - start_time
+                print('{} {}: frames {}-{} ({:.1f} frames/s)'.format(
+                    particle, count, start, start + len(thumbnails), done / elapsed))
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate the multi-hit thumbnail datasets with skopi.')
+    parser.add_argument('--pdb-dir', required=True, help='Directory with a {pdb_id}.pdb file per particle.')
+    parser.add_argument('--beam-file', required=True)
+    parser.add_argument('--output-dir', required=True)
+    parser.add_argument('--detector', type=float, nargs=3, required=True, metavar=('N_PIXELS', 'SIZE', 'DISTANCE'))
+    parser.add_argument('--particles', nargs='+', default=PARTICLES)
+    parser.add_argument('--counts', nargs='+', default=COUNTS, choices=COUNTS)
+    parser.add_argument('--n-single', type=int, default=4000)
+    parser.add_argument('--n-multi', type=int, default=1000)
+    parser.add_argument('--thumbnail-shape', type=int, nargs=2, default=(128, 128))
+    parser.add_argument('--chunk-size', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    pdb_files = {p: os.path.join(args.pdb_dir, p + '.pdb') for p in args.particles}
+    generate(pdb_files, args.beam_file, tuple(args.detector), args.output_dir, args.particles, args.counts,
+             args.n_single, args.n_multi, tuple(args.thumbnail_shape), chunk_size=args.chunk_size,
+             workers=args.workers, seed=args.seed, verbose=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+"""
+
+Approximate nearest-neighbour index over twin network embeddings.
+
+EmbeddingIndex keeps embeddings in a float32 memory-mapped matrix and
+partitions them with an inverted file (IVF): k-means centroids split the
+vectors into nlist lists, and a query only scans the nprobe lists whose
+centroids are closest. Vectors added after training are appended to their
+nearest list, so the index grows without being rebuilt.
+
+    index = build_index(embedding_model, x_train, y_train, path='./index')
+    distances, ids = index.search(embedding_model.predict(x_query), k=5)
+    labels = index.classify(embedding_model.predict(x_query), k=5)
+
+Distances are squared Euclidean distances, the ranking used by
+compute_dist() in examples/twin_network_one_shot.ipynb.
+
+"""
+import os
+import time
+
+import numpy as np
+
+
+def _squared_distances(queries, vectors, vector_norms=None):
+    """ (Q, N) squared Euclidean distances from one matrix product. """
+    if vector_norms is None:
+        vector_norms = np.einsum('ij,ij->i', vectors, vectors)
+    d = np.einsum('ij,ij->i', queries, queries)[:, None] + vector_norms[None, :] - 2 * (queries @ vectors.T)
+    return np.maximum(d, 0, out=d)
+
+
+def _merge_top_k(best_d, best_i, d, ids, k):
+    """ Merges candidate distances d (Q, M) with ids (M,) into the running top-k (best_d, best_i), both (Q, k). """
+    all_d = np.concatenate([best_d, d], axis=1)
+    all_i = np.concatenate([best_i, np.broadcast_to(ids, d.shape)], axis=1)
+    if all_d.shape[1] > k:
+        keep = np.argpartition(all_d, k - 1, axis=1)[:, :k]
+        all_d = np.take_along_axis(all_d, keep, axis=1)
+        all_i = np.take_along_axis(all_i, keep, axis=1)
+    return all_d, all_i
+
+
+def _sort_top_k(best_d, best_i):
+    order = np.argsort(best_d, axis=1, kind='stable')
+    return np.take_along_axis(best_d, order, axis=1), np.take_along_axis(best_i, order, axis=1)
+
+
+def _nearest(x, centroids, chunk_size=16384):
+    """ Index of the nearest centroid of each row of x, computed chunk by chunk to bound memory. """
+    return np.concatenate([_squared_distances(x[start:start + chunk_size], centroids).argmin(axis=1)
+                           for start in range(0, len(x), chunk_size)])
+
+
+def kmeans(x, k, iterations=10, seed=0):
+    """
+    Lloyd's k-means with the assignment step done as matrix products.
+
+    Empty clusters are re-seeded with random points.
+
+    Return
+    ------
+    numpy.array of shape (k, dim) with the centroids.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _nearest(x, centroids)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.stack([np.bincount(assignment, weights=x[:, j], minlength=k) for j in range(x.shape[1])], axis=1)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        centroids[empty] = x[rng.choice(len(x), empty.sum(), replace=False)]
+    return centroids
+
+
+class EmbeddingIndex:
+    """
+    IVF index over float32 embeddings stored in a memory-mapped matrix.
+    """
+
+    VECTORS = 'vectors.npy'
+    META = 'meta.npz'
+
+    def __init__(self, dim, path=None, capacity=1024):
+        """
+        Parameters
+        ----------
+        dim: int
+            Embedding size.
+        path: str (optional)
+            Directory holding the index. The vectors are memory-mapped from path/vectors.npy;
+            without a path they are kept in memory.
+        capacity: int
+            Initial number of rows allocated; the matrix doubles whenever it is full.
+        """
+        self.dim = dim
+        self.path = path
+        self.size = 0
+        self.labels = np.zeros(capacity, dtype=np.int64)
+        self.norms = np.zeros(capacity, dtype=np.float32)
+        self.centroids = None
+        self.lists = []
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+        self.vectors = self._allocate(capacity)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nlist(self):
+        return 0 if self.centroids is None else len(self.centroids)
+
+    def _allocate(self, capacity):
+        if self.path is None:
+            return np.zeros((capacity, self.dim), dtype=np.float32)
+        return np.lib.format.open_memmap(os.path.join(self.path, self.VECTORS), mode='w+',
+                                         dtype=np.float32, shape=(capacity, self.dim))
+
+    def _grow(self, capacity):
+        """ Reallocates the vector matrix with room for capacity rows, copying the stored vectors. """
+        old = self.vectors
+        if self.path is None:
+            self.vectors = self._allocate(capacity)
+            self.vectors[:self.size] = old[:self.size]
+        else:
+            target = os.path.join(self.path, self.VECTORS)
+            tmp = target + '.tmp'
+            grown = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=(capacity, self.dim))
+            grown[:self.size] = old[:self.size]
+            grown.flush()
+            del old, grown
+            os.replace(tmp, target)
+            self.vectors = np.load(target, mmap_mode='r+')
+        self.labels = np.resize(self.labels, capacity)
+        self.norms = np.resize(self.norms, capacity)
+
+    def add(self, vectors, labels=None):
+        """
+        Appends vectors to the index. If the index is trained, each vector joins the list of its nearest centroid.
+
+        Parameters
+        ----------
+        vectors: numpy.array
+            Shape (N, dim).
+        labels: numpy.array (optional)
+            Integer label of each vector, e.g. its particle index. Defaults to -1.
+
+        Return
+        ------
+        numpy.array with the ids of the new vectors.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        n = len(vectors)
+        if self.size + n > len(self.vectors):
+            capacity = len(self.vectors)
+            while capacity < self.size + n:
+                capacity *= 2
+            self._grow(capacity)
+
+        ids = np.arange(self.size, self.size + n)
+        self.vectors[ids] = vectors
+        self.labels[ids] = -1 if labels is None else np.asarray(labels)
+        self.norms[ids] = np.einsum('ij,ij->i', vectors, vectors)
+        self.size += n
+
+        if self.centroids is not None:
+            self._assign(ids, vectors)
+        return ids
+
+    def _assign(self, ids, vectors):
+        assignment = _nearest(vectors, self.centroids)
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(self.nlist + 1))
+        for l in np.unique(assignment):
+            self.lists[l] = np.concatenate([self.lists[l], ids[order[bounds[l]:bounds[l + 1]]]])
+
+    def train(self, nlist=None, sample_size=None, iterations=10, seed=0):
+        """
+        Clusters the stored vectors into nlist partitions and rebuilds the inverted lists.
+
+        Parameters
+        ----------
+        nlist: int (optional)
+            Number of partitions. Defaults to 4 * sqrt(len(self)).
+        sample_size: int (optional)
+            Vectors used to fit the centroids. Defaults to 64 * nlist.
+        iterations: int
+            k-means iterations.
+        seed: int
+            Seed for the sample and the initial centroids.
+        """
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(self.size)))
+        if nlist > self.size:
+            raise ValueError('Cannot train {} partitions on {} vectors'.format(nlist, self.size))
+        sample_size = min(self.size, sample_size or 64 * nlist)
+        sample = np.sort(np.random.default_rng(seed).choice(self.size, sample_size, replace=False))
+        self.centroids = kmeans(np.asarray(self.vectors[sample]), nlist, iterations, seed)
+        self.lists = [np.zeros(0, dtype=np.int64) for _ in range(nlist)]
+        for start in range(0, self.size, 65536):
+            ids = np.arange(start, min(start + 65536, self.size))
+            self._assign(ids, np.asarray(self.vectors[ids]))
+
+    def search_exact(self, queries, k=10, chunk_size=65536):
+        """
+        Brute-force k-nearest-neighbour search, scanning the stored vectors in chunks.
+
+        Return
+        ------
+        distances: numpy.array
+            Squared distances of shape (Q, k), nearest first.
+        ids: numpy.array
+            Ids of the neighbours, shape (Q, k).
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        k = min(k, self.size)
+        best_d = np.empty((len(queries), 0), dtype=np.float32)
+        best_i = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, self.size, chunk_size):
+            stop = min(start + chunk_size, self.size)
+            d = _squared_distances(queries, np.asarray(self.vectors[start:stop]), self.norms[start:stop])
+            best_d, best_i = _merge_top_k(best_d, best_i, d, np.arange(start, stop), k)
+        return _sort_top_k(best_d, best_i)
+
+    def search(self, queries, k=10, nprobe=8):
+        """
+        Approximate k-nearest-neighbour search over the nprobe partitions closest to each query.
+
+        Queries are grouped by partition so each probed list is read and compared
+        against all of its queries at once. An untrained index falls back to search_exact().
+
+        Return
+        ------
+        distances: numpy.array
+            Squared distances of shape (Q, k), nearest first; inf where fewer than k vectors were scanned.
+        ids: numpy.array
+            Ids of the neighbours, shape (Q, k); -1 where fewer than k vectors were scanned.
+        """
+        if self.centroids is None:
+            return self.search_exact(queries, k)
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        nprobe = min(nprobe, self.nlist)
+        probes = np.argpartition(_squared_distances(queries, self.centroids), nprobe - 1, axis=1)[:, :nprobe]
+
+        best_d = np.full((len(queries), k), np.inf, dtype=np.float32)
+        best_i = np.full((len(queries), k), -1, dtype=np.int64)
+        query_of = np.repeat(np.arange(len(queries)), nprobe)
+        probes = probes.ravel()
+        order = np.argsort(probes, kind='stable')
+        bounds = np.searchsorted(probes[order], np.arange(self.nlist + 1))
+        for l in np.unique(probes):
+            ids = self.lists[l]
+            if len(ids) == 0:
+                continue
+            q = query_of[order[bounds[l]:bounds[l + 1]]]
+            d = _squared_distances(queries[q], np.asarray(self.vectors[ids]), self.norms[ids])
+            best_d[q], best_i[q] = _merge_top_k(best_d[q], best_i[q], d, ids, k)
+        return _sort_top_k(best_d, best_i)
+
+    def classify(self, queries, k=5, nprobe=8):
+        """ Predicts the label of each query by majority vote among its k nearest neighbours. """
+        _, ids = self.search(queries, k, nprobe)
+        votes = np.where(ids >= 0, self.labels[np.maximum(ids, 0)], -1)
+        predictions = np.empty(len(votes), dtype=np.int64)
+        for i, row in enumerate(votes):
+            values, counts = np.unique(row[row >= 0], return_counts=True)
+            predictions[i] = values[counts.argmax()] if len(values) else -1
+        return predictions
+
+    def save(self):
+        """ Flushes the vectors and writes the labels, centroids and inverted lists next to them. """
+        if self.path is None:
+            raise ValueError('An in-memory index has no path to save to.')
+        self.vectors.flush()
+        lengths = np.array([len(ids) for ids in self.lists], dtype=np.int64)
+        lists = np.concatenate(self.lists) if self.lists else np.zeros(0, dtype=np.int64)
+        meta = {'size': self.size, 'labels': self.labels[:self.size], 'list_lengths': lengths, 'lists': lists}
+        if self.centroids is not None:
+            meta['centroids'] = self.centroids
+        tmp = os.path.join(self.path, 'meta.tmp.npz')
+        np.savez(tmp, **meta)
+        os.replace(tmp, os.path.join(self.path, self.META))
+
+    @classmethod
+    def open(cls, path):
+        """ Opens an index written by save(); the vectors stay memory-mapped. """
+        vectors = np.load(os.path.join(path, cls.VECTORS), mmap_mode='r+')
+        meta = np.load(os.path.join(path, cls.META))
+        index = cls.__new__(cls)
+        index.dim = vectors.shape[1]
+        index.path = path
+        index.vectors = vectors
+        index.size = int(meta['size'])
+        index.labels = np.resize(meta['labels'], len(vectors))
+        index.norms = np.zeros(len(vectors), dtype=np.float32)
+        for start in range(0, index.size, 65536):
+            chunk = np.asarray(vectors[start:min(start + 65536, index.size)])
+            index.norms[start:start + len(chunk)] = np.einsum('ij,ij->i', chunk, chunk)
+        index.centroids = meta['centroids'] if 'centroids' in meta else None
+        index.lists = np.split(meta['lists'], np.cumsum(meta['list_lengths'])[:-1]) if index.centroids is not None else []
+        return index
+
+
+def embed(embedding_model, x, batch_size=1024):
+    """ Runs embedding_model (a Keras model or any callable) over x in batches and returns float32 embeddings. """
+    predict = getattr(embedding_model, 'predict', None)
+    chunks = []
+    for start in range(0, len(x), batch_size):
+        batch = x[start:start + batch_size]
+        out = predict(batch, verbose=0) if predict is not None else embedding_model(batch)
+        chunks.append(np.asarray(out, dtype=np.float32))
+    return np.concatenate(chunks)
+
+
+def build_index(embedding_model, x, labels=None, path=None, nlist=None, batch_size=1024):
+    """
+    Embeds x with embedding_model and returns a trained EmbeddingIndex over the embeddings.
+
+    Parameters
+    ----------
+    embedding_model: tf.keras.Model or callable
+        The twin network's embedding_model.
+    x: numpy.array
+        Vectorized images.
+    labels: numpy.array (optional)
+        Label of each image.
+    path: str (optional)
+        Directory for the memory-mapped index; it is saved there after training.
+    nlist: int (optional)
+        Number of partitions, see EmbeddingIndex.train().
+    batch_size: int
+        Images embedded at once.
+    """
+    index = None
+    for start in range(0, len(x), batch_size):
+        vectors = embed(embedding_model, x[start:start + batch_size], batch_size)
+        if index is None:
+            index = EmbeddingIndex(vectors.shape[1], path, capacity=len(x))
+        index.add(vectors, None if labels is None else labels[start:start + batch_size])
+    index.train(nlist)
+    if path is not None:
+        index.save()
+    return index
+
+
+def recall_curve(index, queries, k=10, nprobes=(1, 2, 4, 8, 16, 32, 64)):
+    """
+    Measures recall@k and latency of index.search() against search_exact() for several nprobe values.
+
+    Return
+    ------
+    List of dicts with 'nprobe', 'recall', 'latency_ms' (per query) and 'exact_latency_ms' (per query).
+    """
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    start = time.perf_counter()
+    _, exact = index.search_exact(queries, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    results = []
+    for nprobe in nprobes:
+        if nprobe > index.nlist:
+            break
+        start = time.perf_counter()
+        _, ids = index.search(queries, k, nprobe)
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        hits = sum(len(np.intersect1d(a, b)) for a, b in zip(ids, exact))
+        results.append({'nprobe': nprobe, 'recall': hits / exact.size, 'latency_ms': latency_ms,
+                        'exact_latency_ms': exact_ms})
+    return results
@@ -4,30 +4,40 @@ import matplotlib.pyplot as plt
 import pdbGenerator as pg
 import pypdb
 import skopi as sk
+from pdb_cache import read_pdb
 
 showPlot = 0
 maxPDBs = 30000
 outdir = "/reg/data/ana03/scratch/yoon82/Software/DeepProjection/DeepProjection/data"
+pdbIdList = os.path.join(outdir, "pdb_entry_type.txt") # local list of valid PDB IDs, one per line (RCSB holdings file)
+seed = 0 # seed of the order in which PDB IDs are drawn
 
-Pdb = pg.PDBGenerator()
+# Seeds are drawn without replacement from the ID list, skipping structures already simulated,
+# so no fetch is spent on invalid or repeated IDs.
+Pdb = pg.PDBGenerator(pg.load_pdb_ids(pdbIdList), seed=seed, exclude=pg.processed_pdb_ids(outdir))
 
 numPDBs = 0
 while numPDBs < maxPDBs:
     # Search PDB by structure similarity
     found_pdbs = None
     while not found_pdbs:
-        randPDB, pfile = Pdb.get_random_pdb()
-        if not os.path.exists(os.path.join(outdir,randPDB+".npz")):
-            try:
-                found_pdbs = pypdb.Query(randPDB, query_type="structure").search()
-            except:
-                pass
+        randPDB = Pdb.sample_pdb_ids(1)
+        if not randPDB:
+            break
+        try:
+            found_pdbs = pypdb.Query(randPDB[0], query_type="structure").search()
+        except:
+            pass
+    if not found_pdbs:
+        print("No PDB IDs left to sample")
+        break
     numNeighbors = 8
     if len(found_pdbs) < numNeighbors:
         numNeighbors = len(found_pdbs)
 
     # Fetch pdb file
     for i,val in enumerate(found_pdbs[:numNeighbors]):
+        Pdb.exclude([val]) # do not draw a simulated neighbor as a seed later
         if not os.path.exists(os.path.join(outdir,val+".npz")):
             print("fetching: ", val)
             try:
@@ -38,11 +48,10 @@ while numPDBs < maxPDBs:
                 print("Could not fetch pdb file: ", val)
                 continue
 
-        # Set up particle
-        particle = sk.Particle()
+        # Set up particle, parsed once and then loaded from the PDB cache
         if os.path.exists(os.path.join(outdir,val+".pdb")):
             try:
-                particle.read_pdb(os.path.join(outdir,val+".pdb"), ff='WK')
+                particle = read_pdb(os.path.join(outdir,val+".pdb"), ff='WK')
             except:
                 continue
         else:
@@ -6,10 +6,76 @@ import matplotlib.pyplot as plt
 import skopi as sk
 import pypdb 
 
+
+def load_pdb_ids(path):
+    """
+    Reads a local list of PDB IDs, one per line; only the first field of a line is used, so
+    RCSB holdings files such as pdb_entry_type.txt ("101m prot diffraction") can be read directly.
+    Empty lines and lines starting with '#' are skipped.
+
+    Return
+    ------
+    list of lower case PDB IDs
+    """
+    ids = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if fields and not fields[0].startswith('#'):
+                ids.append(fields[0].lower())
+    return ids
+
+
+def processed_pdb_ids(dir, ext='.npz'):
+    """ Returns the lower case PDB IDs of the {PDB ID}{ext} files in dir, e.g. the outputs of generateSAXS.py. """
+    if not os.path.isdir(dir):
+        return []
+    return [name[:-len(ext)].lower() for name in os.listdir(dir) if name.endswith(ext)]
+
+
 class PDBGenerator:
-    def __init__(self):
+    def __init__(self, pdb_ids=None, seed=None, exclude=()):
+       """
+       Parameters
+       ----------
+       pdb_ids : list of str
+           Local list of valid PDB IDs, e.g. from load_pdb_ids(). If given, random PDBs are
+           drawn uniformly from it without replacement; otherwise random IDs are guessed.
+
+       seed : int
+           Seed of the order in which pdb_ids are drawn.
+
+       exclude : iterable of str
+           PDB IDs never to draw, e.g. processed_pdb_ids(outdir).
+       """
        self.pdbID = None
        self.pdbFile = None
+       self.pdb_ids = None
+       self.excluded = set(pdb_id.lower() for pdb_id in exclude)
+       if pdb_ids is not None:
+           # Drawing the IDs of a random permutation in order samples without replacement
+           self.pdb_ids = np.random.RandomState(seed).permutation(np.asarray([pdb_id.lower() for pdb_id in pdb_ids], dtype=str))
+       self.cursor = 0
+
+    def exclude(self, pdb_ids):
+        # Never draw these IDs, e.g. the structures processed since the generator was created
+        self.excluded.update(pdb_id.lower() for pdb_id in pdb_ids)
+
+    def sample_pdb_ids(self, k=1):
+        """
+        Draws up to k PDB IDs from the local ID list, uniformly without replacement and
+        skipping excluded IDs. Fewer than k IDs are returned once the list is exhausted.
+        """
+        if self.pdb_ids is None:
+            raise ValueError('sample_pdb_ids() needs a local list of PDB IDs; see load_pdb_ids().')
+        sample = []
+        while len(sample) < k and self.cursor < len(self.pdb_ids):
+            pdb_id = str(self.pdb_ids[self.cursor])
+            self.cursor += 1
+            if pdb_id not in self.excluded:
+                self.excluded.add(pdb_id)
+                sample.append(pdb_id)
+        return sample
 
     def generate_pdb_id(self):
         # Randomly generate PDB ID (4 characters)
@@ -25,8 +91,35 @@ class PDBGenerator:
                      np.random.choice(alphanum)
         return self.pdbID
 
+    def fetch_pdbs(self, pdb_ids):
+        # Returns the (PDB ID, file) pairs of pdb_ids that could be downloaded, fetching each ID once
+        pdbs = []
+        for pdb_id in pdb_ids:
+            try:
+                pdbs.append((pdb_id, pypdb.get_pdb_file(pdb_id, filetype='pdb', compression=False)))
+            except:
+                print("Could not fetch pdb file:", pdb_id)
+        return pdbs
+
+    def get_random_pdbs(self, k):
+        # Returns a list of up to k (PDB ID, file) pairs drawn from the local ID list.
+        # IDs that fail to download are dropped, not retried.
+        return self.fetch_pdbs(self.sample_pdb_ids(k))
+
     def get_random_pdb(self):
-        # Returns a random but valid PDB ID and file
+        # Returns a random but valid PDB ID and file.
+        # With a local ID list, every fetch is of a listed ID, and (None, None) is returned once it is exhausted.
+        if self.pdb_ids is not None:
+            while 1:
+                pdb_id = self.sample_pdb_ids(1)
+                if not pdb_id:
+                    self.pdbID, self.pdbFile = None, None
+                    return self.pdbID, self.pdbFile
+                pdbs = self.fetch_pdbs(pdb_id)
+                if pdbs:
+                    self.pdbID, self.pdbFile = pdbs[0]
+                    return self.pdbID, self.pdbFile
+
         while 1:
             try:
                 self.pdbID = self.generate_pdb_id()
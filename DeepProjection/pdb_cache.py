@@ -0,0 +1,144 @@
+"""
+
+A cache of PDB structures parsed by skopi.
+
+sk.Particle.read_pdb() parses the text PDB file, applies its symmetry and
+computes the form-factor table on every call. read_pdb() here does that once
+per file content and force field: the arrays read_pdb() sets on the particle
+are stored as .npy files in a directory named by the SHA-256 of the PDB file
+and the force field, and later calls load them memory-mapped (copy-on-write,
+so particles can still be moved and rotated). Entries are written to a
+temporary directory and renamed into place, so a cache directory on a shared
+file system can be filled by many processes at once.
+
+    particle = read_pdb(pdb_file, ff='WK')          # parses and stores
+    particle = read_pdb(pdb_file, ff='WK')          # loads
+
+The cache directory is $DEEPPROJECTION_PDB_CACHE, or ~/.cache/deepprojection/pdb.
+
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import skopi as sk
+
+
+# Particle attributes set by sk.Particle.read_pdb(), by how they are stored.
+ARRAYS = ['atom_struct', 'atom_pos', 'at', 'split_idx', 'q_sample', 'compton_q_sample', 'sBound', 'nFree', 'ff_table']
+STRINGS = ['atomic_symbol', 'atomic_variant', 'residue']
+SCALARS = ['num_atom_types', 'num_q_samples', 'num_compton_q_samples']
+
+
+def file_hash(path, block_size=1 << 20):
+    """ SHA-256 hex digest of a file's content. """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class PDBCache:
+    """
+    Parsed structures stored as memory-mappable arrays, keyed by PDB file hash and force field.
+    """
+
+    def __init__(self, directory=None):
+        """
+        Parameters
+        ----------
+        directory: str (optional)
+            Cache directory. Defaults to $DEEPPROJECTION_PDB_CACHE or ~/.cache/deepprojection/pdb.
+        """
+        if directory is None:
+            directory = os.environ.get('DEEPPROJECTION_PDB_CACHE',
+                                       os.path.join(os.path.expanduser('~'), '.cache', 'deepprojection', 'pdb'))
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def entry(self, pdb_file, ff='WK'):
+        """ Directory of the cache entry of pdb_file parsed with force field ff. """
+        return os.path.join(self.directory, '{}_{}'.format(file_hash(pdb_file), ff))
+
+    def read_pdb(self, pdb_file, ff='WK'):
+        """
+        Returns an sk.Particle as sk.Particle().read_pdb(pdb_file, ff) would, parsing the file only on a cache miss.
+
+        Parameters
+        ----------
+        pdb_file: str
+            Path to PDB file.
+        ff: str
+            Form factor table, 'WK', 'pmi' or 'CM'.
+
+        Return
+        ------
+        particle: sk.Particle
+        """
+        entry = self.entry(pdb_file, ff)
+        if os.path.exists(os.path.join(entry, 'meta.json')):
+            self.hits += 1
+            return self._load(entry)
+        self.misses += 1
+        particle = sk.Particle()
+        particle.read_pdb(pdb_file, ff=ff)
+        self._store(entry, particle)
+        return particle
+
+    def _store(self, entry, particle):
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp_')
+        try:
+            for name in ARRAYS:
+                np.save(os.path.join(tmp, name + '.npy'), np.asarray(getattr(particle, name)))
+            for name in STRINGS:
+                np.save(os.path.join(tmp, name + '.npy'), np.asarray(getattr(particle, name), dtype=str))
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump({name: int(getattr(particle, name)) for name in SCALARS}, f)
+            os.rename(tmp, entry)
+        except OSError:
+            # Another process stored the same entry first.
+            if not os.path.exists(os.path.join(entry, 'meta.json')):
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def _load(self, entry):
+        particle = sk.Particle()
+        for name in ARRAYS:
+            setattr(particle, name, np.load(os.path.join(entry, name + '.npy'), mmap_mode='c'))
+        for name in STRINGS:
+            setattr(particle, name, np.load(os.path.join(entry, name + '.npy')).tolist())
+        with open(os.path.join(entry, 'meta.json')) as f:
+            for name, value in json.load(f).items():
+                setattr(particle, name, value)
+        return particle
+
+
+_default_cache = None
+
+
+def read_pdb(pdb_file, ff='WK', cache=None):
+    """
+    Reads a PDB file into an sk.Particle through a PDBCache (by default, one shared per process).
+
+    Parameters
+    ----------
+    pdb_file: str
+        Path to PDB file.
+    ff: str
+        Form factor table.
+    cache: PDBCache (optional)
+        Cache to use instead of the default one.
+    """
+    global _default_cache
+    if cache is None:
+        if _default_cache is None:
+            _default_cache = PDBCache()
+        cache = _default_cache
+    return cache.read_pdb(pdb_file, ff)
@@ -0,0 +1,153 @@
+"""
+
+Radial intensity profiles of diffraction frames on the q grid of the SAXS curves.
+
+A RadialProfile maps every pixel to a q bin once per detector geometry and
+then reduces whole (N, H, W) stacks with a single bincount (or sparse matrix
+product). The geometry is the SimpleSquareDetector of
+utils.calculate_maximum_diffraction_resolution(), and the bins are those of
+sk.SAXS, which generateSAXS.py stores: bin k holds |q| within half a bin
+width of k * 1e7 m^-1, and the profile's qs are the mean |q| of the pixels
+in each bin. Profile column k and index k of a stored 'qs'/'saxs' pair thus
+refer to the same q bin, up to the range the detector covers.
+
+Example
+-------
+    profile = RadialProfile.from_geometry('amo86615.beam', (1024, 0.1, 0.2), thumbnail_shape=(128, 128))
+    curves = profile(thumbnails)                            # (N, profile.num_bins)
+    saxs = np.load('1fpv.npz')
+    curves_on_saxs_grid = profile.on_grid(curves, saxs['qs'])
+
+"""
+import functools
+
+import numpy as np
+import skopi as sk
+
+from utils import downsample
+
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+
+# Width of the q bins of sk.SAXS, in m^-1.
+SAXS_BIN_WIDTH = 1e7
+
+
+class RadialProfile:
+    """
+    Mean intensity per q bin of a fixed detector geometry.
+    """
+
+    def __init__(self, q_map, mask=None, bin_width=SAXS_BIN_WIDTH):
+        """
+        Parameters
+        ----------
+        q_map: numpy.array
+            |q| of every pixel, in m^-1, shape (H, W).
+        mask: numpy.array (optional)
+            Pixel weights of shape (H, W); 0 excludes a pixel.
+        bin_width: float
+            q bin width, in m^-1; the default matches sk.SAXS.
+        """
+        self.shape = q_map.shape
+        self.bin_width = bin_width
+        weights = np.ones(q_map.size) if mask is None else np.asarray(mask, dtype=np.float64).ravel()
+        self.bins = np.rint(q_map.ravel() / bin_width).astype(np.int64)
+        self.num_bins = int(self.bins.max()) + 1
+        self.counts = np.bincount(self.bins, weights=weights, minlength=self.num_bins)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.qs = np.bincount(self.bins, weights=weights * q_map.ravel(), minlength=self.num_bins) / self.counts
+            # Weight of each pixel in the mean of its bin.
+            self.pixel_weights = np.where(self.counts[self.bins] > 0, weights / self.counts[self.bins], 0)
+        self._matrix = None
+
+    @classmethod
+    def from_detector(cls, det, binning=1, bin_width=SAXS_BIN_WIDTH):
+        """
+        Builds the profile of an sk.SimpleSquareDetector, optionally for images binned by
+        binning x binning pixels as in utils.img_to_thumbnail().
+        """
+        q_map = np.squeeze(det.pixel_distance_reciprocal)
+        if binning > 1:
+            q_map = downsample(q_map, binning, binning)
+        return cls(q_map, bin_width=bin_width)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def from_geometry(beam_file, detector_dimensions, thumbnail_shape=None, bin_width=SAXS_BIN_WIDTH):
+        """
+        Builds (once per geometry; later calls return the cached profile) the profile of the detector
+        utils.calculate_maximum_diffraction_resolution() sets up.
+
+        Parameters
+        ----------
+        beam_file: str
+            Path to beam file.
+        detector_dimensions: tuple(int, float, float)
+            (num pixels for row and col, detector size, detector distance).
+        thumbnail_shape: tuple(int, int) (optional)
+            Shape of the thumbnails the profiles are computed for; full detector frames if None.
+        bin_width: float
+            q bin width, in m^-1.
+        """
+        n_pixels, det_size, det_dist = detector_dimensions
+        beam = sk.Beam(beam_file)
+        det = sk.SimpleSquareDetector(int(n_pixels), float(det_size), float(det_dist), beam=beam)
+        binning = 1 if thumbnail_shape is None else int(n_pixels) // thumbnail_shape[0]
+        return RadialProfile.from_detector(det, binning, bin_width)
+
+    def matrix(self):
+        """ (H * W, num_bins) scipy.sparse matrix averaging pixels into bins. """
+        if self._matrix is None:
+            if scipy is None:
+                raise ImportError('The sparse method requires scipy.')
+            self._matrix = scipy.sparse.csr_matrix(
+                (self.pixel_weights, (np.arange(len(self.bins)), self.bins)), shape=(len(self.bins), self.num_bins))
+        return self._matrix
+
+    def __call__(self, frames, method='bincount'):
+        """
+        Computes the radial profiles of a stack of frames.
+
+        Parameters
+        ----------
+        frames: numpy.array
+            Frames of shape (N, H, W) (or (H, W) for one frame).
+        method: str
+            'bincount' (one bincount over all frames) or 'sparse' (one sparse matrix product).
+
+        Return
+        ------
+        numpy.array of shape (N, num_bins) (or (num_bins,)), NaN for bins without pixels.
+        """
+        frames = np.asarray(frames)
+        single = frames.ndim == 2
+        flat = frames.reshape(-1, len(self.bins))
+        if method == 'sparse':
+            profiles = np.asarray(self.matrix().T.dot(flat.T).T)
+        elif method == 'bincount':
+            n = len(flat)
+            index = (np.arange(n)[:, None] * self.num_bins + self.bins).ravel()
+            profiles = np.bincount(index, weights=(flat * self.pixel_weights).ravel(),
+                                   minlength=n * self.num_bins).reshape(n, self.num_bins)
+        else:
+            raise ValueError("method must be 'bincount' or 'sparse', got {}".format(method))
+        profiles[:, self.counts == 0] = np.nan
+        return profiles[0] if single else profiles
+
+    def on_grid(self, profiles, qs):
+        """
+        Picks the profile values at the bins of a stored SAXS 'qs' grid.
+
+        Return
+        ------
+        numpy.array of shape profiles.shape[:-1] + (len(qs),), NaN where qs is outside the detector's range.
+        """
+        bins = np.rint(np.asarray(qs) / self.bin_width).astype(np.int64)
+        inside = (bins >= 0) & (bins < self.num_bins)
+        out = np.full(np.shape(profiles)[:-1] + (len(bins),), np.nan)
+        out[..., inside] = np.asarray(profiles)[..., bins[inside]]
+        return out
@@ -0,0 +1,356 @@
+"""
+
+Checkpointing that does not stall training and resumes runs exactly.
+
+CheckpointManager snapshots the model, optimizer, scheduler, RNG states and
+data position on the training thread (a plain memory copy), then serializes
+the snapshot on a background thread to a temporary file that is renamed into
+place, so a crash mid-write never leaves a truncated checkpoint. Only the
+last keep_last checkpoints and the keep_best best by a validation metric are
+kept. ResumableSampler replays the same shuffled order from any position,
+and fit() ties both together:
+
+    manager = CheckpointManager(args.logdir, keep_last=3, keep_best=1)
+    fit(model, optimizer, train_set, epochs=20, manager=manager, valid_loader=valid_loader,
+        checkpoint_every=100)
+
+Running the same call again after a crash continues from the latest checkpoint.
+
+"""
+import json
+import os
+import queue
+import random
+import threading
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Sampler
+
+from training import train_one_epoch, evaluate
+
+
+def _snapshot(obj):
+    """ Deep copy of a (nested) state with every tensor detached and cloned to CPU. """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, _snapshot(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_snapshot(v) for v in obj)
+    return obj
+
+
+def rng_state():
+    """ RNG states of Python, NumPy and torch (and CUDA, if available). """
+    state = {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    """ Restores RNG states returned by rng_state(). """
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+class ResumableSampler(Sampler):
+    """
+    Shuffling sampler whose order depends only on (seed, epoch), so it can restart mid-epoch.
+    """
+
+    def __init__(self, data_source, shuffle=True, seed=0):
+        self.data_source = data_source
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    def __len__(self):
+        return len(self.data_source) - self.start
+
+    def __iter__(self):
+        n = len(self.data_source)
+        if self.shuffle:
+            order = torch.randperm(n, generator=torch.Generator().manual_seed(self.seed + self.epoch))
+        else:
+            order = torch.arange(n)
+        return iter(order[self.start:].tolist())
+
+    def set_epoch(self, epoch, start=0):
+        """ Positions the sampler at sample start of epoch. """
+        self.epoch = epoch
+        self.start = start
+
+    def state_dict(self):
+        return {'seed': self.seed, 'epoch': self.epoch, 'start': self.start}
+
+    def load_state_dict(self, state):
+        self.seed = state['seed']
+        self.set_epoch(state['epoch'], state['start'])
+
+
+class CheckpointManager:
+    """
+    Writes checkpoints on a background thread with atomic renames and a keep-last-K/best-K retention policy.
+    """
+
+    MANIFEST = 'checkpoints.json'
+
+    def __init__(self, directory, prefix='ckpt', keep_last=3, keep_best=1, metric='accuracy', mode='max',
+                 background=True):
+        """
+        Parameters
+        ----------
+        directory: str
+            Directory of the checkpoints and of their manifest, checkpoints.json.
+        prefix: str
+            Checkpoint file name prefix; files are named {prefix}_{step:08d}.pth.
+        keep_last: int
+            Number of most recent checkpoints kept.
+        keep_best: int
+            Number of best checkpoints by metric kept, among those saved with metrics.
+        metric: str
+            Key of the metrics passed to save() that ranks checkpoints.
+        mode: str
+            'max' if a higher metric is better, 'min' otherwise.
+        background: bool
+            If False, save() writes synchronously.
+        """
+        if mode not in ('max', 'min'):
+            raise ValueError("mode must be 'max' or 'min', got {}".format(mode))
+        self.directory = directory
+        self.prefix = prefix
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.metric = metric
+        self.mode = mode
+        os.makedirs(directory, exist_ok=True)
+
+        manifest = os.path.join(directory, self.MANIFEST)
+        self.entries = []
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                self.entries = json.load(f)
+
+        self._error = None
+        self._queue = None
+        if background:
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._worker, name='checkpoint-writer', daemon=True)
+            self._thread.start()
+
+    def save(self, step, model, optimizer=None, scheduler=None, sampler=None, metrics=None, **extra):
+        """
+        Snapshots the training state and queues it for writing.
+
+        Parameters
+        ----------
+        step: int
+            Global step; identifies the checkpoint.
+        model: torch.nn.Module
+            Model whose state_dict is saved under 'model_state_dict' (readable by multioutput_cnns.load_model()).
+        optimizer, scheduler: (optional)
+            Objects with a state_dict().
+        sampler: ResumableSampler (optional)
+            Data position to resume from.
+        metrics: dict (optional)
+            Validation metrics, used by the best-K retention.
+        extra:
+            Other picklable values to store, e.g. epoch=epoch.
+
+        Return
+        ------
+        Path the checkpoint is written to.
+        """
+        self._raise_error()
+        state = {'step': step, 'model_state_dict': model.state_dict(), 'rng_state': rng_state(),
+                 'metrics': metrics or {}}
+        if optimizer is not None:
+            state['optimizer_state_dict'] = optimizer.state_dict()
+        if scheduler is not None:
+            state['scheduler_state_dict'] = scheduler.state_dict()
+        if sampler is not None:
+            state['sampler_state_dict'] = sampler.state_dict()
+        state.update(extra)
+        state = _snapshot(state)
+
+        path = os.path.join(self.directory, '{}_{:08d}.pth'.format(self.prefix, step))
+        if self._queue is None:
+            self._write(path, state)
+        else:
+            self._queue.put((path, state))
+        return path
+
+    def _worker(self):
+        while True:
+            path, state = self._queue.get()
+            try:
+                if self._error is None:
+                    self._write(path, state)
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, path, state):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            torch.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+        entries = [e for e in self.entries if e['path'] != os.path.basename(path)]
+        entries.append({'path': os.path.basename(path), 'step': state['step'], 'metrics': state['metrics']})
+        self.entries = self._retain(entries)
+        tmp = os.path.join(self.directory, self.MANIFEST + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp, os.path.join(self.directory, self.MANIFEST))
+
+    def _retain(self, entries):
+        """ Deletes checkpoints that are neither among the last keep_last nor the best keep_best. """
+        by_step = sorted(entries, key=lambda e: e['step'])
+        keep = {e['path'] for e in by_step[len(by_step) - self.keep_last:]} if self.keep_last > 0 else set()
+        ranked = [e for e in entries if self.metric in e['metrics']]
+        ranked.sort(key=lambda e: e['metrics'][self.metric], reverse=self.mode == 'max')
+        keep.update(e['path'] for e in ranked[:self.keep_best])
+        for e in entries:
+            if e['path'] not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, e['path']))
+                except FileNotFoundError:
+                    pass
+        return [e for e in by_step if e['path'] in keep]
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError('Writing a checkpoint failed') from error
+
+    def wait(self):
+        """ Blocks until every queued checkpoint is written; re-raises a failed write. """
+        if self._queue is not None:
+            self._queue.join()
+        self._raise_error()
+
+    def latest(self):
+        """ Path of the most recent checkpoint, or None. """
+        self.wait()
+        return os.path.join(self.directory, self.entries[-1]['path']) if self.entries else None
+
+    def best(self):
+        """ Path of the best checkpoint by metric, or None. """
+        self.wait()
+        ranked = [e for e in self.entries if self.metric in e['metrics']]
+        if not ranked:
+            return None
+        pick = max if self.mode == 'max' else min
+        return os.path.join(self.directory, pick(ranked, key=lambda e: e['metrics'][self.metric])['path'])
+
+    def restore(self, model, optimizer=None, scheduler=None, sampler=None, path=None, map_location='cpu'):
+        """
+        Loads a checkpoint (the latest by default) into the given objects and restores the RNG states.
+
+        Return
+        ------
+        The checkpoint dict, or None if there is no checkpoint.
+        """
+        path = path or self.latest()
+        if path is None:
+            return None
+        state = torch.load(path, map_location=map_location, weights_only=False)
+        model.load_state_dict(state['model_state_dict'])
+        if optimizer is not None and 'optimizer_state_dict' in state:
+            optimizer.load_state_dict(state['optimizer_state_dict'])
+        if scheduler is not None and 'scheduler_state_dict' in state:
+            scheduler.load_state_dict(state['scheduler_state_dict'])
+        if sampler is not None and 'sampler_state_dict' in state:
+            sampler.load_state_dict(state['sampler_state_dict'])
+        set_rng_state(state['rng_state'])
+        return state
+
+
+def fit(model, optimizer, train_set, epochs, manager, batch_size=128, scheduler=None, valid_loader=None,
+        checkpoint_every=None, seed=0, num_workers=0, resume=True, device='cpu'):
+    """
+    Trains model, checkpointing every checkpoint_every batches and at the end of every epoch.
+
+    If resume is True and manager holds a checkpoint, training continues from it: the same
+    remaining batches are drawn in the same order with the same RNG states, so the result matches
+    an uninterrupted run (augmentations drawn in DataLoader workers are the exception).
+
+    Parameters
+    ----------
+    model, optimizer:
+        As for training.train_one_epoch().
+    train_set: torch.utils.data.Dataset
+        Training set, shuffled by a ResumableSampler.
+    epochs: int
+        Total number of epochs.
+    manager: CheckpointManager
+        Where checkpoints are written and resumed from.
+    batch_size: int
+        Batch size.
+    scheduler: (optional)
+        Learning-rate scheduler stepped after every batch.
+    valid_loader: torch.utils.data.DataLoader (optional)
+        Validation set evaluated at the end of each epoch; its metrics rank the best-K checkpoints.
+    checkpoint_every: int (optional)
+        Batches between mid-epoch checkpoints.
+    seed: int
+        Shuffling seed.
+    num_workers: int
+        DataLoader workers.
+    resume: bool
+        Continue from the latest checkpoint if there is one.
+    device: str
+        Device to train on.
+
+    Return
+    ------
+    List of the validation metrics of the epochs run by this call.
+    """
+    sampler = ResumableSampler(train_set, shuffle=True, seed=seed)
+    step, epoch = 0, 0
+    if resume:
+        state = manager.restore(model, optimizer, scheduler, sampler)
+        if state is not None:
+            step, epoch = state['step'], state['epoch']
+
+    history = []
+    while epoch < epochs:
+        if sampler.epoch != epoch:
+            sampler.set_epoch(epoch)
+        start = sampler.start
+        # A dedicated generator keeps the DataLoader from drawing its worker seed from the global
+        # RNG, which a loader created mid-epoch on resume would otherwise do one extra time.
+        loader = DataLoader(train_set, batch_size=batch_size, sampler=sampler, num_workers=num_workers,
+                            generator=torch.Generator().manual_seed(seed + epoch))
+
+        def on_batch_end(batch, loss):
+            nonlocal step
+            step += 1
+            if checkpoint_every and step % checkpoint_every == 0:
+                position = ResumableSampler(train_set, seed=sampler.seed)
+                position.set_epoch(epoch, start + (batch + 1) * batch_size)
+                manager.save(step, model, optimizer, scheduler, position, epoch=epoch)
+
+        train_one_epoch(model, optimizer, loader, device, scheduler, step_callback=on_batch_end)
+        epoch += 1
+        sampler.set_epoch(epoch)
+
+        metrics = {}
+        if valid_loader is not None:
+            accuracy, count_accuracy, particle_accuracy, loss = evaluate(model, valid_loader, device)
+            metrics = {'accuracy': accuracy, 'count_accuracy': count_accuracy,
+                       'particle_accuracy': particle_accuracy, 'loss': loss}
+            history.append(metrics)
+        manager.save(step, model, optimizer, scheduler, sampler, metrics, epoch=epoch)
+    manager.wait()
+    return history
@@ -0,0 +1,90 @@
+"""
+
+Compares float32 and bfloat16-autocast training, each in NCHW and channels-last
+memory format, on the 11-particle, 4-count task.
+
+Every mode trains the same model from the same seed and reports images/s and
+validation accuracy per epoch, plus the accuracy of its float32 checkpoint
+reloaded into a plain NCHW model, which is what nightly retraining ships.
+
+Example
+-------
+    python compare_precision.py --model multi_output_cnn_10_layers --root-dir /path/to/thumbnails --epochs 3
+
+"""
+import argparse
+
+import torch
+
+from multioutput_cnns import MODELS, load_model
+from training import (load_dataset, get_dataloaders, train_one_epoch, evaluate, to_channels_last,
+                      checkpoint_state_dict, PARTICLES, COUNTS)
+
+
+# Mode name: (autocast dtype, channels-last).
+MODES = {
+    'float32': (None, False),
+    'float32_channels_last': (None, True),
+    'bfloat16': (torch.bfloat16, False),
+    'bfloat16_channels_last': (torch.bfloat16, True),
+}
+
+
+def compare(model_name, train_loader, valid_loader, epochs=1, lr=0.001, weight_decay=0.001, modes=MODES, seed=0):
+    """
+    Trains model_name once per mode and records throughput and accuracy.
+
+    Return
+    ------
+    dict mapping mode to a dict with 'epochs', a list of per-epoch dicts with 'images_per_sec', 'loss',
+    'accuracy', 'count_accuracy' and 'particle_accuracy', and 'checkpoint_accuracy', the float32 NCHW
+    accuracy of the final weights.
+    """
+    results = {}
+    for mode, (amp_dtype, channels_last) in modes.items():
+        torch.manual_seed(seed)
+        model = load_model(model_name, len(PARTICLES), len(COUNTS))
+        if channels_last:
+            to_channels_last(model)
+        optimizer = torch.optim.Adam(model.parameters(), lr=lr, weight_decay=weight_decay)
+        history = []
+        for _ in range(epochs):
+            stats = train_one_epoch(model, optimizer, train_loader, amp_dtype=amp_dtype, channels_last=channels_last)
+            accuracy, count_accuracy, particle_accuracy, _ = evaluate(model, valid_loader, amp_dtype=amp_dtype,
+                                                                      channels_last=channels_last)
+            history.append({'images_per_sec': stats['samples'] / stats['wall_time'], 'loss': stats['loss'],
+                            'accuracy': accuracy, 'count_accuracy': count_accuracy,
+                            'particle_accuracy': particle_accuracy})
+
+        reloaded = load_model(model_name, len(PARTICLES), len(COUNTS))
+        reloaded.load_state_dict(checkpoint_state_dict(model))
+        results[mode] = {'epochs': history, 'checkpoint_accuracy': evaluate(reloaded, valid_loader)[0]}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare float32 and bfloat16 training, NCHW and channels-last.')
+    parser.add_argument('--model', default='multi_output_cnn_10_layers', choices=sorted(MODELS))
+    parser.add_argument('--root-dir', default=None, help='Directory containing the thumbnail datasets. Random data if omitted.')
+    parser.add_argument('--length', type=int, default=1000, help='Multi-hit images per dataset (see ThumbnailDataset.from_h5).')
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--num-workers', type=int, default=1)
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.root_dir, args.length)
+    train_loader, valid_loader = get_dataloaders(dataset, args.batch_size, args.num_workers)
+
+    results = compare(args.model, train_loader, valid_loader, epochs=args.epochs)
+    print('{:>24} {:>5} {:>10} {:>9} {:>9} {:>10} {:>12}'.format(
+        'mode', 'epoch', 'images/s', 'total %', 'count %', 'particle %', 'checkpoint %'))
+    for mode, r in results.items():
+        for epoch, e in enumerate(r['epochs']):
+            checkpoint = '{:12.2f}'.format(r['checkpoint_accuracy']) if epoch == len(r['epochs']) - 1 else ''
+            print('{:>24} {:5d} {:10.1f} {:9.2f} {:9.2f} {:10.2f} {}'.format(
+                mode, epoch, e['images_per_sec'], e['accuracy'], e['count_accuracy'], e['particle_accuracy'],
+                checkpoint))
+
+
+if __name__ == "__main__":
+    main()
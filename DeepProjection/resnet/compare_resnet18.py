@@ -0,0 +1,73 @@
+"""
+
+Compares per-epoch training time and validation accuracy of the ResNet18 variants:
+the torchvision-based CustomResNet18Model, resnet.resnet18 with the ImageNet stem,
+and thumbnail_resnet18 (3x3 stem, channels-last) with and without channels-last.
+
+Example
+-------
+    python compare_resnet18.py --root-dir /path/to/thumbnails --epochs 3
+
+"""
+import argparse
+
+import torch
+
+from multioutput_cnns import CustomResNet18Model, thumbnail_resnet18
+from resnet import resnet18
+from training import load_dataset, get_dataloaders, train_one_epoch, evaluate
+
+
+VARIANTS = {
+    'torchvision': lambda: CustomResNet18Model(num_counts=4, num_particles=11),
+    'resnet18': lambda: resnet18(),
+    'resnet18_thumbnail_nchw': lambda: thumbnail_resnet18(channels_last=False),
+    'resnet18_thumbnail': lambda: thumbnail_resnet18(),
+}
+
+
+def compare(train_loader, valid_loader, epochs=1, lr=0.001, weight_decay=0.001, variants=VARIANTS, seed=0):
+    """
+    Trains each variant from the same seed and records its epoch times and validation accuracies.
+
+    Return
+    ------
+    dict mapping variant name to a list of per-epoch dicts with 'wall_time', 'loss', 'accuracy',
+    'count_accuracy' and 'particle_accuracy'.
+    """
+    results = {}
+    for name, make_model in variants.items():
+        torch.manual_seed(seed)
+        model = make_model()
+        optimizer = torch.optim.Adam(model.parameters(), lr=lr, weight_decay=weight_decay)
+        results[name] = []
+        for _ in range(epochs):
+            stats = train_one_epoch(model, optimizer, train_loader)
+            accuracy, count_accuracy, particle_accuracy, _ = evaluate(model, valid_loader)
+            results[name].append({'wall_time': stats['wall_time'], 'loss': stats['loss'], 'accuracy': accuracy,
+                                  'count_accuracy': count_accuracy, 'particle_accuracy': particle_accuracy})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare epoch time and accuracy of the ResNet18 variants.')
+    parser.add_argument('--root-dir', default=None, help='Directory containing the thumbnail datasets. Random data if omitted.')
+    parser.add_argument('--length', type=int, default=1000, help='Multi-hit images per dataset (see ThumbnailDataset.from_h5).')
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--num-workers', type=int, default=1)
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.root_dir, args.length)
+    train_loader, valid_loader = get_dataloaders(dataset, args.batch_size, args.num_workers)
+
+    results = compare(train_loader, valid_loader, epochs=args.epochs)
+    print('{:>24} {:>5} {:>10} {:>9} {:>9} {:>10}'.format('variant', 'epoch', 'time (s)', 'total %', 'count %', 'particle %'))
+    for name, epochs in results.items():
+        for epoch, r in enumerate(epochs):
+            print('{:>24} {:5d} {:10.1f} {:9.2f} {:9.2f} {:10.2f}'.format(
+                name, epoch, r['wall_time'], r['accuracy'], r['count_accuracy'], r['particle_accuracy']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+
+Distributed data-parallel training of the multi-output classifiers on CPU.
+
+Each process trains a DistributedDataParallel replica on its shard of the
+training set (DistributedSampler) with the gloo backend. Loss and accuracy
+are all-reduced so every rank reports global metrics, and only rank 0 writes
+checkpoints.
+
+Local processes (for testing, or one node)
+------------------------------------------
+    python distributed.py --world-size 4 --root-dir /path/to/thumbnails --epochs 10 --ckpt-path ./logs/ckpt.pth
+
+Several nodes, with torchrun setting RANK, WORLD_SIZE, MASTER_ADDR and MASTER_PORT
+-----------------------------------------------------------------------------------
+    torchrun --nnodes 2 --nproc-per-node 4 --rdzv-endpoint host:29500 distributed.py --root-dir ...
+
+Scaling efficiency at 1, 2, 4 and 8 processes
+---------------------------------------------
+    python distributed.py --scaling 1 2 4 8 --root-dir /path/to/thumbnails
+
+"""
+import argparse
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+
+from multioutput_cnns import MODELS, load_model
+from training import load_dataset, split, train_one_epoch, evaluate, checkpoint_state_dict, PARTICLES, COUNTS
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def all_reduce(values, op=dist.ReduceOp.SUM):
+    """ All-reduces a list of floats across the process group and returns the reduced list. """
+    t = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(t, op=op)
+    return t.tolist()
+
+
+def train(rank, world_size, dataset, model_name='multi_output_cnn_10_layers', epochs=1, batch_size=128,
+          lr=0.001, weight_decay=0.001, ckpt_path=None, seed=0, num_workers=0, results=None):
+    """
+    Trains one DDP replica. Run it in every process of an initialized gloo process group.
+
+    Parameters
+    ----------
+    rank: int
+        Rank of this process.
+    world_size: int
+        Number of processes.
+    dataset: ThumbnailDataset
+        Full dataset, split 70/10 into training and validation sets.
+    model_name: str
+        Key of multioutput_cnns.MODELS.
+    epochs: int
+        Training epochs.
+    batch_size: int
+        Per-process batch size; the global batch is world_size * batch_size.
+    lr, weight_decay: float
+        Adam parameters.
+    ckpt_path: str (optional)
+        Rank 0 saves the model and optimizer there after every epoch.
+    seed: int
+        Seed for the initial weights and the shuffling.
+    num_workers: int
+        DataLoader workers per process.
+    results: multiprocessing queue (optional)
+        Rank 0 puts the history there when done.
+
+    Return
+    ------
+    List of per-epoch dicts with the global 'loss', 'images_per_sec', 'wall_time', 'accuracy',
+    'count_accuracy', 'particle_accuracy' and 'valid_loss'.
+    """
+    torch.manual_seed(seed)
+    train_set, valid_set = split(dataset)
+    train_sampler = DistributedSampler(train_set, world_size, rank, shuffle=True, seed=seed)
+    # The validation sampler pads each shard to the same length by repeating a few images.
+    valid_sampler = DistributedSampler(valid_set, world_size, rank, shuffle=False)
+    train_loader = DataLoader(train_set, batch_size=batch_size, sampler=train_sampler, num_workers=num_workers)
+    valid_loader = DataLoader(valid_set, batch_size=batch_size, sampler=valid_sampler, num_workers=num_workers)
+
+    model = DistributedDataParallel(load_model(model_name, len(PARTICLES), len(COUNTS)))
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr, weight_decay=weight_decay)
+
+    history = []
+    for epoch in range(epochs):
+        train_sampler.set_epoch(epoch)
+        stats = train_one_epoch(model, optimizer, train_loader)
+        loss_sum, samples = all_reduce([stats['loss'] * stats['samples'], stats['samples']])
+        wall_time, = all_reduce([stats['wall_time']], op=dist.ReduceOp.MAX)
+
+        accuracy, count_accuracy, particle_accuracy, valid_loss = evaluate(model.module, valid_loader)
+        n = len(valid_sampler)
+        correct = all_reduce([accuracy * n / 100, count_accuracy * n / 100, particle_accuracy * n / 100,
+                              valid_loss * n, n])
+        n = max(correct[-1], 1)
+        history.append({'loss': loss_sum / max(samples, 1), 'images_per_sec': samples / wall_time,
+                        'wall_time': wall_time, 'accuracy': correct[0] / n * 100,
+                        'count_accuracy': correct[1] / n * 100, 'particle_accuracy': correct[2] / n * 100,
+                        'valid_loss': correct[3] / n})
+
+        if rank == 0 and ckpt_path is not None:
+            torch.save({'epoch': epoch, 'model_state_dict': checkpoint_state_dict(model.module),
+                        'optimizer_state_dict': optimizer.state_dict(), 'world_size': world_size}, ckpt_path)
+        dist.barrier()
+
+    if rank == 0 and results is not None:
+        results.put(history)
+    return history
+
+
+def _worker(rank, world_size, port, num_threads, kwargs):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    torch.set_num_threads(num_threads)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    try:
+        train(rank, world_size, **kwargs)
+    finally:
+        dist.destroy_process_group()
+
+
+def launch(world_size, dataset, num_threads=None, **kwargs):
+    """
+    Runs train() in world_size local processes and returns rank 0's history.
+
+    Parameters
+    ----------
+    world_size: int
+        Number of processes.
+    dataset: ThumbnailDataset
+        Passed to every process.
+    num_threads: int (optional)
+        Intra-op threads per process. Defaults to splitting the machine's cores evenly.
+    kwargs:
+        Other arguments of train().
+    """
+    if num_threads is None:
+        num_threads = max(1, (os.cpu_count() or 1) // world_size)
+    results = mp.get_context('spawn').SimpleQueue()
+    kwargs = dict(kwargs, dataset=dataset, results=results)
+    mp.spawn(_worker, args=(world_size, _free_port(), num_threads, kwargs), nprocs=world_size, join=True)
+    return results.get()
+
+
+def scaling(dataset, world_sizes=(1, 2, 4, 8), **kwargs):
+    """
+    Trains one epoch at each world size and reports throughput and scaling efficiency.
+
+    The per-process batch size is kept fixed (weak scaling of the global batch).
+
+    Return
+    ------
+    List of dicts with 'world_size', 'images_per_sec', 'speedup' and 'efficiency'
+    (speedup divided by world_size, relative to the first world size).
+    """
+    kwargs.setdefault('epochs', 1)
+    rows = []
+    for world_size in world_sizes:
+        history = launch(world_size, dataset, **kwargs)
+        rows.append({'world_size': world_size, 'images_per_sec': history[-1]['images_per_sec']})
+    base = rows[0]
+    for row in rows:
+        row['speedup'] = row['images_per_sec'] / base['images_per_sec']
+        row['efficiency'] = row['speedup'] * base['world_size'] / row['world_size']
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distributed data-parallel training on CPU with the gloo backend.')
+    parser.add_argument('--model', default='multi_output_cnn_10_layers', choices=sorted(MODELS))
+    parser.add_argument('--root-dir', default=None, help='Directory containing the thumbnail datasets. Random data if omitted.')
+    parser.add_argument('--length', type=int, default=1000, help='Multi-hit images per dataset (see ThumbnailDataset.from_h5).')
+    parser.add_argument('--world-size', type=int, default=2, help='Local processes to spawn (ignored under torchrun).')
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=128, help='Per-process batch size.')
+    parser.add_argument('--lr', type=float, default=0.001)
+    parser.add_argument('--weight-decay', type=float, default=0.001)
+    parser.add_argument('--num-workers', type=int, default=0)
+    parser.add_argument('--ckpt-path', default=None)
+    parser.add_argument('--scaling', type=int, nargs='+', default=None, help='Report scaling efficiency at these world sizes.')
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.root_dir, args.length)
+    kwargs = dict(model_name=args.model, epochs=args.epochs, batch_size=args.batch_size, lr=args.lr,
+                  weight_decay=args.weight_decay, num_workers=args.num_workers)
+
+    if args.scaling is not None:
+        kwargs['epochs'] = 1
+        print('{:>10} {:>10} {:>8} {:>11}'.format('processes', 'images/s', 'speedup', 'efficiency'))
+        for row in scaling(dataset, args.scaling, **kwargs):
+            print('{:10d} {:10.1f} {:8.2f} {:10.1f}%'.format(
+                row['world_size'], row['images_per_sec'], row['speedup'], row['efficiency'] * 100))
+        return
+
+    if 'RANK' in os.environ:
+        # Started by torchrun: the process group comes from the environment.
+        dist.init_process_group('gloo')
+        rank, world_size = dist.get_rank(), dist.get_world_size()
+        try:
+            history = train(rank, world_size, dataset, ckpt_path=args.ckpt_path, **kwargs)
+        finally:
+            dist.destroy_process_group()
+        if rank != 0:
+            return
+    else:
+        history = launch(args.world_size, dataset, ckpt_path=args.ckpt_path, **kwargs)
+
+    for epoch, h in enumerate(history):
+        print('epoch {}: loss {:.4f}, {:.1f} images/s, valid total {:.2f}%, count {:.2f}%, particle {:.2f}%'.format(
+            epoch, h['loss'], h['images_per_sec'], h['accuracy'], h['count_accuracy'], h['particle_accuracy']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+
+Exports the diffraction classifiers as frozen TorchScript and ONNX artifacts.
+
+Conv2d + BatchNorm2d pairs are folded and Conv2d + ReLU pairs are fused with
+torch.fx before tracing. The traced graph is frozen for inference, saved, and
+checked against the eager model on the same inputs.
+
+Example
+-------
+    python export.py --model multi_output_cnn_3_layers --checkpoint ./logs/ckpt.pth --outdir ./export --benchmark
+
+"""
+import argparse
+import copy
+import inspect
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.fx as fx
+import torch.ao.nn.intrinsic as nni
+from torch.fx.experimental import optimization as fx_optimization
+
+from multioutput_cnns import MODELS, load_model
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+# Names of the exported graph's input and outputs.
+INPUT_NAMES = ['images']
+OUTPUT_NAMES = ['count_log_probs', 'particle_log_probs']
+
+
+def _is_relu(node, modules):
+    if node.op == 'call_function':
+        return node.target in (F.relu, torch.relu)
+    if node.op == 'call_module':
+        return isinstance(modules[node.target], nn.ReLU)
+    return False
+
+
+def _set_module(root, target, module):
+    parent_name, _, name = target.rpartition('.')
+    parent = root.get_submodule(parent_name) if parent_name else root
+    setattr(parent, name, module)
+
+
+def fuse_conv_relu(model):
+    """
+    Folds BatchNorm2d into the preceding Conv2d and fuses Conv2d + ReLU pairs.
+
+    Parameters
+    ----------
+    model: torch.nn.Module
+        Model to fuse. It is copied, not modified.
+
+    Return
+    ------
+    torch.fx.GraphModule
+        Eval-mode copy of model where each Conv2d (with its BatchNorm2d folded in)
+        that feeds only a ReLU is replaced by a torch.ao.nn.intrinsic.ConvReLU2d.
+    """
+    gm = fx_optimization.fuse(copy.deepcopy(model).eval())
+    modules = dict(gm.named_modules())
+
+    for node in list(gm.graph.nodes):
+        if not _is_relu(node, modules):
+            continue
+        conv = node.args[0]
+        if not isinstance(conv, fx.Node) or conv.op != 'call_module' or len(conv.users) != 1:
+            continue
+        if type(modules[conv.target]) is not nn.Conv2d:
+            continue
+        _set_module(gm, conv.target, nni.ConvReLU2d(modules[conv.target], nn.ReLU()))
+        node.replace_all_uses_with(conv)
+        gm.graph.erase_node(node)
+
+    gm.graph.lint()
+    gm.recompile()
+    return gm
+
+
+def export_torchscript(model, example_inputs, path=None, method='trace', fuse=True, optimize=True):
+    """
+    Converts model to a frozen TorchScript module.
+
+    Parameters
+    ----------
+    model: torch.nn.Module
+        Eager model to export.
+    example_inputs: torch.Tensor
+        Batch of shape (N, 1, H, W) used for tracing.
+    path: str (optional)
+        If given, the frozen module is saved there with torch.jit.save().
+    method: str
+        'trace' or 'script'.
+    fuse: bool
+        If True, apply fuse_conv_relu() before conversion.
+    optimize: bool
+        If True, run torch.jit.optimize_for_inference() on the returned module. The saved
+        module is the frozen graph before this step, since the MKLDNN constants it introduces
+        cannot be serialized; load_torchscript() applies it again after loading.
+
+    Return
+    ------
+    torch.jit.ScriptModule
+    """
+    model = fuse_conv_relu(model) if fuse else copy.deepcopy(model).eval()
+    with torch.no_grad():
+        if method == 'trace':
+            scripted = torch.jit.trace(model, example_inputs)
+        elif method == 'script':
+            scripted = torch.jit.script(model)
+        else:
+            raise ValueError("method must be 'trace' or 'script', got {}".format(method))
+        scripted = torch.jit.freeze(scripted.eval())
+
+    if path is not None:
+        torch.jit.save(scripted, path)
+    if optimize:
+        scripted = torch.jit.optimize_for_inference(scripted)
+    return scripted
+
+
+def load_torchscript(path, optimize=True):
+    """ Loads a module saved by export_torchscript() onto the CPU, optionally re-applying optimize_for_inference(). """
+    scripted = torch.jit.load(path, map_location='cpu').eval()
+    if optimize:
+        scripted = torch.jit.optimize_for_inference(scripted)
+    return scripted
+
+
+def export_onnx(model, example_inputs, path, opset_version=17, fuse=True):
+    """
+    Exports model to an ONNX file with a dynamic batch dimension.
+
+    Parameters
+    ----------
+    model: torch.nn.Module
+        Eager model to export.
+    example_inputs: torch.Tensor
+        Batch of shape (N, 1, H, W) used for tracing.
+    path: str
+        Output .onnx file.
+    opset_version: int
+        ONNX opset to target.
+    fuse: bool
+        If True, apply fuse_conv_relu() before exporting.
+    """
+    model = fuse_conv_relu(model) if fuse else copy.deepcopy(model).eval()
+    dynamic_axes = {name: {0: 'batch'} for name in INPUT_NAMES + OUTPUT_NAMES}
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # The dynamic-axes interface used here belongs to the TorchScript-based exporter.
+        kwargs['dynamo'] = False
+    with torch.no_grad():
+        torch.onnx.export(model, (example_inputs,), path, input_names=INPUT_NAMES, output_names=OUTPUT_NAMES,
+                          dynamic_axes=dynamic_axes, opset_version=opset_version, **kwargs)
+    return path
+
+
+def onnx_session(path):
+    """ Returns an onnxruntime.InferenceSession running path on CPU. """
+    if onnxruntime is None:
+        raise ImportError('onnxruntime is required to run exported ONNX models.')
+    return onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+
+
+def _run(runner, inputs):
+    """ Runs an eager/TorchScript module or an onnxruntime session and returns the outputs as numpy arrays. """
+    if onnxruntime is not None and isinstance(runner, onnxruntime.InferenceSession):
+        return runner.run(None, {INPUT_NAMES[0]: inputs.numpy()})
+    with torch.no_grad():
+        return [y.numpy() for y in runner(inputs)]
+
+
+def verify_parity(reference, candidate, inputs, atol=1e-4):
+    """
+    Checks that candidate reproduces the outputs of reference.
+
+    Parameters
+    ----------
+    reference: torch.nn.Module
+        Eager model.
+    candidate: torch.nn.Module, torch.jit.ScriptModule or onnxruntime.InferenceSession
+        Exported model.
+    inputs: torch.Tensor
+        Batch of shape (N, 1, H, W).
+    atol: float
+        Largest absolute difference allowed in either output.
+
+    Return
+    ------
+    max_diff: float
+        Largest absolute difference between the two models' log-probabilities.
+    """
+    reference = reference.eval()
+    max_diff = max(float(np.abs(a - b).max()) for a, b in zip(_run(reference, inputs), _run(candidate, inputs)))
+    if max_diff > atol:
+        raise RuntimeError('Exported model differs from the eager model by {:.3g} (atol={:.3g})'.format(max_diff, atol))
+    return max_diff
+
+
+def measure_latency(runner, inputs, repeats=10, warmup=2):
+    """ Returns the median latency, in milliseconds, of running runner on inputs. """
+    for _ in range(warmup):
+        _run(runner, inputs)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        _run(runner, inputs)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1000)
+
+
+def benchmark(model, image_shape=(128, 128), batch_sizes=(1, 32, 256), repeats=10, workdir='.'):
+    """
+    Compares eager, frozen TorchScript and ONNX Runtime latency on CPU.
+
+    Parameters
+    ----------
+    model: torch.nn.Module
+        Eager model.
+    image_shape: tuple(int, int)
+        Thumbnail shape.
+    batch_sizes: iterable(int)
+        Batch sizes to measure.
+    repeats: int
+        Timed runs per measurement.
+    workdir: str
+        Directory for the temporary ONNX file.
+
+    Return
+    ------
+    List of dicts with 'batch_size', 'eager_ms', 'torchscript_ms' and 'onnxruntime_ms'
+    ('onnxruntime_ms' is None when onnxruntime is not installed).
+    """
+    model = model.eval()
+    example = torch.randn(1, 1, *image_shape)
+    scripted = export_torchscript(model, example)
+    session = None
+    if onnxruntime is not None:
+        session = onnx_session(export_onnx(model, example, os.path.join(workdir, '_benchmark.onnx')))
+
+    results = []
+    for batch_size in batch_sizes:
+        inputs = torch.randn(batch_size, 1, *image_shape)
+        results.append({
+            'batch_size': batch_size,
+            'eager_ms': measure_latency(model, inputs, repeats),
+            'torchscript_ms': measure_latency(scripted, inputs, repeats),
+            'onnxruntime_ms': measure_latency(session, inputs, repeats) if session is not None else None,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the diffraction classifiers to TorchScript and ONNX.')
+    parser.add_argument('--model', default='all', choices=['all'] + sorted(MODELS))
+    parser.add_argument('--checkpoint', default=None, help='Checkpoint to load. Only valid with a single --model.')
+    parser.add_argument('--num-particles', type=int, default=11)
+    parser.add_argument('--num-counts', type=int, default=4)
+    parser.add_argument('--image-size', type=int, default=128)
+    parser.add_argument('--method', default='trace', choices=['trace', 'script'])
+    parser.add_argument('--outdir', default='./export')
+    parser.add_argument('--benchmark', action='store_true', help='Report eager/TorchScript/ONNX Runtime latency.')
+    args = parser.parse_args()
+
+    names = sorted(MODELS) if args.model == 'all' else [args.model]
+    if args.checkpoint is not None and len(names) > 1:
+        parser.error('--checkpoint requires a single --model')
+    os.makedirs(args.outdir, exist_ok=True)
+
+    for name in names:
+        model = load_model(name, args.num_particles, args.num_counts, checkpoint=args.checkpoint).eval()
+        example = torch.randn(4, 1, args.image_size, args.image_size)
+
+        ts_path = os.path.join(args.outdir, name + '.pt')
+        scripted = export_torchscript(model, example, ts_path, method=args.method)
+        print('{}: TorchScript saved to {} (max diff {:.2e})'.format(
+            name, ts_path, verify_parity(model, scripted, example)))
+
+        if onnxruntime is not None:
+            onnx_path = export_onnx(model, example, os.path.join(args.outdir, name + '.onnx'))
+            print('{}: ONNX saved to {} (max diff {:.2e})'.format(
+                name, onnx_path, verify_parity(model, onnx_session(onnx_path), example)))
+
+        if args.benchmark:
+            print('{:>6} {:>10} {:>14} {:>16}'.format('batch', 'eager ms', 'torchscript ms', 'onnxruntime ms'))
+            for row in benchmark(model, (args.image_size, args.image_size), workdir=args.outdir):
+                ort_ms = '{:16.2f}'.format(row['onnxruntime_ms']) if row['onnxruntime_ms'] is not None else '{:>16}'.format('n/a')
+                print('{:6d} {:10.2f} {:14.2f} {}'.format(row['batch_size'], row['eager_ms'], row['torchscript_ms'], ort_ms))
+
+
+if __name__ == "__main__":
+    main()
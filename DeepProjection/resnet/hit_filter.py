@@ -0,0 +1,133 @@
+"""
+
+Rejects blank and near-empty frames before they reach the classifiers.
+
+HitFilter computes three statistics of every frame of a stack in one pass
+(one matrix product and one count): the total photons, the number of lit
+pixels and the radial moment, the intensity-weighted mean distance from the
+beam center, which is large for flat background and small for the
+centrally peaked scattering of a particle. Frames failing any threshold are
+non-hits and skip the network; InferenceEngine(hit_filter=...) applies it
+ahead of the forward pass.
+
+Example
+-------
+    hit_filter = HitFilter(min_photons=50, min_lit_pixels=20)
+    hits = hit_filter(frames)                          # indices of candidate hits
+    print(hit_filter.report())                         # {'frames': ..., 'filtered_fraction': ...}
+    print(benchmark(model, frames, hit_filter))        # end-to-end throughput with and without the filter
+
+"""
+import time
+
+import numpy as np
+
+
+class HitFilter:
+    """
+    Vectorized per-frame statistics with thresholds that separate candidate hits from non-hits.
+    """
+
+    def __init__(self, min_photons=0.0, min_lit_pixels=0, max_radial_moment=None, lit_threshold=0.0, center=None):
+        """
+        Parameters
+        ----------
+        min_photons: float
+            Frames with total photons at or below this are rejected. The default 0 rejects
+            exactly the frames utils.check_for_blank_img() calls blank (for non-negative frames).
+        min_lit_pixels: int
+            Frames with fewer lit pixels are rejected.
+        max_radial_moment: float (optional)
+            Frames whose radial moment, in pixels, exceeds this are rejected.
+        lit_threshold: float
+            A pixel is lit if its value exceeds this.
+        center: tuple(float, float) (optional)
+            Beam center (row, col) in pixels; the frame center by default.
+        """
+        self.min_photons = min_photons
+        self.min_lit_pixels = min_lit_pixels
+        self.max_radial_moment = max_radial_moment
+        self.lit_threshold = lit_threshold
+        self.center = center
+        self._weights = {}
+        self.frames = 0
+        self.passed = 0
+
+    def _radius_weights(self, shape):
+        """ (H * W, 2) matrix of ones and pixel radii, so frames @ weights gives totals and first radial moments. """
+        if shape not in self._weights:
+            center = self.center if self.center is not None else ((shape[0] - 1) / 2.0, (shape[1] - 1) / 2.0)
+            rows, cols = np.indices(shape, dtype=np.float32)
+            radius = np.hypot(rows - center[0], cols - center[1])
+            self._weights[shape] = np.stack([np.ones(radius.size, dtype=np.float32), radius.ravel()], axis=1)
+        return self._weights[shape]
+
+    def statistics(self, frames):
+        """
+        Computes the statistics of a stack of frames.
+
+        Parameters
+        ----------
+        frames: numpy.array
+            Frames of shape (N, H, W) or (N, 1, H, W).
+
+        Return
+        ------
+        dict of (N,) arrays 'photons', 'lit_pixels' and 'radial_moment' (NaN for frames without photons).
+        """
+        frames = np.asarray(frames)
+        shape = frames.shape[-2:]
+        flat = frames.reshape(len(frames), -1)
+        sums = flat.astype(np.float32, copy=False) @ self._radius_weights(shape)
+        photons = sums[:, 0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            radial_moment = np.where(photons != 0, sums[:, 1] / photons, np.nan)
+        return {'photons': photons, 'lit_pixels': np.count_nonzero(flat > self.lit_threshold, axis=1),
+                'radial_moment': radial_moment}
+
+    def mask(self, frames):
+        """ Boolean (N,) array, True for the frames that pass every threshold. """
+        stats = self.statistics(frames)
+        hits = (stats['photons'] > self.min_photons) & (stats['lit_pixels'] >= self.min_lit_pixels)
+        if self.max_radial_moment is not None:
+            hits &= stats['radial_moment'] <= self.max_radial_moment
+        self.frames += len(hits)
+        self.passed += int(hits.sum())
+        return hits
+
+    def __call__(self, frames):
+        """ Indices of the candidate hits among frames. """
+        return np.flatnonzero(self.mask(frames))
+
+    def report(self):
+        """ Frames seen, frames passed and the fraction filtered out so far. """
+        return {'frames': self.frames, 'passed': self.passed,
+                'filtered_fraction': 1 - self.passed / self.frames if self.frames else None}
+
+    def reset(self):
+        self.frames = 0
+        self.passed = 0
+
+
+def benchmark(model, frames, hit_filter, **engine_kwargs):
+    """
+    Classifies frames with an InferenceEngine with and without hit_filter.
+
+    Return
+    ------
+    dict with 'images_per_sec' (without the filter), 'filtered_images_per_sec' (with it, counting
+    every input frame), 'throughput_gain' (their ratio) and 'filtered_fraction'.
+    """
+    from inference import InferenceEngine
+
+    timings = {}
+    for name, f in (('images_per_sec', None), ('filtered_images_per_sec', hit_filter)):
+        with InferenceEngine(model, hit_filter=f, **engine_kwargs) as engine:
+            engine.predict(frames[:engine.max_batch_size])  # warm-up
+            start = time.perf_counter()
+            engine.predict(frames)
+            timings[name] = len(frames) / (time.perf_counter() - start)
+    hit_filter.reset()
+    hit_filter.mask(frames)
+    return dict(timings, throughput_gain=timings['filtered_images_per_sec'] / timings['images_per_sec'],
+                filtered_fraction=hit_filter.report()['filtered_fraction'])
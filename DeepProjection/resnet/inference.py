@@ -0,0 +1,445 @@
+"""
+
+Batched inference for the multi-output (count, particle) classifiers.
+
+Requests are queued one image at a time and grouped into micro-batches by a
+worker thread. A batch is dispatched when it reaches max_batch_size or when
+the oldest queued image has waited max_latency_ms, whichever comes first.
+The engine can be used in-process (InferenceEngine.submit / predict) or
+through a local TCP socket (InferenceServer / classify_remote). With a
+hit_filter.HitFilter, blank and near-empty frames are rejected before they
+are queued and their prediction is None.
+
+Example
+-------
+    python inference.py --model multi_output_cnn_3_layers --checkpoint ./logs/ckpt.pth --num-images 5000
+    python inference.py --model multi_output_cnn_3_layers --blank-fraction 0.5 --min-photons 0
+
+"""
+import argparse
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+
+from hit_filter import HitFilter
+from multioutput_cnns import MODELS, load_model
+
+
+# Result for a single image. count and particle are class indices,
+# count_probs and particle_probs the softmax probabilities of each head.
+Prediction = namedtuple('Prediction', ['count', 'particle', 'count_probs', 'particle_probs'])
+
+# Sentinel put on the request queue to stop the worker thread.
+_STOP = object()
+
+
+class InferenceEngine:
+    """
+    Runs a multi-output model on CPU with dynamic micro-batching.
+    """
+
+    def __init__(self, model, max_batch_size=64, max_latency_ms=5.0, device='cpu', history=100000, hit_filter=None):
+        """
+        Parameters
+        ----------
+        model: torch.nn.Module
+            Model returning (count log-probabilities, particle log-probabilities).
+        max_batch_size: int
+            Largest number of images run in one forward pass.
+        max_latency_ms: float
+            Longest time, in milliseconds, the first image of a batch waits for the batch to fill up.
+        device: str or torch.device
+            Device to run the model on.
+        history: int
+            Number of most recent per-image latencies kept for the statistics.
+        hit_filter: hit_filter.HitFilter (optional)
+            Frames it rejects are not classified; their prediction is None.
+        """
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be at least 1, got {}'.format(max_batch_size))
+        self.model = model.to(device).eval()
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self.device = torch.device(device)
+        self.hit_filter = hit_filter
+
+        self._requests = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=history)
+        self._batch_sizes = deque(maxlen=history)
+        self._num_images = 0
+        self._num_filtered = 0
+        self._first_submit = None
+        self._last_done = None
+
+    @classmethod
+    def from_checkpoint(cls, name, checkpoint, num_particles=11, num_counts=4, **kwargs):
+        """ Builds the engine around a model from multioutput_cnns.MODELS restored from checkpoint. """
+        return cls(load_model(name, num_particles=num_particles, num_counts=num_counts,
+                              checkpoint=checkpoint), **kwargs)
+
+    def start(self):
+        """ Starts the batching worker thread. Calling start() twice is a no-op. """
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name='InferenceEngine', daemon=True)
+            self._worker.start()
+        return self
+
+    def stop(self):
+        """ Finishes the queued requests and stops the worker thread. """
+        if self._worker is not None:
+            self._requests.put(_STOP)
+            self._worker.join()
+            self._worker = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def submit(self, image):
+        """
+        Queues one image for classification.
+
+        Parameters
+        ----------
+        image: numpy.array or torch.Tensor
+            Thumbnail of shape (H, W) or (1, H, W).
+
+        Return
+        ------
+        concurrent.futures.Future resolving to a Prediction, or to None if the hit filter rejects the image.
+        """
+        if self._worker is None:
+            raise RuntimeError('InferenceEngine.start() must be called before submitting images.')
+        image = torch.as_tensor(image, dtype=torch.float32)
+        if image.dim() == 2:
+            image = image.unsqueeze(0)
+        if self.hit_filter is not None and not self.hit_filter.mask(image.numpy())[0]:
+            return self._filtered()
+        return self._enqueue(image)
+
+    def _filtered(self):
+        with self._lock:
+            self._num_filtered += 1
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def _enqueue(self, image):
+        future = Future()
+        now = time.perf_counter()
+        with self._lock:
+            if self._first_submit is None:
+                self._first_submit = now
+        self._requests.put((image, now, future))
+        return future
+
+    def predict(self, images):
+        """
+        Classifies a stack of images and blocks until all results are available.
+
+        Parameters
+        ----------
+        images: numpy.array or torch.Tensor
+            Thumbnails of shape (N, H, W) or (N, 1, H, W).
+
+        Return
+        ------
+        List of N Predictions (None for images rejected by the hit filter), in the order of images.
+        """
+        if self.hit_filter is None:
+            futures = [self.submit(image) for image in images]
+        else:
+            if self._worker is None:
+                raise RuntimeError('InferenceEngine.start() must be called before submitting images.')
+            images = torch.as_tensor(images, dtype=torch.float32)
+            if images.dim() == 3:
+                images = images.unsqueeze(1)
+            # One vectorized pass over the stack instead of one per submitted image.
+            hits = self.hit_filter.mask(images.numpy())
+            futures = [self._enqueue(image) if hit else self._filtered() for image, hit in zip(images, hits)]
+        return [future.result() for future in futures]
+
+    def stats(self):
+        """
+        Returns latency and throughput of the requests served so far.
+
+        Return
+        ------
+        dict with
+            'num_images': images classified,
+            'p50_ms', 'p99_ms': median and 99th percentile latency from submit() to result,
+            'images_per_sec': images classified per second of wall time since the first submit(),
+            'mean_batch_size': average number of images per forward pass,
+            'num_filtered': images rejected by the hit filter, not counted in the other statistics.
+        """
+        with self._lock:
+            latencies = np.asarray(self._latencies, dtype=np.float64)
+            batch_sizes = np.asarray(self._batch_sizes, dtype=np.float64)
+            num_images = self._num_images
+            num_filtered = self._num_filtered
+            elapsed = None
+            if self._first_submit is not None and self._last_done is not None:
+                elapsed = self._last_done - self._first_submit
+
+        if len(latencies) == 0:
+            return {'num_images': 0, 'p50_ms': None, 'p99_ms': None,
+                    'images_per_sec': None, 'mean_batch_size': None, 'num_filtered': num_filtered}
+        return {
+            'num_images': num_images,
+            'p50_ms': float(np.percentile(latencies, 50) * 1000),
+            'p99_ms': float(np.percentile(latencies, 99) * 1000),
+            'images_per_sec': num_images / elapsed if elapsed else None,
+            'mean_batch_size': float(batch_sizes.mean()),
+            'num_filtered': num_filtered,
+        }
+
+    def reset_stats(self):
+        """ Clears the latency and throughput history. """
+        with self._lock:
+            self._latencies.clear()
+            self._batch_sizes.clear()
+            self._num_images = 0
+            self._num_filtered = 0
+            self._first_submit = None
+            self._last_done = None
+
+    def _next_batch(self):
+        """ Blocks for the first request, then gathers more until the batch is full or its deadline passes. """
+        first = self._requests.get()
+        if first is _STOP:
+            return None, True
+        batch = [first]
+        deadline = first[1] + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self._requests.get(timeout=timeout) if timeout > 0 else self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if batch:
+                self._process(batch)
+
+    def _process(self, batch):
+        images, submitted, futures = zip(*batch)
+        try:
+            with torch.inference_mode():
+                y1, y2 = self.model(torch.stack(images).to(self.device))
+            count_probs = y1.exp().cpu().numpy()
+            particle_probs = y2.exp().cpu().numpy()
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        counts = count_probs.argmax(axis=1)
+        particles = particle_probs.argmax(axis=1)
+        done = time.perf_counter()
+        with self._lock:
+            self._latencies.extend(done - t for t in submitted)
+            self._batch_sizes.append(len(batch))
+            self._num_images += len(batch)
+            self._last_done = done
+        for i, future in enumerate(futures):
+            future.set_result(Prediction(int(counts[i]), int(particles[i]), count_probs[i], particle_probs[i]))
+
+
+############################################################ Socket transport ############################################################
+#
+# Request:  '!III' (n, rows, cols) followed by n * rows * cols float32 pixels.
+# Response: '!III' (n, num_counts, num_particles) followed by n int32 count indices, n int32 particle indices,
+#           n * num_counts float32 count probabilities and n * num_particles float32 particle probabilities.
+#           Images rejected by the hit filter have count and particle index -1 and zero probabilities.
+
+_HEADER = struct.Struct('!III')
+
+
+def _recv_exactly(sock, nbytes):
+    """ Reads exactly nbytes from sock, or returns None if the peer closed the connection. """
+    buf = bytearray(nbytes)
+    view = memoryview(buf)
+    received = 0
+    while received < nbytes:
+        n = sock.recv_into(view[received:], nbytes - received)
+        if n == 0:
+            return None
+        received += n
+    return bytes(buf)
+
+
+class _InferenceHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        engine = self.server.engine
+        while True:
+            header = _recv_exactly(self.request, _HEADER.size)
+            if header is None:
+                return
+            n, rows, cols = _HEADER.unpack(header)
+            payload = _recv_exactly(self.request, n * rows * cols * 4)
+            if payload is None:
+                return
+            images = np.frombuffer(payload, dtype='>f4').reshape(n, rows, cols).astype(np.float32)
+            predictions = engine.predict(images)
+            self.request.sendall(_encode_predictions(predictions))
+
+
+def _encode_predictions(predictions):
+    n = len(predictions)
+    first = next((p for p in predictions if p is not None), None)
+    num_counts = len(first.count_probs) if first is not None else 0
+    num_particles = len(first.particle_probs) if first is not None else 0
+    parts = [_HEADER.pack(n, num_counts, num_particles)]
+    if n:
+        parts.append(np.array([-1 if p is None else p.count for p in predictions], dtype='>i4').tobytes())
+        parts.append(np.array([-1 if p is None else p.particle for p in predictions], dtype='>i4').tobytes())
+        parts.append(np.stack([np.zeros(num_counts) if p is None else p.count_probs
+                               for p in predictions]).astype('>f4').tobytes())
+        parts.append(np.stack([np.zeros(num_particles) if p is None else p.particle_probs
+                               for p in predictions]).astype('>f4').tobytes())
+    return b''.join(parts)
+
+
+class InferenceServer(socketserver.ThreadingTCPServer):
+    """
+    Serves an InferenceEngine on a local TCP socket. Images from all connections
+    share the engine's micro-batches.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, engine, host='127.0.0.1', port=0):
+        """
+        Parameters
+        ----------
+        engine: InferenceEngine
+            Started engine used to classify incoming images.
+        host: str
+            Interface to bind to.
+        port: int
+            Port to listen on. 0 picks a free port; see server_address.
+        """
+        super(InferenceServer, self).__init__((host, port), _InferenceHandler)
+        self.engine = engine
+
+    def serve_in_background(self):
+        """ Runs serve_forever() on a daemon thread and returns the thread. """
+        thread = threading.Thread(target=self.serve_forever, name='InferenceServer', daemon=True)
+        thread.start()
+        return thread
+
+
+def classify_remote(address, images, sock=None):
+    """
+    Sends images to an InferenceServer and returns the Predictions.
+
+    Parameters
+    ----------
+    address: tuple(str, int)
+        (host, port) of the server.
+    images: numpy.array
+        Thumbnails of shape (N, H, W).
+    sock: socket.socket (optional)
+        Open connection to reuse. If None, a connection is opened and closed for this call.
+    """
+    images = np.ascontiguousarray(images, dtype=np.float32)
+    n, rows, cols = images.shape
+    own_sock = sock is None
+    if own_sock:
+        sock = socket.create_connection(address)
+    try:
+        sock.sendall(_HEADER.pack(n, rows, cols) + images.astype('>f4').tobytes())
+        header = _recv_exactly(sock, _HEADER.size)
+        if header is None:
+            raise ConnectionError('InferenceServer closed the connection.')
+        n, num_counts, num_particles = _HEADER.unpack(header)
+        body = _recv_exactly(sock, n * 4 * (2 + num_counts + num_particles))
+        if body is None:
+            raise ConnectionError('InferenceServer closed the connection.')
+    finally:
+        if own_sock:
+            sock.close()
+
+    counts = np.frombuffer(body, dtype='>i4', count=n)
+    offset = n * 4
+    particles = np.frombuffer(body, dtype='>i4', count=n, offset=offset)
+    offset += n * 4
+    count_probs = np.frombuffer(body, dtype='>f4', count=n * num_counts, offset=offset).reshape(n, num_counts)
+    offset += n * num_counts * 4
+    particle_probs = np.frombuffer(body, dtype='>f4', count=n * num_particles, offset=offset).reshape(n, num_particles)
+    return [Prediction(int(counts[i]), int(particles[i]),
+                       count_probs[i].astype(np.float32), particle_probs[i].astype(np.float32))
+            if counts[i] >= 0 else None for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark or serve batched inference for the multi-output classifiers.')
+    parser.add_argument('--model', default='multi_output_cnn_3_layers', choices=sorted(MODELS))
+    parser.add_argument('--checkpoint', default=None, help='Checkpoint to load. Random weights are used if omitted.')
+    parser.add_argument('--num-particles', type=int, default=11)
+    parser.add_argument('--num-counts', type=int, default=4)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-latency-ms', type=float, default=5.0)
+    parser.add_argument('--image-size', type=int, default=128)
+    parser.add_argument('--num-images', type=int, default=2000, help='Number of random thumbnails to classify.')
+    parser.add_argument('--blank-fraction', type=float, default=0.0, help='Fraction of the random thumbnails left blank.')
+    parser.add_argument('--min-photons', type=float, default=None, help='Enable the hit filter with this photon threshold.')
+    parser.add_argument('--min-lit-pixels', type=int, default=0, help='Lit-pixel threshold of the hit filter.')
+    parser.add_argument('--serve', action='store_true', help='Serve on a TCP socket instead of benchmarking.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    args = parser.parse_args()
+
+    model = load_model(args.model, args.num_particles, args.num_counts, checkpoint=args.checkpoint)
+    hit_filter = None
+    if args.min_photons is not None:
+        hit_filter = HitFilter(min_photons=args.min_photons, min_lit_pixels=args.min_lit_pixels)
+    engine = InferenceEngine(model, max_batch_size=args.max_batch_size, max_latency_ms=args.max_latency_ms,
+                             hit_filter=hit_filter)
+
+    with engine:
+        if args.serve:
+            server = InferenceServer(engine, args.host, args.port)
+            print('Serving {} on {}:{}'.format(args.model, *server.server_address))
+            server.serve_forever()
+        else:
+            images = np.random.rand(args.num_images, args.image_size, args.image_size).astype(np.float32)
+            images[:int(args.blank_fraction * args.num_images)] = 0
+            np.random.shuffle(images)
+            engine.predict(images[:args.max_batch_size])  # warm-up
+            engine.reset_stats()
+            start = time.perf_counter()
+            engine.predict(images)
+            elapsed = time.perf_counter() - start
+            stats = engine.stats()
+            # No latencies if the hit filter dropped every frame.
+            if stats['p50_ms'] is None:
+                latency = 'p50 n/a, p99 n/a, mean batch n/a'
+            else:
+                latency = 'p50 {p50_ms:.2f} ms, p99 {p99_ms:.2f} ms, mean batch {mean_batch_size:.1f}'.format(**stats)
+            print('{model}: {num_images} images classified, {num_filtered} filtered, {latency}, '
+                  '{total:.1f} frames/s end to end'.format(model=args.model, latency=latency,
+                                                            total=len(images) / elapsed, **stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+
+Profiles DataLoader settings for the thumbnail dataset and picks the fastest.
+
+profile_loader() iterates a DataLoader for a few epochs and splits every
+step into the time spent waiting for the next batch and the time spent in
+the training step, and measures how busy the loader workers were. tune()
+runs it over a grid of num_workers, batch_size, prefetch_factor,
+pin_memory and persistent_workers, and apply() writes the winner into the
+pipeline's args:
+
+    results = tune(dataset, step_fn=training_step(model, optimizer))
+    apply(args, results[0])   # sets args.num_workers, args.batch_size, ...
+
+Example
+-------
+    python loader_tuning.py --root-dir /path/to/thumbnails --model multi_output_cnn_10_layers --augment
+
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import time
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from multioutput_cnns import MODELS, load_model
+from training import load_dataset, multi_output_loss, PARTICLES, COUNTS
+
+
+GRID = {
+    'num_workers': [0, 1, 2, 4, 8],
+    'batch_size': [64, 128, 256],
+    'prefetch_factor': [2, 4],
+    'pin_memory': [False, True],
+    'persistent_workers': [False, True],
+}
+
+
+class _TimedDataset(Dataset):
+    """ Wraps a dataset and accumulates the seconds spent in __getitem__ across all worker processes. """
+
+    def __init__(self, dataset, busy):
+        self.dataset = dataset
+        self.busy = busy
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        start = time.perf_counter()
+        item = self.dataset[index]
+        elapsed = time.perf_counter() - start
+        with self.busy.get_lock():
+            self.busy.value += elapsed
+        return item
+
+
+def training_step(model, optimizer, device='cpu'):
+    """ Returns a step_fn for profile_loader() that runs one optimizer step of the multi-output model on a batch. """
+    model.train()
+
+    def step(batch):
+        inputs, count_labels, particle_labels = batch
+        y1, y2 = model(inputs.to(device))
+        loss = multi_output_loss(y1, y2, count_labels.to(device), particle_labels.to(device))
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    return step
+
+
+def loader_kwargs(config):
+    """ DataLoader keyword arguments for a configuration; worker-only options are dropped when num_workers is 0. """
+    kwargs = {'batch_size': config['batch_size'], 'num_workers': config['num_workers'],
+              'pin_memory': config.get('pin_memory', False) and torch.cuda.is_available()}
+    if config['num_workers'] > 0:
+        kwargs['prefetch_factor'] = config.get('prefetch_factor', 2)
+        kwargs['persistent_workers'] = config.get('persistent_workers', False)
+    return kwargs
+
+
+def profile_loader(dataset, config, step_fn=None, num_batches=20, epochs=2, warmup=2):
+    """
+    Measures the throughput of one DataLoader configuration.
+
+    Parameters
+    ----------
+    dataset: torch.utils.data.Dataset
+        Dataset to load, with its transforms.
+    config: dict
+        'num_workers', 'batch_size' and optionally 'prefetch_factor', 'pin_memory' and 'persistent_workers'.
+    step_fn: callable (optional)
+        Called on every batch, e.g. training_step(model, optimizer). Without it only loading is timed.
+    num_batches: int
+        Batches timed per epoch.
+    epochs: int
+        Epochs, i.e. DataLoader iterators; worker start-up is paid per epoch unless workers persist.
+    warmup: int
+        Untimed batches at the start of the first epoch.
+
+    Return
+    ------
+    dict with the config plus 'samples_per_sec', 'data_wait_fraction' (share of each step spent waiting
+    for data), 'wait_ms' and 'step_ms' (mean per batch) and 'worker_utilization' (share of the
+    workers' time spent producing samples).
+    """
+    busy = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn').Value('d', 0.0)
+    loader = DataLoader(_TimedDataset(dataset, busy), shuffle=True, drop_last=True, **loader_kwargs(config))
+    num_batches = min(num_batches, len(loader) - warmup)
+    if num_batches < 1:
+        raise ValueError('The dataset is too small for batch_size {}'.format(config['batch_size']))
+
+    wait = step = 0.0
+    samples = 0
+    total = 0.0
+    for epoch in range(epochs):
+        epoch_start = time.perf_counter()
+        iterator = iter(loader)
+        if epoch == 0:
+            for _ in range(warmup):
+                batch = next(iterator)
+                if step_fn is not None:
+                    step_fn(batch)
+            epoch_start = time.perf_counter()
+            with busy.get_lock():
+                busy.value = 0.0
+        for _ in range(num_batches):
+            start = time.perf_counter()
+            batch = next(iterator)
+            fetched = time.perf_counter()
+            if step_fn is not None:
+                step_fn(batch)
+            wait += fetched - start
+            step += time.perf_counter() - fetched
+            samples += len(batch[0])
+        total += time.perf_counter() - epoch_start
+        del iterator
+
+    busy_timed = busy.value
+    workers = max(config['num_workers'], 1)
+    result = dict(config)
+    result.update({
+        'samples_per_sec': samples / total,
+        'data_wait_fraction': wait / max(wait + step, 1e-12),
+        'wait_ms': wait / (epochs * num_batches) * 1000,
+        'step_ms': step / (epochs * num_batches) * 1000,
+        # Prefetched batches beyond the timed ones count as busy time, so this can exceed 1 slightly.
+        'worker_utilization': busy_timed / (workers * total),
+    })
+    return result
+
+
+def configurations(grid=GRID):
+    """ Expands a grid into configurations, skipping duplicates that differ only in worker-only options. """
+    seen = set()
+    for values in itertools.product(*grid.values()):
+        config = dict(zip(grid.keys(), values))
+        if config.get('num_workers', 0) == 0:
+            config['prefetch_factor'] = None
+            config['persistent_workers'] = False
+        key = tuple(sorted(config.items()))
+        if key not in seen:
+            seen.add(key)
+            yield config
+
+
+def tune(dataset, grid=GRID, step_fn=None, num_batches=20, epochs=2, verbose=False):
+    """
+    Profiles every configuration of grid and returns the results, fastest first.
+
+    Parameters
+    ----------
+    dataset: torch.utils.data.Dataset
+        Dataset to load.
+    grid: dict
+        Values to try for each DataLoader option (see GRID).
+    step_fn: callable (optional)
+        Training step, see profile_loader().
+    num_batches, epochs:
+        See profile_loader().
+    verbose: bool
+        Print each result as it is measured.
+    """
+    results = []
+    for config in configurations(grid):
+        if config['num_workers'] > (os.cpu_count() or 1) * 2:
+            continue
+        try:
+            result = profile_loader(dataset, config, step_fn, num_batches, epochs)
+        except ValueError:
+            continue
+        if verbose:
+            print(format_result(result))
+        results.append(result)
+    return sorted(results, key=lambda r: r['samples_per_sec'], reverse=True)
+
+
+def apply(args, result):
+    """
+    Sets args.num_workers, args.batch_size, args.prefetch_factor, args.pin_memory and
+    args.persistent_workers from a tune() result, and returns the matching DataLoader kwargs.
+    """
+    for key in GRID:
+        setattr(args, key, result.get(key))
+    return loader_kwargs(result)
+
+
+def format_result(r):
+    return ('workers {:2d}  batch {:4d}  prefetch {:>4}  pin {:d}  persistent {:d}  | {:8.1f} samples/s  '
+            'wait {:5.1f}%  worker util {:5.1f}%').format(
+        r['num_workers'], r['batch_size'], str(r.get('prefetch_factor')), bool(r.get('pin_memory')),
+        bool(r.get('persistent_workers')), r['samples_per_sec'], r['data_wait_fraction'] * 100,
+        r['worker_utilization'] * 100)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile DataLoader settings and recommend the fastest.')
+    parser.add_argument('--root-dir', default=None, help='Directory containing the thumbnail datasets. Random data if omitted.')
+    parser.add_argument('--length', type=int, default=1000, help='Multi-hit images per dataset (see ThumbnailDataset.from_h5).')
+    parser.add_argument('--model', default=None, choices=sorted(MODELS), help='Include a training step of this model.')
+    parser.add_argument('--augment', action='store_true', help='Apply the flips and random affine of pipeline.ipynb.')
+    parser.add_argument('--num-workers', type=int, nargs='+', default=GRID['num_workers'])
+    parser.add_argument('--batch-size', type=int, nargs='+', default=GRID['batch_size'])
+    parser.add_argument('--prefetch-factor', type=int, nargs='+', default=GRID['prefetch_factor'])
+    parser.add_argument('--num-batches', type=int, default=20)
+    parser.add_argument('--epochs', type=int, default=2)
+    args = parser.parse_args()
+
+    transform = None
+    if args.augment:
+        from torchvision import transforms
+        transform = transforms.Compose([transforms.RandomVerticalFlip(p=0.5),
+                                        transforms.RandomHorizontalFlip(p=0.5),
+                                        transforms.RandomAffine(degrees=360, scale=(0.9, 1.1))])
+    dataset = load_dataset(args.root_dir, args.length, transform=transform)
+
+    step_fn = None
+    if args.model is not None:
+        model = load_model(args.model, len(PARTICLES), len(COUNTS))
+        step_fn = training_step(model, torch.optim.Adam(model.parameters(), lr=0.001))
+
+    grid = dict(GRID, num_workers=args.num_workers, batch_size=args.batch_size, prefetch_factor=args.prefetch_factor)
+    results = tune(dataset, grid, step_fn, args.num_batches, args.epochs, verbose=True)
+    print('\nFastest configuration:')
+    print(format_result(results[0]))
+
+
+if __name__ == "__main__":
+    main()
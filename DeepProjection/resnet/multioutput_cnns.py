@@ -1,282 +1,250 @@
+import re
+
 import torch
 import torch.nn as nn
 import torchvision.models as models
 import torch.nn.functional as F
 from resnet import resnet18, resnet34, resnet50
 
-# 3-layer Multi-Output CNN (Late)
-class MultiOutputCNN_3Layer(nn.Module):
-    def __init__(self, num_particles=11, num_counts=4, hidden_dim=8):
-        super(MultiOutputCNN_3Layer, self).__init__()
-        self.conv1 = nn.Conv2d(1, hidden_dim, 2, 2) # (8, 64, 64)
-        self.conv2 = nn.Conv2d(hidden_dim, hidden_dim * 4, 4, 4) # (32, 16, 16)
-        self.conv3 = nn.Conv2d(hidden_dim * 4, hidden_dim * 16, 4, 4) # (128, 4, 4)
-        self.dropout1 = nn.Dropout(0.25)
-        self.fc1 = nn.Linear(2048, num_counts)
-        self.fc2 = nn.Linear(2048, num_particles)
+
+# Conv layer specs for MultiOutputCNN, one (width, kernel, stride, padding) tuple per conv layer.
+# width is a multiple of hidden_dim; the comments give the output shape for a 128x128 input and hidden_dim=8.
+LAYERS_3 = [(1, 2, 2, 0),   # (8, 64, 64)
+            (4, 4, 4, 0),   # (32, 16, 16)
+            (16, 4, 4, 0)]  # (128, 4, 4)
+
+LAYERS_5 = [(1, 2, 2, 0),   # (8, 64, 64)
+            (2, 2, 2, 0),   # (16, 32, 32)
+            (4, 2, 2, 0),   # (32, 16, 16)
+            (8, 2, 2, 0),   # (64, 8, 8)
+            (16, 2, 2, 0)]  # (128, 4, 4)
+
+LAYERS_10 = [(1, 2, 2, 0),   # (8, 64, 64)
+             (2, 2, 2, 0),   # (16, 32, 32)
+             (4, 2, 2, 0),   # (32, 16, 16)
+             (8, 2, 2, 0),   # (64, 8, 8)
+             (8, 2, 1, 0),   # (64, 7, 7)
+             (8, 2, 1, 0),   # (64, 6, 6)
+             (8, 2, 1, 0),   # (64, 5, 5)
+             (16, 1, 1, 0),  # (128, 5, 5)
+             (16, 2, 1, 0)]  # (128, 4, 4)
+
+LAYERS_18 = [(1, 2, 2, 0),   # (8, 64, 64)
+             (2, 2, 2, 0),   # (16, 32, 32)
+             (4, 2, 2, 0),   # (32, 16, 16)
+             (4, 2, 1, 0),   # (32, 15, 15)
+             (4, 2, 1, 0),   # (32, 14, 14)
+             (4, 2, 1, 0),   # (32, 13, 13)
+             (4, 2, 1, 0),   # (32, 12, 12)
+             (4, 2, 1, 0),   # (32, 11, 11)
+             (4, 2, 1, 0),   # (32, 10, 10)
+             (4, 2, 1, 0),   # (32, 9, 9)
+             (8, 1, 1, 0),   # (64, 9, 9)
+             (8, 2, 1, 0),   # (64, 8, 8)
+             (8, 2, 1, 0),   # (64, 7, 7)
+             (8, 2, 1, 0),   # (64, 6, 6)
+             (8, 2, 1, 0),   # (64, 5, 5)
+             (16, 1, 1, 0),  # (128, 5, 5)
+             (16, 2, 1, 0)]  # (128, 4, 4)
+
+
+def conv_layers(depth, downsample=4, widths=None):
+    """
+    Layer spec for a MultiOutputCNN with depth conv layers, for architecture sweeps.
+
+    The first min(depth, downsample) layers are 2x2 convs with stride 2 that halve the feature map;
+    the rest are padded 3x3 convs with stride 1 that keep its size, so depth can be raised without
+    running out of pixels.
+
+    Parameters
+    ----------
+    depth: int
+        Number of conv layers.
+    downsample: int
+        Number of stride-2 layers.
+    widths: list(int) (optional)
+        Width of each layer as a multiple of hidden_dim. By default the width doubles with every
+        stride-2 layer up to 8, and the last layer has width 16 like the hand-designed specs.
+    """
+    if widths is None:
+        widths = [min(2 ** i, 8) for i in range(depth)]
+        widths[-1] = 16
+    if len(widths) != depth:
+        raise ValueError('widths must have depth={} entries, got {}'.format(depth, len(widths)))
+    return [(width, 2, 2, 0) if i < downsample else (width, 3, 1, 1) for i, width in enumerate(widths)]
+
+
+def output_size(layers, input_size):
+    """ Side length of the feature map produced by layers for an input_size x input_size image. """
+    size = input_size
+    for _, kernel, stride, padding in layers:
+        size = (size + 2 * padding - kernel) // stride + 1
+    if size < 1:
+        raise ValueError('Input of size {} is too small for these layers.'.format(input_size))
+    return size
+
+
+# Multi-Output CNN builder
+class MultiOutputCNN(nn.Module):
+    """
+    Plain CNN with a count head and a particle head.
+
+    The first branch_point conv layers are shared by both heads; every layer after it is built once per head.
+    The last feature map is adaptively average-pooled to pool_size x pool_size before the heads, so any
+    input size works. By default pool_size is the feature-map size the layers produce for input_size,
+    which makes the pooling a no-op at that size.
+    """
+
+    def __init__(self, layers, num_particles=11, num_counts=4, hidden_dim=8, branch_point=None,
+                 input_size=128, pool_size=None, dropout=0.25):
+        """
+        Parameters
+        ----------
+        layers: list(tuple(int, int, int, int))
+            One (width, kernel, stride, padding) tuple per conv layer, with width a multiple of hidden_dim.
+            See LAYERS_3, LAYERS_5, LAYERS_10, LAYERS_18 and conv_layers().
+        num_particles: int
+            Number of particle classes.
+        num_counts: int
+            Number of count classes.
+        hidden_dim: int
+            Base number of channels.
+        branch_point: int (optional)
+            Number of conv layers shared by the two heads. Defaults to len(layers), i.e. branching after the last conv.
+        input_size: int
+            Thumbnail side length the model is designed for.
+        pool_size: int (optional)
+            Side length of the pooled feature map fed to the heads.
+        dropout: float
+            Dropout probability before the heads.
+        """
+        super(MultiOutputCNN, self).__init__()
+        if branch_point is None:
+            branch_point = len(layers)
+        if not 1 <= branch_point <= len(layers):
+            raise ValueError('branch_point must be between 1 and {}, got {}'.format(len(layers), branch_point))
+        if pool_size is None:
+            pool_size = output_size(layers, input_size)
+        self.branch_point = branch_point
+
+        channels = [1] + [width * hidden_dim for width, _, _, _ in layers]
+        convs = [(channels[i], channels[i + 1], kernel, stride, padding)
+                 for i, (_, kernel, stride, padding) in enumerate(layers)]
+        self.trunk = nn.ModuleList([nn.Conv2d(*conv) for conv in convs[:branch_point]])
+        self.branches = nn.ModuleList([nn.ModuleList([nn.Conv2d(*conv) for conv in convs[branch_point:]])
+                                       for _ in range(2)])
+        self.pool = nn.AdaptiveAvgPool2d(pool_size)
+        self.dropout = nn.Dropout(dropout)
+        num_features = channels[-1] * pool_size * pool_size
+        self.heads = nn.ModuleList([nn.Linear(num_features, num_counts), nn.Linear(num_features, num_particles)])
+
+        self._register_load_state_dict_pre_hook(self._rename_legacy_keys)
+
+    def _rename_legacy_keys(self, state_dict, prefix, *args):
+        """
+        Maps the parameter names of the former hand-unrolled classes (conv1, conv3_b1, fc1, fc1_b2, ...)
+        onto trunk/branches/heads, so their checkpoints still load.
+        """
+        for key in list(state_dict):
+            if not key.startswith(prefix):
+                continue
+            name = key[len(prefix):]
+            match = re.match(r'conv(\d+)(?:_b(\d))?\.(.*)', name)
+            if match:
+                layer, branch, param = int(match.group(1)) - 1, match.group(2), match.group(3)
+                if branch is None and layer < self.branch_point:
+                    new_name = 'trunk.{}.{}'.format(layer, param)
+                elif branch is not None:
+                    new_name = 'branches.{}.{}.{}'.format(int(branch) - 1, layer - self.branch_point, param)
+                else:
+                    continue
+            else:
+                match = re.match(r'fc(\d)(?:_b(\d))?\.(.*)', name)
+                if not match:
+                    continue
+                head = int(match.group(2) or match.group(1)) - 1
+                new_name = 'heads.{}.{}'.format(head, match.group(3))
+            state_dict[prefix + new_name] = state_dict.pop(key)
 
     def forward(self, x):
-        x = self.conv1(x)
-        x = F.relu(x)
-        x = self.conv2(x)
-        x = F.relu(x)
-        x = self.conv3(x)
-        x = F.relu(x)
-        x = self.dropout1(x)
-        x = torch.flatten(x, 1)
-
-        y1 = self.fc1(x)
-        y1 = F.log_softmax(y1, dim=1)
-        y2 = self.fc2(x)
-        y2 = F.log_softmax(y2, dim=1)
-        return y1, y2
-    
+        for conv in self.trunk:
+            x = F.relu(conv(x))
+
+        outputs = []
+        for branch, head in zip(self.branches, self.heads):
+            y = x
+            for conv in branch:
+                y = F.relu(conv(y))
+            y = self.dropout(self.pool(y))
+            y = torch.flatten(y, 1)
+            outputs.append(F.log_softmax(head(y), dim=1))
+        return outputs[0], outputs[1]
+
+
+# 3-layer Multi-Output CNN (Late)
+class MultiOutputCNN_3Layer(MultiOutputCNN):
+    def __init__(self, num_particles=11, num_counts=4, hidden_dim=8, input_size=128):
+        super(MultiOutputCNN_3Layer, self).__init__(LAYERS_3, num_particles, num_counts, hidden_dim,
+                                                    input_size=input_size)
+
+
 # 5-Layer Multi-Output CNN (Late)
-class MultiOutputCNN_5Layer(nn.Module):
-    def __init__(self, num_particles=11, num_counts=4, hidden_dim=8):
-        super(MultiOutputCNN_5Layer, self).__init__()
-        self.conv1 = nn.Conv2d(1, hidden_dim, 2, 2) # (8, 64, 64)
-        self.conv2 = nn.Conv2d(hidden_dim, hidden_dim * 2, 2, 2) # (16, 32, 32)
-        self.conv3 = nn.Conv2d(hidden_dim * 2, hidden_dim * 4, 2, 2) # (32, 16, 16)
-        self.conv4 = nn.Conv2d(hidden_dim * 4, hidden_dim * 8, 2, 2) # (64, 8, 8)
-        self.conv5 = nn.Conv2d(hidden_dim * 8, hidden_dim * 16, 2, 2) # (128, 4, 4)
-        self.dropout1 = nn.Dropout(0.25)
-        self.dropout2 = nn.Dropout(0.5)
-        self.fc1 = nn.Linear(2048, num_counts)
-        self.fc2 = nn.Linear(2048, num_particles)
+class MultiOutputCNN_5Layer(MultiOutputCNN):
+    def __init__(self, num_particles=11, num_counts=4, hidden_dim=8, input_size=128):
+        super(MultiOutputCNN_5Layer, self).__init__(LAYERS_5, num_particles, num_counts, hidden_dim,
+                                                    input_size=input_size)
+
 
-    def forward(self, x):
-        x = self.conv1(x)
-        x = F.relu(x)
-        x = self.conv2(x)
-        x = F.relu(x)
-        x = self.conv3(x)
-        x = F.relu(x)
-        x = self.conv4(x)
-        x = F.relu(x)
-        x = self.conv5(x)
-        x = F.relu(x)
-        x = self.dropout1(x)
-        x = torch.flatten(x, 1)
-
-        y1 = self.fc1(x)
-        y1 = F.log_softmax(y1, dim=1)
-        y2 = self.fc2(x)
-        y2 = F.log_softmax(y2, dim=1)
-        return y1, y2
-    
 # 10-Layer Multi-Output CNN (Late)
-class MultiOutputCNN_10Layer(nn.Module):
-    def __init__(self, num_particles=11, num_counts=4, hidden_dim=8):
-        super(MultiOutputCNN_10Layer, self).__init__()
-        self.conv1 = nn.Conv2d(1, hidden_dim, 2, 2) # (8, 64, 64)
-        self.conv2 = nn.Conv2d(hidden_dim, hidden_dim * 2, 2, 2) # (16, 32, 32)
-        self.conv3 = nn.Conv2d(hidden_dim * 2, hidden_dim * 4, 2, 2) # (32, 16, 16)
-        self.conv4 = nn.Conv2d(hidden_dim * 4, hidden_dim * 8, 2, 2) # (64, 8, 8)
-        self.conv5 = nn.Conv2d(hidden_dim * 8, hidden_dim * 8, 2, 1) # (64, 7, 7)
-        self.conv6 = nn.Conv2d(hidden_dim * 8, hidden_dim * 8, 2, 1) # (64, 6, 6)
-        self.conv7 = nn.Conv2d(hidden_dim * 8, hidden_dim * 8, 2, 1) # (64, 5, 5)
-        self.conv8 = nn.Conv2d(hidden_dim * 8, hidden_dim * 16, 1, 1) # (128, 5, 5)
-        self.conv9 = nn.Conv2d(hidden_dim * 16, hidden_dim * 16, 2, 1) # (128, 4, 4)
-        self.dropout1 = nn.Dropout(0.25)
-        self.fc1 = nn.Linear(2048, num_counts)
-        self.fc2 = nn.Linear(2048, num_particles)
+class MultiOutputCNN_10Layer(MultiOutputCNN):
+    def __init__(self, num_particles=11, num_counts=4, hidden_dim=8, input_size=128):
+        super(MultiOutputCNN_10Layer, self).__init__(LAYERS_10, num_particles, num_counts, hidden_dim,
+                                                     input_size=input_size)
+
 
-    def forward(self, x):
-        x = self.conv1(x)
-        x = F.relu(x)
-        x = self.conv2(x)
-        x = F.relu(x)
-        x = self.conv3(x)
-        x = F.relu(x)
-        x = self.conv4(x)
-        x = F.relu(x)
-        x = self.conv5(x)
-        x = F.relu(x)
-        x = self.conv6(x)
-        x = F.relu(x)
-        x = self.conv7(x)
-        x = F.relu(x)
-        x = self.conv8(x)
-        x = F.relu(x)
-        x = self.conv9(x)
-        x = F.relu(x)
-        x = self.dropout1(x)
-        x = torch.flatten(x, 1)
-
-        y1 = self.fc1(x)
-        y1 = F.log_softmax(y1, dim=1)
-        y2 = self.fc2(x)
-        y2 = F.log_softmax(y2, dim=1)
-        return y1, y2
-    
 # 18-Layer Multi-Output CNN
-class MultiOutputCNN_18Layer(nn.Module):
-    def __init__(self, num_particles=11, num_counts=4, hidden_dim=8):
-        super(MultiOutputCNN_18Layer, self).__init__()
-        self.conv1 = nn.Conv2d(1, hidden_dim, 2, 2) # (8, 64, 64)
-        self.conv2 = nn.Conv2d(hidden_dim, hidden_dim * 2, 2, 2) # (16, 32, 32)
-        self.conv3 = nn.Conv2d(hidden_dim * 2, hidden_dim * 4, 2, 2) # (32, 16, 16)
-        self.conv4 = nn.Conv2d(hidden_dim * 4, hidden_dim * 4, 2, 1) # (32, 15, 15)
-        self.conv5 = nn.Conv2d(hidden_dim * 4, hidden_dim * 4, 2, 1) # (32, 14, 14)
-        self.conv6 = nn.Conv2d(hidden_dim * 4, hidden_dim * 4, 2, 1) # (32, 13, 13)
-        self.conv7 = nn.Conv2d(hidden_dim * 4, hidden_dim * 4, 2, 1) # (32, 12, 12)
-        self.conv8 = nn.Conv2d(hidden_dim * 4, hidden_dim * 4, 2, 1) # (32, 11, 11)
-        self.conv9 = nn.Conv2d(hidden_dim * 4, hidden_dim * 4, 2, 1) # (32, 10, 10)
-        self.conv10 = nn.Conv2d(hidden_dim * 4, hidden_dim * 4, 2, 1) # (32, 9, 9)
-        self.conv11 = nn.Conv2d(hidden_dim * 4, hidden_dim * 8, 1, 1) # (64, 9, 9)
-        self.conv12 = nn.Conv2d(hidden_dim * 8, hidden_dim * 8, 2, 1) # (64, 8, 8)
-        self.conv13 = nn.Conv2d(hidden_dim * 8, hidden_dim * 8, 2, 1) # (64, 7, 7)
-        self.conv14 = nn.Conv2d(hidden_dim * 8, hidden_dim * 8, 2, 1) # (64, 6, 6)
-        self.conv15 = nn.Conv2d(hidden_dim * 8, hidden_dim * 8, 2, 1) # (64, 5, 5)
-        self.conv16 = nn.Conv2d(hidden_dim * 8, hidden_dim * 16, 1, 1) # (128, 5, 5)
-        self.conv17 = nn.Conv2d(hidden_dim * 16, hidden_dim * 16, 2, 1) # (128, 4, 4)
-        self.dropout1 = nn.Dropout(0.25)
-        self.fc1 = nn.Linear(2048, num_counts)
-        self.fc2 = nn.Linear(2048, num_particles)
+class MultiOutputCNN_18Layer(MultiOutputCNN):
+    def __init__(self, num_particles=11, num_counts=4, hidden_dim=8, input_size=128):
+        super(MultiOutputCNN_18Layer, self).__init__(LAYERS_18, num_particles, num_counts, hidden_dim,
+                                                     input_size=input_size)
 
-    def forward(self, x):
-        x = self.conv1(x)
-        x = F.relu(x)
-        x = self.conv2(x)
-        x = F.relu(x)
-        x = self.conv3(x)
-        x = F.relu(x)
-        x = self.conv4(x)
-        x = F.relu(x)
-        x = self.conv5(x)
-        x = F.relu(x)
-        x = self.conv6(x)
-        x = F.relu(x)
-        x = self.conv7(x)
-        x = F.relu(x)
-        x = self.conv8(x)
-        x = F.relu(x)
-        x = self.conv9(x)
-        x = F.relu(x)
-        x = self.conv10(x)
-        x = F.relu(x)
-        x = self.conv11(x)
-        x = F.relu(x)
-        x = self.conv12(x)
-        x = F.relu(x)
-        x = self.conv13(x)
-        x = F.relu(x)
-        x = self.conv14(x)
-        x = F.relu(x)
-        x = self.conv15(x)
-        x = F.relu(x)
-        x = self.conv16(x)
-        x = F.relu(x)
-        x = self.conv17(x)
-        x = F.relu(x)
-        x = self.dropout1(x)
-        x = torch.flatten(x, 1)
-
-        y1 = self.fc1(x)
-        y1 = F.log_softmax(y1, dim=1)
-        y2 = self.fc2(x)
-        y2 = F.log_softmax(y2, dim=1)
-        return y1, y2
-    
-# Multi-Output CNN (Early)
-class MultiOutputCNN_Early(nn.Module):
-    def __init__(self, num_particles=11, num_counts=4, hidden_dim=8):
-        super(MultiOutputCNN_Early, self).__init__()
-        
-        
-        self.conv1 = nn.Conv2d(1, hidden_dim, 2, 2) # (8, 64, 64)
-        self.conv2 = nn.Conv2d(hidden_dim, hidden_dim * 2, 2, 2) # (16, 32, 32)
-        
-        #Branched
-        self.conv3_b1 = nn.Conv2d(hidden_dim * 2, hidden_dim * 4, 2, 2) # (32, 16, 16)
-        self.conv4_b1 = nn.Conv2d(hidden_dim * 4, hidden_dim * 8, 2, 2) # (64, 8, 8)
-        self.conv5_b1 = nn.Conv2d(hidden_dim * 8, hidden_dim * 8, 2, 1) # (64, 7, 7)
-        self.conv6_b1 = nn.Conv2d(hidden_dim * 8, hidden_dim * 8, 2, 1) # (64, 6, 6)
-        self.conv7_b1 = nn.Conv2d(hidden_dim * 8, hidden_dim * 8, 2, 1) # (64, 5, 5)
-        self.conv8_b1 = nn.Conv2d(hidden_dim * 8, hidden_dim * 16, 1, 1) # (128, 5, 5)
-        self.conv9_b1 = nn.Conv2d(hidden_dim * 16, hidden_dim * 16, 2, 1) # (128, 4, 4)
-        self.dropout1_b1 = nn.Dropout(0.25)
-        self.fc1_b1 = nn.Linear(2048, num_counts)
-        
-        self.conv3_b2 = nn.Conv2d(hidden_dim * 2, hidden_dim * 4, 2, 2) # (32, 16, 16)
-        self.conv4_b2 = nn.Conv2d(hidden_dim * 4, hidden_dim * 8, 2, 2) # (64, 8, 8)
-        self.conv5_b2 = nn.Conv2d(hidden_dim * 8, hidden_dim * 8, 2, 1) # (64, 7, 7)
-        self.conv6_b2 = nn.Conv2d(hidden_dim * 8, hidden_dim * 8, 2, 1) # (64, 6, 6)
-        self.conv7_b2 = nn.Conv2d(hidden_dim * 8, hidden_dim * 8, 2, 1) # (64, 5, 5)
-        self.conv8_b2 = nn.Conv2d(hidden_dim * 8, hidden_dim * 16, 1, 1) # (128, 5, 5)
-        self.conv9_b2 = nn.Conv2d(hidden_dim * 16, hidden_dim * 16, 2, 1) # (128, 4, 4)
-        self.dropout1_b2 = nn.Dropout(0.25)
-        self.fc1_b2 = nn.Linear(2048, num_particles)
 
-    def forward(self, x):
-        x = self.conv1(x)
-        x = F.relu(x)
-        x = self.conv2(x)
-        x = F.relu(x)
-        
-        #Branched
-        y1 = self.conv3_b1(x)
-        y1 = F.relu(y1)
-        y1 = self.conv4_b1(y1)
-        y1 = F.relu(y1)
-        y1 = self.conv5_b1(y1)
-        y1 = F.relu(y1)
-        y1 = self.conv6_b1(y1)
-        y1 = F.relu(y1)
-        y1 = self.conv7_b1(y1)
-        y1 = F.relu(y1)
-        y1 = self.conv8_b1(y1)
-        y1 = F.relu(y1)
-        y1 = self.conv9_b1(y1)
-        y1 = F.relu(y1)
-        y1 = self.dropout1_b1(y1)
-        y1 = torch.flatten(y1, 1)
-        y1 = self.fc1_b1(y1)
-        y1 = F.log_softmax(y1, dim=1)
-
-        y2 = self.conv3_b2(x)
-        y2 = F.relu(y2)
-        y2 = self.conv4_b2(y2)
-        y2 = F.relu(y2)
-        y2 = self.conv5_b2(y2)
-        y2 = F.relu(y2)
-        y2 = self.conv6_b2(y2)
-        y2 = F.relu(y2)
-        y2 = self.conv7_b2(y2)
-        y2 = F.relu(y2)
-        y2 = self.conv8_b2(y2)
-        y2 = F.relu(y2)
-        y2 = self.conv9_b2(y2)
-        y2 = F.relu(y2)
-        y2 = self.dropout1_b2(y2)
-        y2 = torch.flatten(y2, 1)
-        y2 = self.fc1_b2(y2)
-        y2 = F.log_softmax(y2, dim=1)
+# Multi-Output CNN (Early): the 10-layer CNN branched after the second conv.
+class MultiOutputCNN_Early(MultiOutputCNN):
+    def __init__(self, num_particles=11, num_counts=4, hidden_dim=8, input_size=128):
+        super(MultiOutputCNN_Early, self).__init__(LAYERS_10, num_particles, num_counts, hidden_dim,
+                                                   branch_point=2, input_size=input_size)
 
-        return y1, y2
-    
-# Multi-Output ResNet18
+
+# Multi-Output ResNet18 (torchvision)
 class CustomResNet18Model(nn.Module):
     def __init__(self, num_counts, num_particles):
         super(CustomResNet18Model, self).__init__()
         self.model_resnet = models.resnet18(pretrained=False)
-        self.model_resnet.conv1 = torch.nn.Conv1d(1, 64, (7, 7), (2, 2), (3, 3), bias=True)
-        
-        self.model_resnet.fc.register_forward_hook(lambda m, inp, out: F.dropout(out, p=0.5, training=m.training))
-        
+        self.model_resnet.conv1 = torch.nn.Conv2d(1, 64, (7, 7), (2, 2), (3, 3), bias=True)
+
         num_ftrs = self.model_resnet.fc.in_features
         self.model_resnet.fc = nn.Identity()
+        self.dropout = nn.Dropout(0.5)
         self.fc1 = nn.Linear(num_ftrs, num_counts)
         self.fc2 = nn.Linear(num_ftrs, num_particles)
     def forward(self, x):
         x = self.model_resnet(x)
+        x = self.dropout(x)
         out1 = self.fc1(x)
         y1 = F.log_softmax(out1, dim=1)
         out2 = self.fc2(x)
         y2 = F.log_softmax(out2, dim=1)
         return y1, y2
 
+
+# Multi-Output single-channel ResNet18 built on resnet.ResNet, with the 3x3 stem and channels-last activations.
+def thumbnail_resnet18(num_particles=11, num_counts=4, **kwargs):
+    kwargs.setdefault('small_stem', True)
+    kwargs.setdefault('channels_last', True)
+    return resnet18(num_particles=num_particles, num_counts=num_counts, **kwargs)
+
+
 # Multi-Output VGG16
 class CustomVgg16Model(nn.Module):
     def __init__(self, num_counts, num_particles):
@@ -293,4 +261,60 @@ class CustomVgg16Model(nn.Module):
         y1 = F.log_softmax(out1, dim=1)
         out2 = self.fc2(x)
         y2 = F.log_softmax(out2, dim=1)
-        return y1, y2
\ No newline at end of file
+        return y1, y2
+
+
+# Model names used by the training pipeline, mapped to their constructors.
+# Every constructor accepts the num_particles and num_counts keywords.
+MODELS = {
+    'multi_output_cnn_3_layers': MultiOutputCNN_3Layer,
+    'multi_output_cnn_5_layers': MultiOutputCNN_5Layer,
+    'multi_output_cnn_10_layers': MultiOutputCNN_10Layer,
+    'multi_output_cnn_18_layers': MultiOutputCNN_18Layer,
+    'multi_output_cnn_early': MultiOutputCNN_Early,
+    'multi_output_resnet18': CustomResNet18Model,
+    'multi_output_vgg16': CustomVgg16Model,
+    'resnet18': resnet18,
+    'resnet18_thumbnail': thumbnail_resnet18,
+    'resnet34': resnet34,
+    'resnet50': resnet50,
+}
+
+
+def load_model(name, num_particles=11, num_counts=4, checkpoint=None, map_location='cpu'):
+    """
+    Builds one of the models in MODELS and optionally restores its weights from a checkpoint.
+
+    Parameters
+    ----------
+    name: str
+        Key in MODELS, e.g. 'multi_output_cnn_3_layers' or 'resnet18'.
+    num_particles: int
+        Number of particle classes predicted by the second head.
+    num_counts: int
+        Number of count classes predicted by the first head.
+    checkpoint: str (optional)
+        Path to a file written by torch.save(). Either a bare state_dict or a dictionary
+        holding the state_dict under 'model_state_dict', 'state_dict' or 'model'.
+    map_location: str or torch.device
+        Device to map the checkpoint tensors onto.
+
+    Return
+    ------
+    model: torch.nn.Module
+        The model, in eval mode if a checkpoint was loaded.
+    """
+    if name not in MODELS:
+        raise ValueError('Invalid model type specified. Please select from the following: {}'.format(sorted(MODELS)))
+    model = MODELS[name](num_particles=num_particles, num_counts=num_counts)
+
+    if checkpoint is not None:
+        state = torch.load(checkpoint, map_location=map_location)
+        for key in ('model_state_dict', 'state_dict', 'model'):
+            if isinstance(state, dict) and key in state:
+                state = state[key]
+                break
+        model.load_state_dict(state)
+        model.eval()
+
+    return model
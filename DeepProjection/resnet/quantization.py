@@ -0,0 +1,219 @@
+"""
+
+Post-training int8 quantization of the diffraction classifiers for CPU inference.
+
+Static quantization calibrates activation ranges on a sample of thumbnails
+and converts convolutions (with their BatchNorm and ReLU fused) and linear
+layers to int8 kernels. Quantization-aware fine-tuning trains with fake
+quantization for a few epochs before converting, which recovers accuracy
+when static calibration alone loses too much.
+
+Example
+-------
+    python quantization.py --model resnet18 --checkpoint ./logs/ckpt.pth --root-dir /path/to/thumbnails --qat-epochs 2
+
+"""
+import argparse
+import contextlib
+import copy
+import io
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from torch.ao.quantization import get_default_qconfig_mapping, get_default_qat_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, prepare_qat_fx, convert_fx
+
+from multioutput_cnns import MODELS, load_model
+from training import load_dataset, split, held_out, train_one_epoch, evaluate
+
+
+# Quantized kernel backend for x86 CPUs.
+BACKEND = 'x86'
+
+
+@contextlib.contextmanager
+def quantized_engine(backend=BACKEND):
+    """
+    Sets the process-wide torch.backends.quantized.engine to backend inside the block and restores
+    the previous engine after it. Run a converted model under the engine it was quantized for.
+    """
+    previous = torch.backends.quantized.engine
+    torch.backends.quantized.engine = backend
+    try:
+        yield
+    finally:
+        torch.backends.quantized.engine = previous
+
+
+def _example_inputs(dataloader):
+    inputs = next(iter(dataloader))[0]
+    return (inputs[:1],)
+
+
+def quantize_static(model, calibration_loader, num_batches=10, backend=BACKEND):
+    """
+    Static post-training quantization.
+
+    Parameters
+    ----------
+    model: torch.nn.Module
+        Float model. It is copied, not modified.
+    calibration_loader: torch.utils.data.DataLoader
+        Yields (images, count_labels, particle_labels); only the images are used.
+    num_batches: int
+        Number of batches used to calibrate the activation observers.
+    backend: str
+        Quantized engine, 'x86', 'fbgemm' or 'qnnpack'.
+
+    Return
+    ------
+    torch.fx.GraphModule with int8 weights and activations.
+    """
+    with quantized_engine(backend):
+        prepared = prepare_fx(copy.deepcopy(model).eval(), get_default_qconfig_mapping(backend),
+                              _example_inputs(calibration_loader))
+        with torch.no_grad():
+            for i, (inputs, _, _) in enumerate(calibration_loader):
+                if i >= num_batches:
+                    break
+                prepared(inputs)
+        return convert_fx(prepared)
+
+
+def quantize_aware_finetune(model, train_loader, epochs=1, lr=1e-4, weight_decay=0.0, backend=BACKEND):
+    """
+    Quantization-aware fine-tuning followed by conversion to int8.
+
+    Parameters
+    ----------
+    model: torch.nn.Module
+        Trained float model. It is copied, not modified.
+    train_loader: torch.utils.data.DataLoader
+        Yields (images, count_labels, particle_labels).
+    epochs: int
+        Fine-tuning epochs with fake quantization.
+    lr: float
+        Adam learning rate; keep it well below the one used for float training.
+    weight_decay: float
+        Adam weight decay.
+    backend: str
+        Quantized engine, 'x86', 'fbgemm' or 'qnnpack'.
+
+    Return
+    ------
+    torch.fx.GraphModule with int8 weights and activations.
+    """
+    with quantized_engine(backend):
+        prepared = prepare_qat_fx(copy.deepcopy(model).train(), get_default_qat_qconfig_mapping(backend),
+                                  _example_inputs(train_loader))
+        optimizer = torch.optim.Adam(prepared.parameters(), lr=lr, weight_decay=weight_decay)
+        for _ in range(epochs):
+            train_one_epoch(prepared, optimizer, train_loader)
+        return convert_fx(prepared.eval())
+
+
+def model_size_mb(model):
+    """ Returns the size of model's serialized state_dict in megabytes. """
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1e6
+
+
+def measure_latency(model, batch, repeats=10, warmup=2):
+    """ Returns the median latency, in milliseconds, of a forward pass over batch. """
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(batch)
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(batch)
+            timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1000)
+
+
+def compare(float_model, quantized_model, test_loader, batch_size=256, repeats=10, backend=BACKEND):
+    """
+    Reports the accuracy, latency and size of a quantized model next to its float original.
+
+    Parameters
+    ----------
+    float_model: torch.nn.Module
+        Float model.
+    quantized_model: torch.nn.Module
+        Model returned by quantize_static() or quantize_aware_finetune().
+    test_loader: torch.utils.data.DataLoader
+        Labelled thumbnails to evaluate on.
+    batch_size: int
+        Batch size used to measure latency.
+    repeats: int
+        Timed forward passes per model.
+    backend: str
+        Quantized engine the int8 model was converted for; it runs under quantized_engine(backend).
+
+    Return
+    ------
+    dict with, for 'float' and 'int8', the accuracies, 'latency_ms' and 'size_mb',
+    and under 'delta' the int8 minus float accuracies and the latency/size ratios.
+    """
+    images = next(iter(test_loader))[0]
+    batch = images.repeat((batch_size + len(images) - 1) // len(images), 1, 1, 1)[:batch_size]
+
+    report = {}
+    for key, model in (('float', float_model), ('int8', quantized_model)):
+        with quantized_engine(backend):
+            accuracy, count_accuracy, particle_accuracy, _ = evaluate(model, test_loader)
+            latency_ms = measure_latency(model, batch, repeats)
+        report[key] = {'accuracy': accuracy, 'count_accuracy': count_accuracy,
+                       'particle_accuracy': particle_accuracy, 'latency_ms': latency_ms,
+                       'size_mb': model_size_mb(model)}
+
+    report['delta'] = {
+        'accuracy': report['int8']['accuracy'] - report['float']['accuracy'],
+        'count_accuracy': report['int8']['count_accuracy'] - report['float']['count_accuracy'],
+        'particle_accuracy': report['int8']['particle_accuracy'] - report['float']['particle_accuracy'],
+        'speedup': report['float']['latency_ms'] / report['int8']['latency_ms'],
+        'size_reduction': report['float']['size_mb'] / report['int8']['size_mb'],
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Quantize a diffraction classifier to int8 and compare it with float32.')
+    parser.add_argument('--model', default='multi_output_cnn_10_layers', choices=sorted(MODELS))
+    parser.add_argument('--checkpoint', required=True)
+    parser.add_argument('--root-dir', default=None, help='Directory containing the thumbnail datasets. Random data if omitted.')
+    parser.add_argument('--length', type=int, default=1000, help='Multi-hit images per dataset (see ThumbnailDataset.from_h5).')
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--calibration-batches', type=int, default=10)
+    parser.add_argument('--qat-epochs', type=int, default=0, help='If > 0, fine-tune with fake quantization instead of calibrating only.')
+    parser.add_argument('--qat-lr', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.root_dir, args.length)
+    # Calibrate or fine-tune on the training split and compare on the held-out test images.
+    train_set, _ = split(dataset)
+    train_loader = DataLoader(train_set, batch_size=args.batch_size, shuffle=True)
+    test_loader = DataLoader(held_out(dataset), batch_size=args.batch_size)
+
+    model = load_model(args.model, checkpoint=args.checkpoint)
+    if args.qat_epochs > 0:
+        quantized = quantize_aware_finetune(model, train_loader, epochs=args.qat_epochs, lr=args.qat_lr)
+    else:
+        quantized = quantize_static(model, train_loader, num_batches=args.calibration_batches)
+
+    report = compare(model, quantized, test_loader)
+    print('{:>6} {:>9} {:>9} {:>9} {:>11} {:>9}'.format('', 'total %', 'count %', 'particle %', 'latency ms', 'size MB'))
+    for key in ('float', 'int8'):
+        r = report[key]
+        print('{:>6} {:9.2f} {:9.2f} {:10.2f} {:11.2f} {:9.2f}'.format(
+            key, r['accuracy'], r['count_accuracy'], r['particle_accuracy'], r['latency_ms'], r['size_mb']))
+    d = report['delta']
+    print('delta: total {:+.2f}, count {:+.2f}, particle {:+.2f}; {:.2f}x faster, {:.2f}x smaller'.format(
+        d['accuracy'], d['count_accuracy'], d['particle_accuracy'], d['speedup'], d['size_reduction']))
+
+
+if __name__ == "__main__":
+    main()
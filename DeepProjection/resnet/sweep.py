@@ -0,0 +1,391 @@
+"""
+
+Learning-rate x weight-decay sweeps over a process pool, with ASHA early stopping.
+
+Each trial trains one configuration for a number of epochs on a worker
+process, checkpoints itself and reports its per-epoch metrics. With
+scheduler='asha' (asynchronous successive halving) every trial starts with
+min_epochs; a trial is promoted to eta times more epochs only while it ranks
+in the top 1/eta of the trials that reached the same rung, so losing
+configurations stop early and free their worker for the next one.
+scheduler='grid' trains every configuration for max_epochs.
+
+Every finished epoch is appended to a JSON-lines results file, from which
+plot_heatmap() draws the accuracy heatmaps of visualization.ipynb.
+
+Example
+-------
+    python sweep.py --root-dir /path/to/thumbnails --workers 4 --max-epochs 27 --results sweep.jsonl
+    python sweep.py --plot sweep.jsonl --metric particle_accuracy
+
+"""
+import argparse
+import functools
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+import torch
+
+from multioutput_cnns import MODELS, load_model
+from training import load_dataset, get_dataloaders, train_one_epoch, evaluate, checkpoint_state_dict, PARTICLES, COUNTS
+
+
+# Grid of visualization.ipynb.
+LEARNING_RATES = [0.002, 0.001, 0.0005, 0.0001]
+WEIGHT_DECAYS = [0.01, 0.005, 0.0025, 0.001]
+
+METRICS = ['accuracy', 'count_accuracy', 'particle_accuracy']
+METRIC_LABELS = {'accuracy': 'total', 'count_accuracy': 'count', 'particle_accuracy': 'particle'}
+
+
+############################################################ Worker side ############################################################
+
+_worker_dataset = None
+
+
+def _init_worker(dataset_fn, num_threads):
+    global _worker_dataset
+    torch.set_num_threads(num_threads)
+    _worker_dataset = dataset_fn()
+
+
+def run_trial(trial, config, start_epoch, stop_epoch, workdir, batch_size=128, dataset=None):
+    """
+    Trains a trial from start_epoch to stop_epoch, resuming from and updating its checkpoint in workdir.
+
+    Parameters
+    ----------
+    trial: int
+        Trial id.
+    config: dict
+        'model', 'lr' and 'weight_decay'.
+    start_epoch, stop_epoch: int
+        Epochs already trained and epochs to reach.
+    workdir: str
+        Directory of the trial checkpoints.
+    batch_size: int
+        Batch size.
+    dataset: ThumbnailDataset (optional)
+        Defaults to the dataset built by the worker initializer.
+
+    Return
+    ------
+    List of per-epoch dicts with 'epoch', 'wall_time', 'loss', 'accuracy', 'count_accuracy',
+    'particle_accuracy' and 'valid_loss'.
+    """
+    dataset = _worker_dataset if dataset is None else dataset
+    # Trials are compared on the validation set of the split in training.py.
+    generator = torch.Generator().manual_seed(trial * 1000 + start_epoch)
+    train_loader, valid_loader = get_dataloaders(dataset, batch_size, generator=generator)
+
+    torch.manual_seed(trial)
+    model = load_model(config['model'], len(PARTICLES), len(COUNTS))
+    optimizer = torch.optim.Adam(model.parameters(), lr=config['lr'], weight_decay=config['weight_decay'])
+    ckpt_path = os.path.join(workdir, 'trial_{}.pth'.format(trial))
+    if start_epoch > 0:
+        checkpoint = torch.load(ckpt_path)
+        model.load_state_dict(checkpoint['model_state_dict'])
+        optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+
+    history = []
+    for epoch in range(start_epoch, stop_epoch):
+        stats = train_one_epoch(model, optimizer, train_loader)
+        accuracy, count_accuracy, particle_accuracy, valid_loss = evaluate(model, valid_loader)
+        history.append({'epoch': epoch + 1, 'wall_time': stats['wall_time'], 'loss': stats['loss'],
+                        'accuracy': accuracy, 'count_accuracy': count_accuracy,
+                        'particle_accuracy': particle_accuracy, 'valid_loss': valid_loss})
+
+    torch.save({'epoch': stop_epoch, 'model_state_dict': checkpoint_state_dict(model),
+                'optimizer_state_dict': optimizer.state_dict()}, ckpt_path)
+    return history
+
+
+############################################################ Scheduler side ############################################################
+
+def rung_epochs(min_epochs, max_epochs, eta):
+    """ Epoch budgets of the successive-halving rungs: min_epochs * eta**k, capped at max_epochs. """
+    epochs = [min_epochs]
+    while epochs[-1] < max_epochs:
+        epochs.append(min(epochs[-1] * eta, max_epochs))
+    return epochs
+
+
+class ASHA:
+    """
+    Asynchronous successive halving: decides which trial a free worker runs next.
+    """
+
+    def __init__(self, num_trials, rungs, eta=3):
+        self.rungs = rungs
+        self.eta = eta
+        self.pending = list(range(num_trials))
+        # results[k] maps trial to its metric at rung k; promoted[k] holds the trials moved on from rung k.
+        self.results = [dict() for _ in rungs]
+        self.promoted = [set() for _ in rungs]
+        self.failed = set()
+
+    def next_job(self):
+        """ Returns (trial, rung) to run next, or None if nothing can run until more results arrive. """
+        for k in reversed(range(len(self.rungs) - 1)):
+            ranked = sorted(self.results[k], key=self.results[k].get, reverse=True)
+            for trial in ranked[:len(ranked) // self.eta]:
+                if trial not in self.promoted[k]:
+                    self.promoted[k].add(trial)
+                    return trial, k + 1
+        if self.pending:
+            return self.pending.pop(0), 0
+        return None
+
+    def report(self, trial, rung, metric):
+        self.results[rung][trial] = metric
+
+    def fail(self, trial):
+        """ Marks a trial that returned no result; it is not promoted further. """
+        self.failed.add(trial)
+
+    def status(self, trial):
+        """ 'failed' if a job of the trial returned no epochs, 'completed' if it reached the last rung, else 'pruned'. """
+        if trial in self.failed:
+            return 'failed'
+        return 'completed' if trial in self.results[-1] else 'pruned'
+
+
+class Grid(ASHA):
+    """ Runs every trial straight to the last rung. """
+
+    def __init__(self, num_trials, rungs):
+        super(Grid, self).__init__(num_trials, [rungs[-1]], eta=1)
+
+
+def sweep(dataset_fn, results_path, learning_rates=LEARNING_RATES, weight_decays=WEIGHT_DECAYS,
+          model_name='multi_output_cnn_10_layers', scheduler='asha', min_epochs=1, max_epochs=9, eta=3,
+          metric='accuracy', workers=None, batch_size=128, workdir=None):
+    """
+    Runs a learning-rate x weight-decay sweep.
+
+    Parameters
+    ----------
+    dataset_fn: callable
+        Picklable function returning the ThumbnailDataset, called once per worker,
+        e.g. functools.partial(training.load_dataset, root_dir).
+    results_path: str
+        JSON-lines file that every finished epoch is appended to; it is truncated when the sweep
+        starts, so it only holds the records of this sweep.
+    learning_rates, weight_decays: list(float)
+        The grid.
+    model_name: str
+        Key of multioutput_cnns.MODELS.
+    scheduler: str
+        'asha' or 'grid'.
+    min_epochs, max_epochs: int
+        Epochs of the first and last rung.
+    eta: int
+        Reduction factor: 1/eta of the trials are promoted to eta times more epochs.
+    metric: str
+        Validation metric used for promotion.
+    workers: int (optional)
+        Worker processes. Defaults to the number of cores.
+    batch_size: int
+        Batch size.
+    workdir: str (optional)
+        Directory for trial checkpoints. Defaults to the directory of results_path.
+
+    Return
+    ------
+    List of the records written to results_path.
+    """
+    configs = [{'model': model_name, 'lr': lr, 'weight_decay': wd}
+               for lr, wd in itertools.product(learning_rates, weight_decays)]
+    rungs = rung_epochs(min_epochs, max_epochs, eta)
+    if scheduler == 'asha':
+        schedule = ASHA(len(configs), rungs, eta)
+    elif scheduler == 'grid':
+        schedule = Grid(len(configs), rungs)
+    else:
+        raise ValueError("scheduler must be 'asha' or 'grid', got {}".format(scheduler))
+
+    workers = workers or os.cpu_count() or 1
+    workdir = workdir or os.path.dirname(os.path.abspath(results_path))
+    os.makedirs(workdir, exist_ok=True)
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+    epochs_done = {}
+    records = []
+    start = time.perf_counter()
+    # results_grid() takes the last record of each configuration, so records of an earlier sweep must not remain.
+    open(results_path, 'w').close()
+
+    def write(record):
+        records.append(record)
+        with open(results_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(dataset_fn, num_threads)) as pool:
+        running = {}
+        while True:
+            while len(running) < workers:
+                job = schedule.next_job()
+                if job is None:
+                    break
+                trial, rung = job
+                stop_epoch = schedule.rungs[rung]
+                future = pool.submit(run_trial, trial, configs[trial], epochs_done.get(trial, 0), stop_epoch,
+                                     workdir, batch_size)
+                running[future] = (trial, rung, stop_epoch)
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                trial, rung, stop_epoch = running.pop(future)
+                history = future.result()
+                if not history:
+                    schedule.fail(trial)
+                    continue
+                for epoch in history:
+                    write(dict(epoch, trial=trial, config=configs[trial], rung=rung,
+                               elapsed=time.perf_counter() - start))
+                epochs_done[trial] = stop_epoch
+                schedule.report(trial, rung, history[-1][metric])
+
+    for trial, config in enumerate(configs):
+        write({'trial': trial, 'config': config, 'status': schedule.status(trial),
+               'epochs': epochs_done.get(trial, 0)})
+    return records
+
+
+############################################################ Results ############################################################
+
+def load_results(path):
+    """ Reads the records of a sweep results file. """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def results_grid(records, metric='accuracy'):
+    """
+    Arranges the last recorded value of metric for each configuration as a learning-rate x weight-decay matrix.
+
+    Return
+    ------
+    learning_rates: list(float)
+        Rows, in decreasing order as in visualization.ipynb.
+    weight_decays: list(float)
+        Columns, in decreasing order.
+    values: numpy.array
+        Metric of each cell, NaN if no trial ran it.
+    epochs: numpy.array
+        Epochs trained in each cell; cells of pruned trials have fewer than the maximum.
+    """
+    last = {}
+    for record in records:
+        if metric in record:
+            last[(record['config']['lr'], record['config']['weight_decay'])] = record
+    learning_rates = sorted({lr for lr, _ in last}, reverse=True)
+    weight_decays = sorted({wd for _, wd in last}, reverse=True)
+    values = np.full((len(learning_rates), len(weight_decays)), np.nan)
+    epochs = np.zeros(values.shape, dtype=int)
+    for (lr, wd), record in last.items():
+        i, j = learning_rates.index(lr), weight_decays.index(wd)
+        values[i, j] = record[metric]
+        epochs[i, j] = record['epoch']
+    return learning_rates, weight_decays, values, epochs
+
+
+def plot_heatmap(records, metric='particle_accuracy', ax=None, path=None):
+    """
+    Draws the learning-rate x weight-decay heatmap of visualization.ipynb from sweep records.
+
+    Cells of trials stopped early are annotated with the epochs they trained for.
+
+    Parameters
+    ----------
+    records: list(dict) or str
+        Records returned by sweep() or load_results(), or the path of a results file.
+    metric: str
+        'accuracy', 'count_accuracy' or 'particle_accuracy'.
+    ax: matplotlib.axes.Axes (optional)
+        Axes to draw on; a new figure is created otherwise.
+    path: str (optional)
+        If given, the figure is saved there.
+
+    Return
+    ------
+    matplotlib.axes.Axes
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib.colors as colors
+
+    if isinstance(records, str):
+        records = load_results(records)
+    learning_rates, weight_decays, values, epochs = results_grid(records, metric)
+
+    if ax is None:
+        _, ax = plt.subplots()
+    fig = ax.figure
+    vmin, vmax = np.floor(np.nanmin(values)) - 1, np.ceil(np.nanmax(values)) + 1
+    im = ax.imshow(values, cmap='YlOrRd', norm=colors.LogNorm(vmin=max(vmin, 1e-3), vmax=vmax))
+
+    ax.set_xticks(np.arange(len(weight_decays)))
+    ax.set_yticks(np.arange(len(learning_rates)))
+    ax.set_xticklabels(weight_decays)
+    ax.set_yticklabels(learning_rates)
+    ax.set_xlabel('Weight decay')
+    ax.set_ylabel('Learning rate')
+    cbar = fig.colorbar(im, ax=ax, format='%.0f')
+    cbar.ax.set_ylabel('Validation {} accuracy'.format(METRIC_LABELS.get(metric, metric)), rotation=-90,
+                       va="bottom", fontsize=11)
+    plt.setp(ax.get_xticklabels(), rotation=45, ha="right", rotation_mode="anchor")
+    plt.setp(ax.get_yticklabels(), rotation=45, ha="right", rotation_mode="anchor")
+
+    max_epochs = epochs.max()
+    for i in range(len(learning_rates)):
+        for j in range(len(weight_decays)):
+            if np.isnan(values[i, j]):
+                continue
+            text = '{:.1f}'.format(values[i, j])
+            if epochs[i, j] < max_epochs:
+                text += '\n({} ep)'.format(epochs[i, j])
+            ax.text(j, i, text, ha="center", va="center", color="w", fontsize=10)
+
+    fig.tight_layout()
+    if path is not None:
+        fig.savefig(path, dpi=150)
+    return ax
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Learning-rate x weight-decay sweep with ASHA early stopping.')
+    parser.add_argument('--model', default='multi_output_cnn_10_layers', choices=sorted(MODELS))
+    parser.add_argument('--root-dir', default=None, help='Directory containing the thumbnail datasets. Random data if omitted.')
+    parser.add_argument('--length', type=int, default=1000, help='Multi-hit images per dataset (see ThumbnailDataset.from_h5).')
+    parser.add_argument('--lr', type=float, nargs='+', default=LEARNING_RATES)
+    parser.add_argument('--weight-decay', type=float, nargs='+', default=WEIGHT_DECAYS)
+    parser.add_argument('--scheduler', default='asha', choices=['asha', 'grid'])
+    parser.add_argument('--min-epochs', type=int, default=1)
+    parser.add_argument('--max-epochs', type=int, default=9)
+    parser.add_argument('--eta', type=int, default=3)
+    parser.add_argument('--metric', default='accuracy', choices=METRICS, help='Validation metric used for promotion.')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--results', default='sweep.jsonl')
+    parser.add_argument('--plot', default=None, help='Only draw heatmaps from this results file.')
+    args = parser.parse_args()
+
+    if args.plot is None:
+        dataset_fn = functools.partial(load_dataset, args.root_dir, args.length)
+        sweep(dataset_fn, args.results, args.lr, args.weight_decay, args.model, args.scheduler, args.min_epochs,
+              args.max_epochs, args.eta, args.metric, args.workers, args.batch_size)
+
+    results = args.plot or args.results
+    for metric in METRICS:
+        path = os.path.splitext(results)[0] + '_{}.png'.format(metric)
+        plot_heatmap(results, metric, path=path)
+        print('{} heatmap saved to {}'.format(metric, path))
+
+
+if __name__ == "__main__":
+    main()
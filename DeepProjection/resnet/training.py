@@ -0,0 +1,286 @@
+"""
+
+Dataset, loss and train/evaluate loops for the multi-output classifiers.
+
+These are the pieces of pipeline.ipynb that the scripts in this directory
+share. Labels follow the notebook: particle2idx for the PDB ID and
+count2idx for the number of particles per shot.
+
+train_one_epoch() and evaluate() optionally run the forward pass under
+bfloat16 autocast and feed channels-last inputs; see compare_precision.py.
+Parameters stay float32 in either mode, so checkpoints are interchangeable.
+
+"""
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Dataset, Subset
+
+
+# Particles and particle counts of the thumbnail datasets.
+PARTICLES = ['1fpv', '1ss8', '3j03', '1ijg', '3iyf', '6ody', '6sp2', '6xs6', '7dwz', '7dx8', '7dx9']
+COUNTS = ['single', 'double', 'triple', 'quadruple']
+
+particle2idx = {particle: i for i, particle in enumerate(PARTICLES)}
+count2idx = {count: i for i, count in enumerate(COUNTS)}
+
+# Weight of the count loss relative to the particle loss (Section 4.2 of the paper cited in pipeline.ipynb).
+COUNT_LOSS_WEIGHT = 4
+
+
+def thumbnail_file(root_dir, particle, count, n=None):
+    """
+    Returns the path of the thumbnail dataset of n images for one particle and count. The size is
+    written in thousands ('4k') if n is a multiple of 1000, and as the exact count ('1500') otherwise.
+    By default single-hit datasets hold 4k images, multi-hit datasets 1k.
+    """
+    if n is None:
+        n = 4000 if count == 'single' else 1000
+    size = f'{n // 1000}k' if n and n % 1000 == 0 else str(n)
+    return f'{root_dir}/SPI_{particle}_{size}_{count}_thumbnail.h5'
+
+
+class ThumbnailDataset(Dataset):
+    """
+    Diffraction thumbnails with their count and particle labels.
+    """
+
+    def __init__(self, images, count_labels, particle_labels, transform=None):
+        """
+        Parameters
+        ----------
+        images: numpy.array
+            Thumbnails of shape (N, H, W).
+        count_labels: numpy.array
+            Count class index of each image, shape (N,).
+        particle_labels: numpy.array
+            Particle class index of each image, shape (N,).
+        transform: callable (optional)
+            Applied to each (1, H, W) float32 tensor before it is returned.
+        """
+        if not len(images) == len(count_labels) == len(particle_labels):
+            raise ValueError('images, count_labels and particle_labels must have the same length.')
+        self.images = np.ascontiguousarray(images, dtype=np.float32)
+        self.count_labels = np.asarray(count_labels, dtype=np.int64)
+        self.particle_labels = np.asarray(particle_labels, dtype=np.int64)
+        self.transform = transform
+
+    @classmethod
+    def from_h5(cls, root_dir, particles=PARTICLES, counts=COUNTS, length=1000, transform=None, seed=1234,
+                n_single=4000, n_multi=1000):
+        """
+        Loads the thumbnail_file() datasets and shuffles them with seed, as CustomDataset in pipeline.ipynb does.
+
+        Parameters
+        ----------
+        root_dir: str
+            Directory containing the thumbnail datasets.
+        particles: list(str)
+            PDB IDs to load.
+        counts: list(str)
+            Count types to load.
+        length: int
+            Multi-hit images per dataset; single-hit datasets contribute 4 * length images.
+        transform: callable (optional)
+            See __init__.
+        seed: int
+            Seed for the shuffle.
+        n_single, n_multi: int
+            Images in each single-hit and multi-hit file, as passed to dataset_generator.generate();
+            they select the file names.
+        """
+        import h5py
+
+        images, count_labels, particle_labels = [], [], []
+        for particle in particles:
+            for count in counts:
+                n = (4 if count == 'single' else 1) * length
+                path = thumbnail_file(root_dir, particle, count, n_single if count == 'single' else n_multi)
+                with h5py.File(path, 'r') as f:
+                    images.append(f[list(f.keys())[0]][:n].astype(np.float32))
+                count_labels.append(np.full(n, count2idx[count]))
+                particle_labels.append(np.full(n, particle2idx[particle]))
+
+        perm = np.random.RandomState(seed).permutation(sum(len(x) for x in images))
+        return cls(np.concatenate(images)[perm], np.concatenate(count_labels)[perm],
+                   np.concatenate(particle_labels)[perm], transform=transform)
+
+    def __len__(self):
+        '''Denotes the total number of samples'''
+        return len(self.images)
+
+    def __getitem__(self, index):
+        '''Generates one sample of data'''
+        X = torch.from_numpy(self.images[index]).unsqueeze(0)
+        if self.transform is not None:
+            X = self.transform(X)
+        return X, self.count_labels[index], self.particle_labels[index]
+
+
+def random_dataset(length=1000, transform=None, seed=0):
+    """
+    Random 128x128 thumbnails with random labels, as many as ThumbnailDataset.from_h5() loads
+    for one particle (4 * length single-hit and 3 * length multi-hit images). Used by the scripts
+    in this directory when no thumbnail datasets are given.
+    """
+    rng = np.random.RandomState(seed)
+    n = 7 * length
+    return ThumbnailDataset(rng.rand(n, 128, 128), rng.randint(0, len(COUNTS), n), rng.randint(0, len(PARTICLES), n),
+                            transform=transform)
+
+
+def load_dataset(root_dir=None, length=1000, transform=None):
+    """ The thumbnail datasets in root_dir (see ThumbnailDataset.from_h5()), or random_dataset() if root_dir is None. """
+    if root_dir is not None:
+        return ThumbnailDataset.from_h5(root_dir, length=length, transform=transform)
+    return random_dataset(length, transform=transform)
+
+
+def split(dataset):
+    """
+    Same 70/10/20 split as get_dataloaders() in pipeline.ipynb.
+
+    Return
+    ------
+    (train_set, valid_set) subsets of dataset; the last 20% are held out for testing (see held_out()).
+    """
+    n = len(dataset)
+    return Subset(dataset, range(0, int(n * 0.7))), Subset(dataset, range(int(n * 0.7), int(n * 0.8)))
+
+
+def held_out(dataset):
+    """ The last 20% of dataset, which split() leaves out of training and validation. """
+    n = len(dataset)
+    return Subset(dataset, range(int(n * 0.8), n))
+
+
+def get_dataloaders(dataset, batch_size=128, num_workers=0, generator=None):
+    """
+    Training (shuffled with generator) and validation DataLoaders of the split() of dataset.
+    """
+    train_set, valid_set = split(dataset)
+    train_loader = DataLoader(train_set, batch_size=batch_size, shuffle=True, num_workers=num_workers,
+                              generator=generator)
+    valid_loader = DataLoader(valid_set, batch_size=batch_size, num_workers=num_workers)
+    return train_loader, valid_loader
+
+
+def multi_output_loss(y1, y2, count_labels, particle_labels):
+    """
+    Weighted loss of a multi-output model.
+
+    Parameters
+    ----------
+    y1, y2: torch.Tensor
+        Count and particle log-probabilities returned by the model.
+    count_labels, particle_labels: torch.Tensor
+        Class indices.
+    """
+    return COUNT_LOSS_WEIGHT * F.nll_loss(y1, count_labels) + F.nll_loss(y2, particle_labels)
+
+
+def autocast(device='cpu', amp_dtype=None):
+    """ Autocast context for device running in amp_dtype (e.g. torch.bfloat16); a no-op if amp_dtype is None. """
+    return torch.autocast(device_type=torch.device(device).type, dtype=amp_dtype, enabled=amp_dtype is not None)
+
+
+def to_channels_last(model):
+    """ Converts the 4D parameters and buffers of model to the channels-last memory format, in place. """
+    return model.to(memory_format=torch.channels_last)
+
+
+def checkpoint_state_dict(model):
+    """
+    Returns model's state_dict with every tensor in the default contiguous layout.
+
+    Checkpoints written from a channels-last model then match those of a float32 NCHW model
+    and load into either with load_state_dict() or multioutput_cnns.load_model().
+    """
+    return {k: v.contiguous() if isinstance(v, torch.Tensor) else v for k, v in model.state_dict().items()}
+
+
+def _to_device(inputs, device, channels_last):
+    if channels_last:
+        return inputs.to(device, memory_format=torch.channels_last)
+    return inputs.to(device)
+
+
+def train_one_epoch(model, optimizer, dataloader, device='cpu', scheduler=None, amp_dtype=None, channels_last=False,
+                    step_callback=None):
+    """
+    Trains model for one pass over dataloader.
+
+    With amp_dtype (e.g. torch.bfloat16) the forward pass runs under autocast while the
+    parameters, gradients and optimizer state stay float32. With channels_last the inputs are
+    converted to the channels-last memory format; convert the model with to_channels_last() too.
+    step_callback(batch, loss), if given, is called after every optimizer step, e.g. to checkpoint.
+
+    Return
+    ------
+    dict with the mean 'loss', the number of 'samples' and the 'wall_time' in seconds.
+    """
+    model.train()
+    start = time.perf_counter()
+    total_loss = 0.0
+    num_samples = 0
+    for batch, (inputs, count_labels, particle_labels) in enumerate(dataloader):
+        inputs = _to_device(inputs, device, channels_last)
+        with autocast(device, amp_dtype):
+            y1, y2 = model(inputs)
+        loss = multi_output_loss(y1.float(), y2.float(), count_labels.to(device), particle_labels.to(device))
+
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        if scheduler is not None:
+            scheduler.step()
+
+        total_loss += loss.item() * len(inputs)
+        num_samples += len(inputs)
+        if step_callback is not None:
+            step_callback(batch, loss.item())
+
+    return {'loss': total_loss / max(num_samples, 1), 'samples': num_samples,
+            'wall_time': time.perf_counter() - start}
+
+
+def evaluate(model, dataloader, device='cpu', amp_dtype=None, channels_last=False):
+    """
+    Evaluates a multi-output model, optionally under autocast and with channels-last inputs (see train_one_epoch()).
+
+    Return
+    ------
+    accuracy: float
+        Percentage of images with both count and particle predicted correctly.
+    count_accuracy: float
+        Percentage of images with the count predicted correctly.
+    particle_accuracy: float
+        Percentage of images with the particle predicted correctly.
+    loss: float
+        Mean weighted loss per image.
+    """
+    model.eval()
+    loss = 0.0
+    correct = correct_count = correct_particle = 0
+    num_samples = 0
+    with torch.no_grad():
+        for inputs, count_labels, particle_labels in dataloader:
+            with autocast(device, amp_dtype):
+                y1, y2 = model(_to_device(inputs, device, channels_last))
+            y1, y2 = y1.float(), y2.float()
+            count_labels = count_labels.to(device)
+            particle_labels = particle_labels.to(device)
+            loss += multi_output_loss(y1, y2, count_labels, particle_labels).item() * len(inputs)
+
+            count_ok = y1.argmax(dim=1) == count_labels
+            particle_ok = y2.argmax(dim=1) == particle_labels
+            correct += (count_ok & particle_ok).sum().item()
+            correct_count += count_ok.sum().item()
+            correct_particle += particle_ok.sum().item()
+            num_samples += len(inputs)
+
+    num_samples = max(num_samples, 1)
+    return (correct / num_samples * 100, correct_count / num_samples * 100,
+            correct_particle / num_samples * 100, loss / num_samples)
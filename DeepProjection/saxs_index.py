@@ -0,0 +1,260 @@
+"""
+
+Similarity search over the SAXS curves written by generateSAXS.py.
+
+Every {pdb_id}.npz curve (qs, saxs) is resampled onto a common log-spaced q
+grid as log10 intensity and centered, so that curves differing only by an
+overall intensity scale are identical. The curves form one float32 matrix,
+and a batch of queries is scored against all of it with one matrix product:
+
+    cosine     a . b / (|a| |b|)          higher is more similar
+    chi2       |a - b|^2 / grid size      lower is more similar; the mean squared
+                                          log10 residual after the best scale factor
+
+With fit_pca() the curves are also projected on their leading principal
+components and search(approximate=True) scores in that space, then re-ranks
+the best candidates exactly. knn_graph() computes the k nearest neighbours
+of every curve in row chunks, so all pairs never have to be in memory.
+
+Example
+-------
+    python saxs_index.py --data-dir ./data --index ./saxs_index --query 1fpv 3iyf --k 10
+
+    index = SAXSIndex.from_directory('./data')
+    index.save('./saxs_index')
+    index = SAXSIndex.load('./saxs_index')
+    ids, scores = index.search_curves([np.load('query.npz')], k=10)
+    neighbours, scores = index.knn_graph(k=8)
+
+"""
+import argparse
+import glob
+import os
+
+import numpy as np
+
+
+def log_q_grid(qmin=2e7, qmax=9.5e8, size=128):
+    """ Log-spaced q grid, in m^-1. The default covers the curves of generateSAXS.py (resmax 1e-9 m). """
+    return np.geomspace(qmin, qmax, size)
+
+
+def resample(qs, saxs, grid):
+    """
+    Resamples one SAXS curve onto grid as centered log10 intensity.
+
+    Bins without intensity are dropped; grid points outside the curve's q range take the
+    value at its nearest end.
+
+    Return
+    ------
+    numpy.array of len(grid), float32, with zero mean.
+    """
+    qs, saxs = np.asarray(qs, dtype=np.float64), np.asarray(saxs, dtype=np.float64)
+    valid = (qs > 0) & (saxs > 0) & np.isfinite(saxs)
+    if valid.sum() < 2:
+        raise ValueError('A SAXS curve needs at least two points with positive q and intensity.')
+    curve = np.interp(np.log(grid), np.log(qs[valid]), np.log10(saxs[valid]))
+    return (curve - curve.mean()).astype(np.float32)
+
+
+def _top_k(scores, k, largest):
+    """ Indices and values of the k best scores of each row, best first. """
+    k = min(k, scores.shape[1])
+    order = -scores if largest else scores
+    part = np.argpartition(order, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(order, part, axis=1)
+    rank = np.argsort(part_scores, axis=1, kind='stable')
+    idx = np.take_along_axis(part, rank, axis=1)
+    return idx, np.take_along_axis(scores, idx, axis=1)
+
+
+class SAXSIndex:
+    """
+    Normalized SAXS curves on a common log-q grid, searchable by cosine similarity or chi2.
+    """
+
+    METRICS = ('cosine', 'chi2')
+
+    def __init__(self, ids, curves, grid):
+        """
+        Parameters
+        ----------
+        ids: list(str)
+            PDB ID of each curve.
+        curves: numpy.array
+            (N, len(grid)) centered log10 curves, as returned by resample().
+        grid: numpy.array
+            q grid, in m^-1.
+        """
+        self.ids = list(ids)
+        self.curves = np.asarray(curves, dtype=np.float32)
+        self.grid = np.asarray(grid)
+        self.norms = np.linalg.norm(self.curves, axis=1)
+        self.components = None
+        self.projections = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_directory(cls, directory, grid=None, verbose=False):
+        """ Builds the index from the {pdb_id}.npz files of generateSAXS.py, skipping unreadable curves. """
+        grid = log_q_grid() if grid is None else grid
+        ids, curves = [], []
+        for path in sorted(glob.glob(os.path.join(directory, '*.npz'))):
+            try:
+                with np.load(path) as f:
+                    curves.append(resample(f['qs'], f['saxs'], grid))
+            except (ValueError, KeyError, OSError) as e:
+                if verbose:
+                    print('Skipping {}: {}'.format(path, e))
+                continue
+            ids.append(os.path.splitext(os.path.basename(path))[0])
+        return cls(ids, np.stack(curves) if curves else np.zeros((0, len(grid)), np.float32), grid)
+
+    def prepare(self, curves):
+        """ Resamples a list of (qs, saxs) pairs or mappings with 'qs' and 'saxs' into query vectors. """
+        rows = []
+        for curve in curves:
+            qs, saxs = (curve['qs'], curve['saxs']) if hasattr(curve, 'keys') else curve
+            rows.append(resample(qs, saxs, self.grid))
+        return np.stack(rows)
+
+    def scores(self, queries, rows=None, metric='cosine'):
+        """
+        Scores query vectors against the indexed curves (or the curves at rows) with one matrix product.
+
+        Return
+        ------
+        numpy.array of shape (len(queries), N).
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        curves = self.curves if rows is None else self.curves[rows]
+        norms = self.norms if rows is None else self.norms[rows]
+        dots = queries @ curves.T
+        query_norms = np.linalg.norm(queries, axis=1)
+        if metric == 'cosine':
+            return dots / np.maximum(query_norms[:, None] * norms[None, :], 1e-12)
+        if metric == 'chi2':
+            d = query_norms[:, None] ** 2 + norms[None, :] ** 2 - 2 * dots
+            return np.maximum(d, 0) / self.curves.shape[1]
+        raise ValueError('metric must be one of {}, got {}'.format(self.METRICS, metric))
+
+    def fit_pca(self, n_components=16, sample_size=20000, seed=0):
+        """ Fits a PCA on (a sample of) the curves and projects every curve for approximate search. """
+        rng = np.random.RandomState(seed)
+        sample = self.curves if len(self) <= sample_size else self.curves[rng.choice(len(self), sample_size, replace=False)]
+        self.mean = sample.mean(axis=0)
+        _, _, vt = np.linalg.svd(sample - self.mean, full_matrices=False)
+        self.components = vt[:n_components].astype(np.float32)
+        self.projections = (self.curves - self.mean) @ self.components.T
+        return self
+
+    def search(self, queries, k=10, metric='cosine', approximate=False, rerank=4):
+        """
+        Finds the k most similar curves to each query vector.
+
+        Parameters
+        ----------
+        queries: numpy.array
+            (Q, len(grid)) query vectors, see prepare().
+        k: int
+            Neighbours per query.
+        metric: str
+            'cosine' or 'chi2'.
+        approximate: bool
+            Score in PCA space (fit_pca() first) and re-rank the best rerank * k candidates exactly.
+        rerank: int
+            Candidate multiplier of the approximate mode.
+
+        Return
+        ------
+        (indices, scores), each (Q, k), best first.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        largest = metric == 'cosine'
+        if not approximate:
+            return _top_k(self.scores(queries, metric=metric), k, largest)
+        if self.projections is None:
+            raise RuntimeError('fit_pca() must be called before an approximate search.')
+
+        # The mean-removed distance in PCA space ranks candidates for both metrics.
+        q = (queries - self.mean) @ self.components.T
+        d = (np.einsum('ij,ij->i', q, q)[:, None] + np.einsum('ij,ij->i', self.projections, self.projections)[None, :]
+             - 2 * q @ self.projections.T)
+        candidates, _ = _top_k(d, rerank * k, largest=False)
+        indices = np.empty((len(queries), min(k, candidates.shape[1])), dtype=np.int64)
+        scores = np.empty(indices.shape, dtype=np.float32)
+        for i, rows in enumerate(candidates):
+            idx, s = _top_k(self.scores(queries[i:i + 1], rows, metric), k, largest)
+            indices[i], scores[i] = rows[idx[0]], s[0]
+        return indices, scores
+
+    def search_curves(self, curves, k=10, metric='cosine', **kwargs):
+        """ search() for (qs, saxs) curves; returns the PDB IDs and scores of the neighbours. """
+        indices, scores = self.search(self.prepare(curves), k, metric, **kwargs)
+        return [[self.ids[j] for j in row] for row in indices], scores
+
+    def knn_graph(self, k=8, metric='cosine', chunk_size=2048):
+        """
+        k nearest neighbours of every curve, excluding itself, computed chunk_size rows at a time.
+
+        Return
+        ------
+        (indices, scores), each (N, k), best first.
+        """
+        largest = metric == 'cosine'
+        k = min(k, len(self) - 1)
+        indices = np.empty((len(self), k), dtype=np.int64)
+        scores = np.empty((len(self), k), dtype=np.float32)
+        for start in range(0, len(self), chunk_size):
+            stop = min(start + chunk_size, len(self))
+            s = self.scores(self.curves[start:stop], metric=metric)
+            s[np.arange(stop - start), np.arange(start, stop)] = -np.inf if largest else np.inf
+            indices[start:stop], scores[start:stop] = _top_k(s, k, largest)
+        return indices, scores
+
+    def save(self, path):
+        """ Writes the index to directory path: curves.npy, memory-mapped by load(), and meta.npz. """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'curves.npy'), self.curves)
+        np.savez(os.path.join(path, 'meta.npz'), ids=np.asarray(self.ids, dtype=str), grid=self.grid)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """ Reads an index written by save(); the curves are memory-mapped unless mmap is False. """
+        with np.load(os.path.join(path, 'meta.npz')) as meta:
+            ids, grid = meta['ids'].tolist(), meta['grid']
+        curves = np.load(os.path.join(path, 'curves.npy'), mmap_mode='r' if mmap else None)
+        return cls(ids, curves, grid)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build and query a similarity index of SAXS curves.')
+    parser.add_argument('--data-dir', default=None, help='Directory of the generateSAXS.py .npz files; (re)builds the index.')
+    parser.add_argument('--index', required=True, help='Index directory.')
+    parser.add_argument('--query', nargs='*', default=[], help='PDB IDs in the index to find neighbours of.')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--metric', default='cosine', choices=SAXSIndex.METRICS)
+    parser.add_argument('--pca', type=int, default=None, help='Search approximately with this many PCA components.')
+    args = parser.parse_args()
+
+    if args.data_dir is not None:
+        index = SAXSIndex.from_directory(args.data_dir, verbose=True)
+        index.save(args.index)
+        print('Indexed {} curves'.format(len(index)))
+    index = SAXSIndex.load(args.index)
+    if args.pca:
+        index.fit_pca(args.pca)
+    rows = [index.ids.index(pdb_id) for pdb_id in args.query]
+    if rows:
+        indices, scores = index.search(np.asarray(index.curves[rows]), args.k + 1, args.metric,
+                                       approximate=bool(args.pca))
+        for pdb_id, row, s in zip(args.query, indices, scores):
+            print(pdb_id + ': ' + ', '.join('{} ({:.4f})'.format(index.ids[j], v) for j, v in zip(row, s)
+                                             if index.ids[j] != pdb_id))
+
+
+if __name__ == "__main__":
+    main()
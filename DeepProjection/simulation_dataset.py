@@ -0,0 +1,179 @@
+"""
+
+An endless stream of freshly simulated diffraction thumbnails for training.
+
+SimulatedThumbnailDataset is an IterableDataset: each DataLoader worker
+builds one dataset_generator.Simulator (beam, detector and experiments set
+up once, thumbnails made with utils.downsample()) and simulates frames on
+demand in a background thread that fills a bounded queue, so simulation
+continues while the worker hands batches to training. Samples have the form
+of training.ThumbnailDataset, (image, count label, particle label), with
+the particle and count of each chunk of frames drawn at random.
+
+skopi draws from NumPy's global RNG, which Simulator.simulate() seeds for
+every chunk and restores afterwards (dataset_generator.seeded_global_rng()).
+Without DataLoader workers (num_workers=0) there is no background thread:
+chunks are simulated in the calling thread between samples, so NumPy random
+calls of the training loop neither interleave with a chunk's draws nor see
+their stream reset. Within a worker process, the transform runs next to the
+producer thread and must not use NumPy's global RNG (torchvision transforms
+use torch's).
+
+    dataset = SimulatedThumbnailDataset(simulator_kwargs, frames_per_epoch=7000)
+    loader = DataLoader(dataset, batch_size=128, num_workers=8, persistent_workers=True)
+    train_one_epoch(model, optimizer, loader)
+    print(dataset.frames_per_sec())
+
+Example
+-------
+    simulator_kwargs = {'pdb_files': {'1fpv': '1fpv.pdb', '3iyf': '3iyf.pdb'}, 'beam_file': 'amo86615.beam',
+                        'detector_dimensions': (1024, 0.1, 0.2), 'thumbnail_shape': (128, 128)}
+
+"""
+import multiprocessing
+import queue
+import threading
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from dataset_generator import Simulator, COUNTS, N_PART_PER_SHOT
+
+
+class SimulatedThumbnailDataset(IterableDataset):
+    """
+    Thumbnails simulated on the fly in every DataLoader worker.
+    """
+
+    def __init__(self, simulator_kwargs, particles=None, counts=COUNTS, frames_per_epoch=None, chunk_size=16,
+                 queue_size=4, seed=0, transform=None, simulator_cls=Simulator, max_workers=64):
+        """
+        Parameters
+        ----------
+        simulator_kwargs: dict
+            Arguments of simulator_cls, see dataset_generator.Simulator.
+        particles: list(str) (optional)
+            Particles to simulate, in label order. Defaults to the keys of simulator_kwargs['pdb_files'].
+        counts: list(str)
+            Count types to simulate, in label order.
+        frames_per_epoch: int (optional)
+            Frames per iteration over the dataset, split among the workers. Endless if None.
+        chunk_size: int
+            Frames simulated in a row with the same particle and count.
+        queue_size: int
+            Simulated chunks each worker buffers ahead of training.
+        seed: int
+            Base seed; a chunk's seed depends on it, the epoch, the worker and the chunk index.
+        transform: callable (optional)
+            Applied to each (1, H, W) float32 tensor, as in training.ThumbnailDataset.
+        simulator_cls: type
+            Class built once per worker with simulator_kwargs.
+        max_workers: int
+            Upper bound on the DataLoader workers, for the frame statistics.
+        """
+        self.simulator_kwargs = simulator_kwargs
+        self.particles = list(particles or simulator_kwargs['pdb_files'])
+        self.counts = list(counts)
+        self.frames_per_epoch = frames_per_epoch
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+        self.seed = seed
+        self.transform = transform
+        self.simulator_cls = simulator_cls
+        self.epoch = 0
+        self._iterations = 0
+        self._simulator = None
+        # Frames simulated and seconds spent simulating, per worker; shared with forked workers.
+        self._stats = multiprocessing.Array('d', 2 * max_workers)
+
+    def set_epoch(self, epoch):
+        """
+        Sets the epoch of the next iteration. Persistent workers count their iterations themselves,
+        but workers that restart every epoch would otherwise repeat the same frames.
+        """
+        self.epoch = epoch
+
+    def _worker_frames(self, worker_id, num_workers):
+        if self.frames_per_epoch is None:
+            return None
+        return self.frames_per_epoch // num_workers + (worker_id < self.frames_per_epoch % num_workers)
+
+    def _chunks(self, worker_id, epoch, frames):
+        """ Yields simulated (images, count, particle) chunks until frames are done. """
+        if self._simulator is None:
+            self._simulator = self.simulator_cls(**self.simulator_kwargs)
+        index = 0
+        while frames is None or index * self.chunk_size < frames:
+            n = self.chunk_size if frames is None else min(self.chunk_size, frames - index * self.chunk_size)
+            rng = np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(epoch, worker_id, index)))
+            particle, count = rng.integers(len(self.particles)), rng.integers(len(self.counts))
+            start = time.perf_counter()
+            images = self._simulator.simulate(self.particles[particle], N_PART_PER_SHOT[self.counts[count]], n,
+                                              int(rng.integers(2 ** 32)))
+            with self._stats.get_lock():
+                self._stats[2 * worker_id] += n
+                self._stats[2 * worker_id + 1] += time.perf_counter() - start
+            yield images, count, particle
+            index += 1
+
+    def _simulate(self, worker_id, epoch, frames, chunks, stop):
+        """ Producer thread: simulates chunks into the bounded queue until frames are done or stop is set. """
+        try:
+            for chunk in self._chunks(worker_id, epoch, frames):
+                while not stop.is_set():
+                    try:
+                        chunks.put(chunk, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            chunks.put(None)
+        except BaseException as e:
+            chunks.put(e)
+
+    def _samples(self, images, count, particle):
+        for image in images:
+            X = torch.from_numpy(np.ascontiguousarray(image, dtype=np.float32)).unsqueeze(0)
+            if self.transform is not None:
+                X = self.transform(X)
+            yield X, count, particle
+
+    def __iter__(self):
+        info = get_worker_info()
+        worker_id, num_workers = (0, 1) if info is None else (info.id, info.num_workers)
+        epoch = self.epoch + self._iterations
+        self._iterations += 1
+        frames = self._worker_frames(worker_id, num_workers)
+        if info is None:
+            # In the main process the caller may use NumPy's global RNG too: simulate in this thread.
+            for chunk in self._chunks(worker_id, epoch, frames):
+                yield from self._samples(*chunk)
+            return
+
+        chunks = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._simulate, daemon=True, args=(worker_id, epoch, frames, chunks, stop))
+        thread.start()
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    return
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                yield from self._samples(*chunk)
+        finally:
+            stop.set()
+
+    def __len__(self):
+        if self.frames_per_epoch is None:
+            raise TypeError('An endless SimulatedThumbnailDataset has no length.')
+        return self.frames_per_epoch
+
+    def frames_per_sec(self):
+        """ Simulated frames per second of simulation time of each worker that has simulated frames. """
+        stats = np.frombuffer(self._stats.get_obj()).reshape(-1, 2)
+        return {i: frames / seconds for i, (frames, seconds) in enumerate(stats) if frames > 0}
@@ -0,0 +1,296 @@
+"""
+
+Sparse storage of photon-count diffraction frames.
+
+Photon images from SPIExperiment.generate_image_stack(return_photons=True) are
+mostly zeros. Frames are stored here like the rows of a CSR matrix: 'values'
+holds the nonzero pixels of all frames one after another, 'indices' their flat
+pixel index within the frame, and 'indptr' where each frame starts, so frame i
+is values[indptr[i]:indptr[i + 1]]. In HDF5 the three arrays are chunked,
+extendable datasets in one group, with the frame shape as an attribute:
+
+    {group}/indptr    (N + 1,) int64
+    {group}/indices   (nnz,)   uint32
+    {group}/values    (nnz,)   photon counts, uint16 by default
+
+Encoding and decoding are vectorized over all frames, and decode() can fill a
+preallocated numpy array or torch tensor, e.g. the batch buffer of a loader.
+
+Example
+-------
+    with SparseFrameWriter('SPI_1fpv_4k_single_sparse.h5', frame_shape=(128, 128)) as w:
+        w.append(frames)
+    with SparseFrameReader('SPI_1fpv_4k_single_sparse.h5') as r:
+        batch = r.read(0, 64, out=torch.empty(64, 128, 128))
+
+    python sparse_frames.py /data/SPI_*_thumbnail.h5 --output-dir /data/sparse
+
+"""
+import argparse
+import os
+import time
+
+import h5py
+import numpy as np
+
+
+def encode(frames, dtype=np.uint16):
+    """
+    Encodes frames into CSR arrays.
+
+    Parameters
+    ----------
+    frames: numpy.array
+        Frames of shape (N, H, W).
+    dtype: numpy.dtype (optional)
+        dtype of the stored values; None keeps the frames' dtype. Photon counts fit in uint16;
+        a ValueError is raised if the values do not fit in an integer dtype exactly.
+
+    Return
+    ------
+    indptr: numpy.array (N + 1,) int64, indices: numpy.array (nnz,) uint32, values: numpy.array (nnz,)
+    """
+    flat = np.asarray(frames).reshape(len(frames), -1)
+    if flat.shape[1] > np.iinfo(np.uint32).max:
+        raise ValueError('Frames with more than 2**32 pixels are not supported.')
+    nonzero = flat != 0
+    indptr = np.zeros(len(flat) + 1, dtype=np.int64)
+    np.cumsum(np.count_nonzero(nonzero, axis=1), out=indptr[1:])
+    positions = np.flatnonzero(nonzero)
+    indices = (positions % flat.shape[1]).astype(np.uint32)
+    values = flat.reshape(-1)[positions]
+    if dtype is not None:
+        if np.issubdtype(dtype, np.integer) and len(values):
+            if values.max() > np.iinfo(dtype).max or values.min() < np.iinfo(dtype).min:
+                raise ValueError('Values do not fit in {}.'.format(np.dtype(dtype).name))
+            if not np.array_equal(values, np.round(values)):
+                raise ValueError('Non-integer values cannot be stored as {} without loss; '
+                                 'use a float dtype.'.format(np.dtype(dtype).name))
+        values = values.astype(dtype)
+    return indptr, indices, values
+
+
+def decode(indptr, indices, values, frame_shape, out=None):
+    """
+    Decodes CSR arrays into dense frames.
+
+    Parameters
+    ----------
+    indptr, indices, values: numpy.array
+        As returned by encode(); indptr may start at an offset other than 0.
+    frame_shape: tuple(int, int)
+        Shape (H, W) of one frame.
+    out: numpy.array or torch.Tensor (optional)
+        Array of shape (N, H, W) (or (N, 1, H, W)) to decode into; it is zeroed first.
+
+    Return
+    ------
+    out, or a new float32 numpy.array of shape (N, H, W).
+    """
+    n = len(indptr) - 1
+    if out is None:
+        out = np.zeros((n,) + tuple(frame_shape), dtype=np.float32)
+    else:
+        out[...] = 0
+    rows = np.repeat(np.arange(n), np.diff(indptr))
+    flat_index = rows * int(np.prod(frame_shape)) + indices
+    if isinstance(out, np.ndarray):
+        out.reshape(-1)[flat_index] = values
+    else:
+        import torch
+        out.view(-1)[torch.from_numpy(flat_index)] = torch.from_numpy(values.astype(np.float32, copy=False)).to(out.dtype)
+    return out
+
+
+class SparseFrameWriter:
+    """
+    Appends frames to a sparse frame group of an HDF5 file.
+    """
+
+    def __init__(self, path, frame_shape, group='photons', dtype=np.uint16, chunk_size=1 << 16, mode='w'):
+        """
+        Parameters
+        ----------
+        path: str
+            HDF5 file.
+        frame_shape: tuple(int, int)
+            Shape (H, W) of the frames.
+        group: str
+            Group holding indptr, indices and values.
+        dtype: numpy.dtype
+            dtype of the stored values, see encode().
+        chunk_size: int
+            HDF5 chunk length of the indices and values datasets.
+        mode: str
+            h5py file mode; 'a' appends a group to an existing file.
+        """
+        self.file = h5py.File(path, mode)
+        self.group = self.file.create_group(group)
+        self.group.attrs['frame_shape'] = tuple(frame_shape)
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = dtype
+        self.group.create_dataset('indptr', data=np.zeros(1, dtype=np.int64), maxshape=(None,),
+                                  chunks=(min(chunk_size, 1 << 14),))
+        self.group.create_dataset('indices', shape=(0,), maxshape=(None,), dtype=np.uint32, chunks=(chunk_size,),
+                                  compression='lzf')
+        self.group.create_dataset('values', shape=(0,), maxshape=(None,), dtype=dtype, chunks=(chunk_size,),
+                                  compression='lzf')
+
+    def append(self, frames):
+        """ Encodes and appends frames of shape (N, H, W). """
+        if tuple(frames.shape[1:]) != self.frame_shape:
+            raise ValueError('Expected frames of shape {}, got {}'.format(self.frame_shape, frames.shape[1:]))
+        indptr, indices, values = encode(frames, self.dtype)
+        g = self.group
+        n, nnz = len(g['indptr']), len(g['values'])
+        g['indptr'].resize((n + len(frames),))
+        g['indptr'][n:] = indptr[1:] + nnz
+        for name, data in (('indices', indices), ('values', values)):
+            g[name].resize((nnz + len(data),))
+            g[name][nnz:] = data
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SparseFrameReader:
+    """
+    Reads frames from a sparse frame group of an HDF5 file.
+    """
+
+    def __init__(self, path, group='photons'):
+        self.file = h5py.File(path, 'r')
+        self.group = self.file[group]
+        self.frame_shape = tuple(self.group.attrs['frame_shape'])
+        # indptr is small (8 bytes per frame) and needed for every read.
+        self.indptr = self.group['indptr'][:]
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def read(self, start=0, stop=None, out=None):
+        """ Decodes frames start to stop into out (see decode()) or a new float32 array. """
+        stop = len(self) if stop is None else min(stop, len(self))
+        lo, hi = self.indptr[start], self.indptr[stop]
+        return decode(self.indptr[start:stop + 1] - lo, self.group['indices'][lo:hi], self.group['values'][lo:hi],
+                      self.frame_shape, out)
+
+    def read_rows(self, rows, out=None):
+        """
+        Decodes the frames at the given row indices, in order. The rows are read in sorted
+        runs of consecutive frames, so a sorted or clustered sample costs few slice reads.
+        """
+        rows = np.asarray(rows)
+        if out is None:
+            out = np.zeros((len(rows),) + self.frame_shape, dtype=np.float32)
+        order = np.argsort(rows, kind='stable')
+        sorted_rows = rows[order]
+        breaks = np.nonzero(np.diff(sorted_rows) > 1)[0] + 1
+        position = 0
+        for run in np.split(sorted_rows, breaks):
+            frames = self.read(run[0], run[-1] + 1)[run - run[0]]
+            targets = order[position:position + len(run)]
+            if isinstance(out, np.ndarray):
+                out[targets] = frames.reshape(out[targets].shape)
+            else:
+                import torch
+                targets = torch.from_numpy(targets)
+                out[targets] = torch.from_numpy(frames).to(out.dtype).reshape(out[targets].shape)
+            position += len(run)
+        return out
+
+    def nbytes(self):
+        """ Bytes the sparse arrays occupy in the file, after HDF5 compression. """
+        return sum(self.group[name].id.get_storage_size() for name in ('indptr', 'indices', 'values'))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def convert(dense_path, sparse_path, dataset=None, group='photons', batch_size=256, dtype=np.uint16):
+    """
+    Converts an (N, H, W) dataset of a dense HDF5 file, by default its first, into a sparse frame file.
+
+    Return
+    ------
+    Number of frames converted.
+    """
+    with h5py.File(dense_path, 'r') as f:
+        data = f[dataset or list(f.keys())[0]]
+        try:
+            with SparseFrameWriter(sparse_path, data.shape[1:], group, dtype) as writer:
+                for start in range(0, len(data), batch_size):
+                    writer.append(data[start:start + batch_size])
+        except ValueError:
+            # Do not leave a partial sparse file behind, e.g. for float frames and an integer dtype.
+            os.remove(sparse_path)
+            raise
+        return len(data)
+
+
+def benchmark(dense_path, sparse_path, dataset=None, group='photons', batch_size=256):
+    """
+    Compares a dense dataset with its sparse copy.
+
+    Return
+    ------
+    dict with 'frames', 'dense_bytes' (uncompressed frames), 'sparse_bytes' (sparse arrays on disk),
+    'compression_ratio', 'decode_frames_per_sec' (sparse file to dense batches) and
+    'dense_read_frames_per_sec' (reading the dense dataset), both into a preallocated batch.
+    """
+    with h5py.File(dense_path, 'r') as f:
+        data = f[dataset or list(f.keys())[0]]
+        n, dense_bytes = len(data), data.size * data.dtype.itemsize
+        out = np.empty((batch_size,) + data.shape[1:], dtype=np.float32)
+        start_time = time.perf_counter()
+        for start in range(0, n, batch_size):
+            stop = min(start + batch_size, n)
+            data.read_direct(out, np.s_[start:stop], np.s_[:stop - start])
+        dense_time = time.perf_counter() - start_time
+
+    with SparseFrameReader(sparse_path, group) as reader:
+        sparse_bytes = reader.nbytes()
+        start_time = time.perf_counter()
+        for start in range(0, n, batch_size):
+            stop = min(start + batch_size, n)
+            reader.read(start, stop, out[:stop - start])
+        sparse_time = time.perf_counter() - start_time
+
+    return {'frames': n, 'dense_bytes': dense_bytes, 'sparse_bytes': sparse_bytes,
+            'compression_ratio': dense_bytes / max(sparse_bytes, 1), 'decode_frames_per_sec': n / sparse_time,
+            'dense_read_frames_per_sec': n / dense_time}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert dense photon frame datasets to sparse frame files.')
+    parser.add_argument('files', nargs='+', help='Dense HDF5 files, e.g. SPI_1fpv_4k_single_thumbnail.h5.')
+    parser.add_argument('--output-dir', required=True)
+    parser.add_argument('--dataset', default=None, help='Dataset to convert; the first one by default.')
+    parser.add_argument('--float', action='store_true', help='Store float32 values instead of uint16 photon counts; '
+                                                              'needed for thumbnails, which hold binned averages.')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for path in args.files:
+        sparse_path = os.path.join(args.output_dir, os.path.basename(path).replace('.h5', '_sparse.h5'))
+        convert(path, sparse_path, args.dataset, dtype=np.float32 if args.float else np.uint16)
+        r = benchmark(path, sparse_path, args.dataset)
+        print('{}: {} frames, {:.1f}x smaller, decode {:.0f} frames/s (dense read {:.0f} frames/s)'.format(
+            os.path.basename(path), r['frames'], r['compression_ratio'], r['decode_frames_per_sec'],
+            r['dense_read_frames_per_sec']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+
+Shape descriptors of PDB structures and a similarity graph built from them offline.
+
+Each structure, read through pdb_cache (so a PDB file is parsed once), is
+summarized by its radius of gyration, the eigenvalues of its inertia tensor
+and its pair-distance distribution p(r), all weighted by atomic number, the
+electron count that sets the scattering. The descriptors of all structures
+are standardized into one matrix, and similarity_graph() finds the top-k
+neighbours of every structure block by block with matrix products, in the
+(source, [(target, score), ...]) form of
+visualize_similarity_network.get_structure_similarity_data_from_range(), so
+load_to_dataframe() and the rest of the network code take it unchanged.
+
+Example
+-------
+    ids, descriptors = descriptor_matrix({'1fpv': './pdbs/1fpv.pdb', '3iyf': './pdbs/3iyf.pdb', ...})
+    similar_pdbs = similarity_graph(ids, descriptors, num_neighbors=10)
+    df = load_to_dataframe(similar_pdbs)
+
+"""
+import numpy as np
+
+from pdb_cache import read_pdb
+
+
+def load_coordinates(pdb_file, cache=None):
+    """
+    Atom positions, in Angstrom, and atomic numbers of a structure, with its symmetry applied.
+
+    Return
+    ------
+    coords: numpy.array (N, 3), weights: numpy.array (N,)
+    """
+    particle = read_pdb(pdb_file, ff='WK', cache=cache)
+    return np.asarray(particle.atom_pos) * 1e10, np.asarray(particle.at, dtype=np.float64)
+
+
+def shape_descriptors(coords, weights=None, bins=32, r_max=300.0, max_atoms=2000, seed=0, block_size=1024):
+    """
+    Computes the shape descriptors of one structure.
+
+    Parameters
+    ----------
+    coords: numpy.array
+        Atom positions of shape (N, 3), in Angstrom.
+    weights: numpy.array (optional)
+        Per-atom weights, e.g. atomic numbers; uniform if None.
+    bins: int
+        Number of p(r) bins between 0 and r_max.
+    r_max: float
+        Largest pair distance of the p(r) histogram, in Angstrom; longer pairs go to the last bin.
+    max_atoms: int
+        p(r) is estimated from a random subset of this many atoms.
+    seed: int
+        Seed of the atom subset.
+    block_size: int
+        Atoms per block of the pair-distance computation.
+
+    Return
+    ------
+    dict with 'rg' (float), 'inertia' (3 eigenvalues of the gyration tensor, descending, in A^2)
+    and 'p_r' (normalized histogram of length bins).
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    weights = np.ones(len(coords)) if weights is None else np.asarray(weights, dtype=np.float64)
+    total = weights.sum()
+    centered = coords - weights @ coords / total
+    gyration = (centered * weights[:, None]).T @ centered / total
+    inertia = np.sort(np.linalg.eigvalsh(gyration))[::-1]
+    rg = float(np.sqrt(max(np.trace(gyration), 0)))
+
+    if len(coords) > max_atoms:
+        keep = np.random.RandomState(seed).choice(len(coords), max_atoms, replace=False)
+        centered, weights = centered[keep], weights[keep]
+    edges_scale = bins / r_max
+    norms = np.einsum('ij,ij->i', centered, centered)
+    p_r = np.zeros(bins)
+    for start in range(0, len(centered), block_size):
+        block = centered[start:start + block_size]
+        d2 = norms[start:start + block_size, None] + norms[None, :] - 2 * block @ centered.T
+        r = np.sqrt(np.maximum(d2, 0))
+        index = np.minimum((r * edges_scale).astype(np.int64), bins - 1)
+        p_r += np.bincount(index.ravel(), weights=np.outer(weights[start:start + block_size], weights).ravel(),
+                           minlength=bins)
+    # Remove the self pairs, which all fall in the first bin.
+    p_r[0] -= np.sum(weights ** 2)
+    p_r = np.maximum(p_r, 0)
+    p_r /= max(p_r.sum(), 1e-12)
+    return {'rg': rg, 'inertia': inertia, 'p_r': p_r}
+
+
+def descriptor_vector(descriptors):
+    """ Flattens shape descriptors into one vector: log Rg, log inertia eigenvalues and sqrt p(r). """
+    return np.concatenate([[np.log(max(descriptors['rg'], 1e-6))],
+                           np.log(np.maximum(descriptors['inertia'], 1e-6)),
+                           np.sqrt(descriptors['p_r'])])
+
+
+def descriptor_matrix(pdb_files, cache=None, verbose=False, **kwargs):
+    """
+    Computes the descriptor vectors of several structures.
+
+    Parameters
+    ----------
+    pdb_files: dict(str, str)
+        Path of the PDB file of each PDB ID.
+    cache: pdb_cache.PDBCache (optional)
+        Cache the structures are read through.
+    verbose: bool
+        Print the structures that cannot be read.
+    kwargs:
+        Arguments of shape_descriptors().
+
+    Return
+    ------
+    ids: list(str) of the structures read, descriptors: numpy.array (len(ids), 4 + bins)
+    """
+    ids, rows = [], []
+    for pdb_id, path in pdb_files.items():
+        try:
+            coords, weights = load_coordinates(path, cache)
+        except Exception as e:
+            if verbose:
+                print('Skipping {}: {}'.format(pdb_id, e))
+            continue
+        ids.append(pdb_id)
+        rows.append(descriptor_vector(shape_descriptors(coords, weights, **kwargs)))
+    return ids, np.array(rows)
+
+
+def standardize(descriptors, group_sizes=None):
+    """
+    Z-scores the descriptor columns and scales each descriptor group (Rg, inertia, p(r)) to the
+    same total weight, so the many p(r) bins do not dominate the distances.
+    """
+    descriptors = np.asarray(descriptors, dtype=np.float64)
+    if group_sizes is None:
+        group_sizes = (1, 3, descriptors.shape[1] - 4)
+    z = (descriptors - descriptors.mean(axis=0)) / np.maximum(descriptors.std(axis=0), 1e-12)
+    scale = np.concatenate([np.full(size, 1 / np.sqrt(size)) for size in group_sizes])
+    return (z * scale).astype(np.float32)
+
+
+def similarity_graph(ids, descriptors, num_neighbors=10, block_size=1024, standardized=False):
+    """
+    Finds the num_neighbors most similar structures of every structure.
+
+    The score of a pair is 1 / (1 + d), with d the Euclidean distance between their standardized
+    descriptors, so it lies in (0, 1] and a higher score means more similar.
+
+    Parameters
+    ----------
+    ids: list(str)
+        PDB IDs, in the order of the descriptor rows.
+    descriptors: numpy.array
+        Descriptor matrix from descriptor_matrix().
+    num_neighbors: int
+        Neighbours per structure.
+    block_size: int
+        Rows scored against all structures at a time.
+    standardized: bool
+        True if descriptors were already passed through standardize().
+
+    Return
+    ------
+    A list of tuples (PDB ID, list of (similar PDB ID, score)), best first, as consumed by
+    visualize_similarity_network.load_to_dataframe().
+    """
+    x = descriptors if standardized else standardize(descriptors)
+    n = len(x)
+    k = min(num_neighbors, n - 1)
+    norms = np.einsum('ij,ij->i', x, x)
+    results = []
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        d2 = norms[start:stop, None] + norms[None, :] - 2 * x[start:stop] @ x.T
+        d2[np.arange(stop - start), np.arange(start, stop)] = np.inf
+        if k <= 0:
+            results.extend((ids[i], []) for i in range(start, stop))
+            continue
+        part = np.argpartition(d2, k - 1, axis=1)[:, :k]
+        part_d2 = np.take_along_axis(d2, part, axis=1)
+        order = np.argsort(part_d2, axis=1, kind='stable')
+        neighbours = np.take_along_axis(part, order, axis=1)
+        scores = 1 / (1 + np.sqrt(np.maximum(np.take_along_axis(part_d2, order, axis=1), 0)))
+        for row, i in enumerate(range(start, stop)):
+            results.append((ids[i], [(ids[j], float(s)) for j, s in zip(neighbours[row], scores[row])]))
+    return results
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Modules in resnet/ import each other by bare name (e.g. "from resnet import resnet18"),
+# the same way the notebooks in that directory use them.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resnet'))
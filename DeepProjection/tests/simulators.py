@@ -0,0 +1,14 @@
+import numpy as np
+
+from dataset_generator import seeded_global_rng
+
+
+class RandomSimulator:
+    """ Draws thumbnails from NumPy's global RNG like skopi does, without running a simulation. """
+
+    def __init__(self, pdb_files, beam_file, detector_dimensions, thumbnail_shape, increase_factor):
+        self.shape = tuple(thumbnail_shape)
+
+    def simulate(self, particle, n_part_per_shot, n, seed):
+        with seeded_global_rng(seed):
+            return np.random.poisson(n_part_per_shot, (n,) + self.shape).astype(np.float32)
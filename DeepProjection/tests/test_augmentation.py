@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from augmentation import add_noise, add_noise_per_image, affine_warp, random_affine_matrices
+
+
+@pytest.fixture
+def images():
+    rows, cols = np.mgrid[:64, :64] - 31.5
+    pattern = 1e4 * np.exp(-np.hypot(rows, cols) / 8) * (1 + np.cos(cols / 3))
+    return np.repeat(pattern[None], 32, axis=0).astype(np.float32)
+
+
+def test_affine_warp(images):
+    identity = np.tile(np.eye(2), (len(images), 1, 1))
+    np.testing.assert_array_equal(affine_warp(images, identity), images)
+    # A 180 degree rotation is an up-down plus a left-right flip.
+    np.testing.assert_allclose(affine_warp(images, -identity), images[:, ::-1, ::-1], atol=1e-3)
+    # Zooming out leaves the border empty.
+    assert (affine_warp(images, 2 * identity)[:, 0, :] == 0).all()
+
+
+def test_random_affine_matrices():
+    m = random_affine_matrices(1000, rotation_range=0, zoom_range=(1, 1), rng=0)
+    assert set(np.unique(m)) <= {-1.0, 0.0, 1.0} and (m[:, 0, 0] < 0).mean() == pytest.approx(0.5, abs=0.05)
+    m = random_affine_matrices(1000, flips=False, rng=0)
+    det = np.linalg.det(m)
+    assert (det > 0.81 - 1e-6).all() and (det < 1.21 + 1e-6).all()
+
+
+def test_add_noise(images):
+    original = images.copy()
+    out = add_noise(images, rng=1)
+    np.testing.assert_array_equal(images, original)
+    assert out.shape == images.shape and out.dtype == np.float32
+    np.testing.assert_allclose(out.mean(axis=(1, 2)), 0, atol=1e-5)
+    np.testing.assert_allclose(out.std(axis=(1, 2)), 1, atol=1e-5)
+    np.testing.assert_array_equal(out, add_noise(images, rng=1))
+    # Constant images stay all zeros instead of dividing by a zero standard deviation.
+    assert (add_noise(np.zeros((2, 8, 8)), gaussian_noise=0, rng=0) == 0).all()
+
+
+def test_matches_per_image_statistics(images):
+    tf = pytest.importorskip('tensorflow')
+    # 64 thumbnails, as in the benchmark; the reference draws from both NumPy's and TensorFlow's global RNG.
+    images = np.concatenate([images, images])
+    np.random.seed(0)
+    tf.random.set_seed(0)
+    reference = add_noise_per_image(images.astype(np.float64))
+    out = add_noise(images, rng=0)
+    quantiles = [50, 90, 99]
+    np.testing.assert_allclose(np.percentile(out, quantiles), np.percentile(reference, quantiles), atol=0.03)
@@ -0,0 +1,83 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from torch.utils.data import DataLoader
+from checkpoint import CheckpointManager, ResumableSampler, fit
+from multioutput_cnns import MultiOutputCNN_3Layer
+from training import ThumbnailDataset
+
+
+def random_dataset(n=40, seed=0):
+    rng = np.random.RandomState(seed)
+    return ThumbnailDataset(rng.rand(n, 128, 128), rng.randint(0, 4, n), rng.randint(0, 11, n))
+
+
+def make_model():
+    torch.manual_seed(0)
+    model = MultiOutputCNN_3Layer()
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=3, gamma=0.5)
+    return model, optimizer, scheduler
+
+
+def test_resumable_sampler():
+    sampler = ResumableSampler(range(10), seed=3)
+    sampler.set_epoch(2)
+    order = list(sampler)
+    sampler.set_epoch(2, start=4)
+    assert list(sampler) == order[4:] and len(sampler) == 6
+    resumed = ResumableSampler(range(10))
+    resumed.load_state_dict(sampler.state_dict())
+    assert list(resumed) == order[4:]
+
+
+def test_exact_resume(tmp_path):
+    train_set, valid_loader = random_dataset(), DataLoader(random_dataset(16, seed=1), batch_size=8)
+
+    model, optimizer, scheduler = make_model()
+    fit(model, optimizer, train_set, 2, CheckpointManager(str(tmp_path / 'full')), batch_size=8,
+        scheduler=scheduler, valid_loader=valid_loader)
+    expected = model.state_dict()
+
+    class Crash(Exception):
+        pass
+
+    # Crash on the 8th batch (3rd batch of epoch 1), after the checkpoint of step 6.
+    model, optimizer, scheduler = make_model()
+    manager = CheckpointManager(str(tmp_path / 'crashed'), keep_last=2, keep_best=1)
+    original_step = optimizer.step
+    calls = [0]
+
+    def crashing_step(*args, **kwargs):
+        calls[0] += 1
+        if calls[0] == 8:
+            raise Crash()
+        return original_step(*args, **kwargs)
+
+    optimizer.step = crashing_step
+    with pytest.raises(Crash):
+        fit(model, optimizer, train_set, 2, manager, batch_size=8, scheduler=scheduler, valid_loader=valid_loader,
+            checkpoint_every=3)
+    manager.wait()
+
+    model, optimizer, scheduler = make_model()
+    torch.manual_seed(1234)  # The RNG state is restored from the checkpoint.
+    manager = CheckpointManager(str(tmp_path / 'crashed'), keep_last=2, keep_best=1)
+    assert manager.latest().endswith('ckpt_00000006.pth')
+    fit(model, optimizer, train_set, 2, manager, batch_size=8, scheduler=scheduler, valid_loader=valid_loader,
+        checkpoint_every=3)
+    for k, v in model.state_dict().items():
+        torch.testing.assert_close(v, expected[k], rtol=0, atol=0)
+
+    # Retention: the last two checkpoints plus the best one by validation accuracy.
+    files = sorted(f for f in os.listdir(str(tmp_path / 'crashed')) if f.endswith('.pth'))
+    with open(str(tmp_path / 'crashed' / 'checkpoints.json')) as f:
+        manifest = json.load(f)
+    assert files == sorted(e['path'] for e in manifest) and 2 <= len(files) <= 3
+    assert not any(f.endswith('.tmp') for f in os.listdir(str(tmp_path / 'crashed')))
+    assert os.path.basename(manager.best()) in files
@@ -0,0 +1,95 @@
+import h5py
+import numpy as np
+import pytest
+
+pytest.importorskip('skopi')
+
+from dataset_generator import generate, chunk_seed, output_file, Simulator
+from tests.simulators import RandomSimulator
+
+
+def _generate(output_dir, workers):
+    return generate({'1fpv': None, '1ss8': None}, None, (128, 0.1, 0.2), str(output_dir),
+                    particles=['1fpv', '1ss8'], counts=['single', 'triple'], n_single=40, n_multi=10,
+                    thumbnail_shape=(8, 8), chunk_size=7, workers=workers, seed=3, simulator_cls=RandomSimulator)
+
+
+def test_generate_is_deterministic_across_worker_counts(tmp_path):
+    files = _generate(tmp_path / 'one', workers=1)
+    other = _generate(tmp_path / 'two', workers=2)
+    assert files[('1ss8', 'triple')] == output_file(str(tmp_path / 'one'), '1ss8', 'triple', 10)
+
+    for key, path in files.items():
+        with h5py.File(path, 'r') as f, h5py.File(other[key], 'r') as g:
+            assert f['photons'].shape == ((40 if key[1] == 'single' else 10), 8, 8)
+            assert f['photons'].chunks == (7, 8, 8)
+            assert f.attrs['particle'] == key[0] and f.attrs['count'] == key[1]
+            np.testing.assert_array_equal(f['photons'][:], g['photons'][:])
+            # Every chunk was written.
+            assert (f['photons'][:].reshape(len(f['photons']), -1).sum(axis=1) > 0).all()
+    with h5py.File(files[('1fpv', 'triple')], 'r') as f:
+        assert f.attrs['n_part_per_shot'] == 3
+        assert f['photons'][:].mean() == pytest.approx(3, rel=0.1)
+
+
+def test_chunk_seed():
+    assert chunk_seed(0, 1, 2, 3) == chunk_seed(0, 1, 2, 3)
+    assert len({chunk_seed(0, 0, 0, k) for k in range(100)} | {chunk_seed(1, 0, 0, 0)}) == 101
+
+
+def test_output_file_names_exact_counts():
+    assert output_file('out', '1fpv', 'single', 4000).endswith('SPI_1fpv_4k_single_thumbnail.h5')
+    assert output_file('out', '1fpv', 'double', 1500).endswith('SPI_1fpv_1500_double_thumbnail.h5')
+    assert output_file('out', '1fpv', 'double', 40).endswith('SPI_1fpv_40_double_thumbnail.h5')
+
+
+def test_generated_datasets_load_for_training(tmp_path):
+    pytest.importorskip('torch')
+    from training import ThumbnailDataset, count2idx, particle2idx
+
+    _generate(tmp_path, workers=1)
+    dataset = ThumbnailDataset.from_h5(str(tmp_path), particles=['1fpv', '1ss8'], counts=['single', 'triple'],
+                                       length=10, n_single=40, n_multi=10)
+    assert len(dataset) == 100 and dataset.images.shape[1:] == (8, 8)
+    assert sorted(set(dataset.particle_labels)) == [particle2idx['1fpv'], particle2idx['1ss8']]
+    assert sorted(set(dataset.count_labels)) == [count2idx['single'], count2idx['triple']]
+
+
+def test_simulator_builds_detector_once(tmp_path, monkeypatch):
+    import dataset_generator
+
+    beam_file = tmp_path / 'test.beam'
+    beam_file.write_text('beam/photon_energy = 4600\nbeam/photonsPerShot = 1e12\nbeam/radius = 5e-7\n')
+    built = {'detector': 0, 'experiment': 0, 'pdb': 0}
+    detector_cls = dataset_generator.sk.SimpleSquareDetector
+
+    def detector(*args, **kwargs):
+        built['detector'] += 1
+        return detector_cls(*args, **kwargs)
+
+    def read_pdb(path, ff):
+        built['pdb'] += 1
+        return path
+
+    class Experiment:
+        # sk.SPIExperiment needs a GPU; this one returns Poisson photons of the detector's shape.
+        def __init__(self, det, beam, particle, n_part_per_shot):
+            built['experiment'] += 1
+            self.shape = det.shape
+
+        def generate_image_stack(self, return_photons=True, return_intensities=False):
+            return np.random.poisson(1.0, self.shape)
+
+    monkeypatch.setattr(dataset_generator.sk, 'SimpleSquareDetector', detector)
+    monkeypatch.setattr(dataset_generator.sk, 'SPIExperiment', Experiment)
+    monkeypatch.setattr(dataset_generator, 'read_pdb', read_pdb)
+
+    simulator = Simulator({'1fpv': '1fpv.pdb', '1ss8': '1ss8.pdb'}, str(beam_file), (128, 0.1, 0.2),
+                          thumbnail_shape=(32, 32))
+    assert simulator.mask.shape == (128, 128) and simulator.bins == (4, 4)
+    runs = [simulator.simulate(particle, n, 3, seed) for particle, n, seed in
+            (('1fpv', 1, 0), ('1fpv', 2, 1), ('1ss8', 1, 2), ('1fpv', 1, 0), ('1fpv', 2, 3))]
+    assert all(run.shape == (3, 32, 32) for run in runs)
+    np.testing.assert_array_equal(runs[0], runs[3])
+    # One detector per simulator, one particle per PDB and one experiment per particle and count.
+    assert built == {'detector': 1, 'pdb': 2, 'experiment': 3}
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from distributed import launch
+from multioutput_cnns import load_model
+from training import ThumbnailDataset
+
+
+def test_launch_two_processes(tmp_path):
+    rng = np.random.RandomState(0)
+    n = 80
+    dataset = ThumbnailDataset(rng.rand(n, 128, 128), rng.randint(0, 4, n), rng.randint(0, 11, n))
+    ckpt_path = str(tmp_path / 'ckpt.pth')
+    history = launch(2, dataset, model_name='multi_output_cnn_3_layers', epochs=2, batch_size=8,
+                     ckpt_path=ckpt_path, num_threads=1)
+    assert len(history) == 2
+    for h in history:
+        assert h['loss'] > 0 and h['images_per_sec'] > 0
+        assert 0 <= h['accuracy'] <= min(h['count_accuracy'], h['particle_accuracy']) <= 100
+
+    checkpoint = torch.load(ckpt_path)
+    assert checkpoint['epoch'] == 1 and checkpoint['world_size'] == 2
+    model = load_model('multi_output_cnn_3_layers', checkpoint=ckpt_path)
+    assert not model.training
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from embedding_index import EmbeddingIndex, build_index, recall_curve
+
+
+@pytest.fixture
+def data():
+    rng = np.random.RandomState(0)
+    centers = rng.rand(20, 16)
+    labels = rng.randint(0, 20, 3000)
+    return (centers[labels] + 0.05 * rng.randn(3000, 16)).astype(np.float32), labels
+
+
+def test_search_exact(data):
+    x, _ = data
+    index = EmbeddingIndex(16, capacity=10)
+    index.add(x[:1000])
+    index.add(x[1000:])
+    d, ids = index.search_exact(x[:50], k=5)
+    expected = np.argsort(np.sum(np.square(x[:50, None] - x[None]), axis=2), axis=1)[:, :5]
+    assert (ids[:, 0] == np.arange(50)).all()
+    assert all(set(a) == set(b) for a, b in zip(ids, expected))
+    assert (np.diff(d, axis=1) >= 0).all()
+
+
+def test_ivf_recall_and_incremental_add(data):
+    x, labels = data
+    index = EmbeddingIndex(16)
+    index.add(x[:2500], labels[:2500])
+    index.train(nlist=32)
+    _, exact = index.search_exact(x[2500:], k=10)
+    _, ids = index.search(x[2500:], k=10, nprobe=32)
+    assert (np.sort(ids, axis=1) == np.sort(exact, axis=1)).all()
+    curve = recall_curve(index, x[2500:], k=10, nprobes=(1, 4, 32))
+    assert [r['nprobe'] for r in curve] == [1, 4, 32]
+    assert curve[-1]['recall'] == 1.0 and curve[1]['recall'] > 0.9
+
+    new_ids = index.add(x[2500:], labels[2500:])
+    _, ids = index.search(x[2500:], k=1, nprobe=4)
+    assert (ids[:, 0] == new_ids).all()
+    assert (index.classify(x[2500:], k=5) == labels[2500:]).mean() > 0.95
+
+
+def test_persistence(data, tmp_path):
+    x, labels = data
+    index = build_index(lambda batch: batch * 2, x, labels, path=str(tmp_path / 'index'), nlist=16, batch_size=700)
+    assert len(index) == 3000 and index.nlist == 16
+    reopened = EmbeddingIndex.open(str(tmp_path / 'index'))
+    assert isinstance(reopened.vectors, np.memmap)
+    np.testing.assert_array_equal(reopened.search(x[:20] * 2, k=3)[1], index.search(x[:20] * 2, k=3)[1])
+    reopened.add(x[:10] * 2, labels[:10])
+    assert len(reopened) == 3010
@@ -0,0 +1,46 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+import torch.ao.nn.intrinsic as nni
+from multioutput_cnns import MultiOutputCNN_10Layer, MultiOutputCNN_Early
+from resnet import resnet18
+from export import fuse_conv_relu, export_torchscript, load_torchscript, export_onnx, onnx_session, verify_parity
+
+
+@pytest.fixture
+def inputs():
+    torch.manual_seed(0)
+    return torch.randn(4, 1, 128, 128)
+
+
+def test_fuse_conv_relu():
+    # Every conv in the 10-layer CNN is followed by a ReLU.
+    fused = fuse_conv_relu(MultiOutputCNN_10Layer())
+    assert sum(isinstance(m, nni.ConvReLU2d) for m in fused.modules()) == 9
+
+    # BatchNorm is folded away in the ResNet.
+    fused = fuse_conv_relu(resnet18())
+    assert not any(isinstance(m, torch.nn.BatchNorm2d) for m in fused.modules())
+
+
+@pytest.mark.parametrize('method', ['trace', 'script'])
+def test_torchscript_parity(tmp_path, inputs, method):
+    model = resnet18().eval()
+    path = str(tmp_path / 'resnet18.pt')
+    export_torchscript(model, inputs, path, method=method)
+    assert verify_parity(model, load_torchscript(path), inputs) < 1e-4
+
+
+def test_verify_parity_detects_mismatch(inputs):
+    with pytest.raises(RuntimeError):
+        verify_parity(MultiOutputCNN_Early().eval(), MultiOutputCNN_Early().eval(), inputs, atol=1e-6)
+
+
+def test_onnx_parity(tmp_path, inputs):
+    pytest.importorskip('onnxruntime')
+    model = MultiOutputCNN_Early().eval()
+    path = export_onnx(model, inputs, str(tmp_path / 'early.onnx'))
+    # The batch dimension is dynamic.
+    assert verify_parity(model, onnx_session(path), inputs[:1]) < 1e-4
+    assert verify_parity(model, onnx_session(path), inputs) < 1e-4
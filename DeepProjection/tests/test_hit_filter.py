@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from hit_filter import HitFilter, benchmark
+from inference import InferenceEngine, InferenceServer, classify_remote
+from multioutput_cnns import MultiOutputCNN_3Layer
+from utils import blank_frames
+
+
+def _frames(seed=0):
+    """ Four blank frames, four flat background frames and four centrally peaked hits. """
+    rng = np.random.RandomState(seed)
+    rows, cols = np.indices((32, 32))
+    peak = 20 * np.exp(-np.hypot(rows - 15.5, cols - 15.5) / 3)
+    frames = np.zeros((12, 32, 32), dtype=np.float32)
+    frames[4:8] = rng.poisson(0.2, (4, 32, 32))
+    frames[8:] = rng.poisson(peak, (4, 32, 32))
+    return frames
+
+
+def test_statistics():
+    frames = _frames()
+    stats = HitFilter().statistics(frames)
+    np.testing.assert_allclose(stats['photons'], frames.sum(axis=(1, 2)), rtol=1e-5)
+    np.testing.assert_array_equal(stats['lit_pixels'], np.count_nonzero(frames, axis=(1, 2)))
+    assert np.isnan(stats['radial_moment'][:4]).all()
+    assert stats['radial_moment'][8:].max() < stats['radial_moment'][4:8].min()
+
+
+def test_default_filter_matches_blank_check():
+    frames = _frames()
+    hit_filter = HitFilter()
+    np.testing.assert_array_equal(hit_filter.mask(frames), ~blank_frames(frames))
+    assert hit_filter.report() == {'frames': 12, 'passed': 8, 'filtered_fraction': pytest.approx(1 / 3)}
+
+
+def test_thresholds():
+    frames = _frames()
+    np.testing.assert_array_equal(HitFilter(max_radial_moment=8.0)(frames), [8, 9, 10, 11])
+    np.testing.assert_array_equal(HitFilter(min_photons=1000)(frames), [8, 9, 10, 11])
+    np.testing.assert_array_equal(HitFilter(min_lit_pixels=100, lit_threshold=1)(frames), [8, 9, 10, 11])
+
+
+def test_engine_skips_filtered_frames():
+    torch.manual_seed(0)
+    model = MultiOutputCNN_3Layer().eval()
+    frames = np.zeros((6, 128, 128), dtype=np.float32)
+    frames[::2] = np.random.RandomState(0).rand(3, 128, 128)
+
+    with InferenceEngine(model, max_batch_size=4, max_latency_ms=1.0) as engine:
+        expected = engine.predict(frames)
+    with InferenceEngine(model, max_batch_size=4, max_latency_ms=1.0, hit_filter=HitFilter()) as engine:
+        predictions = engine.predict(frames)
+        assert engine.submit(frames[1]).result() is None
+        stats = engine.stats()
+
+    assert predictions[1::2] == [None] * 3
+    assert [p.count for p in predictions[::2]] == [p.count for p in expected[::2]]
+    assert stats['num_images'] == 3 and stats['num_filtered'] == 4
+
+    result = benchmark(model, frames, HitFilter(), max_batch_size=4, max_latency_ms=1.0)
+    assert result['filtered_fraction'] == 0.5
+    assert result['throughput_gain'] > 0
+
+
+def test_socket_returns_none_for_filtered_frames():
+    torch.manual_seed(0)
+    frames = np.zeros((4, 128, 128), dtype=np.float32)
+    frames[1] = 1.0
+    with InferenceEngine(MultiOutputCNN_3Layer().eval(), hit_filter=HitFilter()) as engine:
+        server = InferenceServer(engine)
+        server.serve_in_background()
+        try:
+            predictions = classify_remote(server.server_address, frames)
+            blank = classify_remote(server.server_address, frames[:1])
+        finally:
+            server.shutdown()
+            server.server_close()
+    assert predictions[0] is None and predictions[2:] == [None, None]
+    assert predictions[1].count_probs.sum() == pytest.approx(1, rel=1e-5)
+    assert blank == [None]
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from multioutput_cnns import MultiOutputCNN_3Layer
+from inference import InferenceEngine, InferenceServer, classify_remote, main
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(0)
+    return MultiOutputCNN_3Layer().eval()
+
+
+@pytest.fixture
+def images():
+    return np.random.RandomState(0).rand(10, 128, 128).astype(np.float32)
+
+
+def test_predict_matches_eager_model(model, images):
+    with torch.no_grad():
+        y1, y2 = model(torch.from_numpy(images).unsqueeze(1))
+
+    with InferenceEngine(model, max_batch_size=4, max_latency_ms=1.0) as engine:
+        predictions = engine.predict(images)
+
+    assert len(predictions) == len(images)
+    assert [p.count for p in predictions] == y1.argmax(dim=1).tolist()
+    assert [p.particle for p in predictions] == y2.argmax(dim=1).tolist()
+    np.testing.assert_allclose(predictions[0].count_probs, y1[0].exp().numpy(), rtol=1e-5)
+    np.testing.assert_allclose(predictions[0].particle_probs.sum(), 1.0, rtol=1e-5)
+
+
+def test_stats(model, images):
+    with InferenceEngine(model, max_batch_size=4, max_latency_ms=1.0) as engine:
+        assert engine.stats()['num_images'] == 0
+        engine.predict(images)
+        stats = engine.stats()
+
+    assert stats['num_images'] == len(images)
+    assert 0 < stats['p50_ms'] <= stats['p99_ms']
+    assert stats['images_per_sec'] > 0
+    assert 1 <= stats['mean_batch_size'] <= 4
+
+
+def test_submit_requires_start(model, images):
+    engine = InferenceEngine(model)
+    with pytest.raises(RuntimeError):
+        engine.submit(images[0])
+
+
+def test_socket_round_trip(model, images):
+    with InferenceEngine(model, max_batch_size=8, max_latency_ms=1.0) as engine:
+        expected = engine.predict(images)
+        server = InferenceServer(engine)
+        server.serve_in_background()
+        try:
+            predictions = classify_remote(server.server_address, images)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    assert [p.count for p in predictions] == [p.count for p in expected]
+    assert [p.particle for p in predictions] == [p.particle for p in expected]
+    np.testing.assert_allclose(predictions[3].particle_probs, expected[3].particle_probs, rtol=1e-6)
+
+
+def test_main_reports_when_every_frame_is_filtered(monkeypatch, capsys):
+    monkeypatch.setattr('sys.argv', ['inference.py', '--num-images', '16', '--max-batch-size', '8',
+                                     '--blank-fraction', '1', '--min-photons', '0'])
+    main()
+    assert '0 images classified, 16 filtered, p50 n/a' in capsys.readouterr().out
@@ -0,0 +1,52 @@
+import argparse
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from loader_tuning import profile_loader, configurations, tune, apply, training_step, loader_kwargs
+from multioutput_cnns import load_model
+from training import ThumbnailDataset, PARTICLES, COUNTS
+
+
+def _dataset(n=64):
+    rng = np.random.RandomState(0)
+    return ThumbnailDataset(rng.rand(n, 128, 128), rng.randint(0, 4, n), rng.randint(0, 11, n))
+
+
+def test_configurations_skip_worker_options_without_workers():
+    grid = {'num_workers': [0, 1], 'batch_size': [8], 'prefetch_factor': [2, 4],
+            'pin_memory': [False], 'persistent_workers': [False, True]}
+    configs = list(configurations(grid))
+    assert len([c for c in configs if c['num_workers'] == 0]) == 1
+    assert len([c for c in configs if c['num_workers'] == 1]) == 4
+    assert 'prefetch_factor' not in loader_kwargs(configs[0])
+
+
+def test_profile_loader_reports_wait_fraction():
+    config = {'num_workers': 0, 'batch_size': 8}
+    loading = profile_loader(_dataset(), config, num_batches=4, epochs=1)
+    assert loading['data_wait_fraction'] > 0.95
+    assert loading['samples_per_sec'] > 0
+    assert 0 < loading['worker_utilization'] <= 1.5
+
+    model = load_model('multi_output_cnn_10_layers', len(PARTICLES), len(COUNTS))
+    step_fn = training_step(model, torch.optim.Adam(model.parameters()))
+    training = profile_loader(_dataset(), config, step_fn, num_batches=4, epochs=1)
+    assert training['data_wait_fraction'] < 1
+    assert training['step_ms'] > 0
+
+
+def test_tune_and_apply():
+    grid = {'num_workers': [0, 1], 'batch_size': [8, 16], 'prefetch_factor': [2],
+            'pin_memory': [False], 'persistent_workers': [True]}
+    results = tune(_dataset(), grid, num_batches=2, epochs=2)
+    assert len(results) == 4
+    speeds = [r['samples_per_sec'] for r in results]
+    assert speeds == sorted(speeds, reverse=True)
+
+    args = argparse.Namespace(num_workers=4, batch_size=128)
+    kwargs = apply(args, results[0])
+    assert args.batch_size == results[0]['batch_size'] == kwargs['batch_size']
+    assert args.num_workers == kwargs['num_workers']
@@ -0,0 +1,100 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from multioutput_cnns import (MultiOutputCNN, MultiOutputCNN_5Layer, MultiOutputCNN_10Layer, MultiOutputCNN_Early,
+                              LAYERS_10, conv_layers, output_size, load_model)
+
+
+def test_output_size():
+    assert output_size(LAYERS_10, 128) == 4
+    assert output_size(conv_layers(8), 64) == 4
+    with pytest.raises(ValueError):
+        output_size(LAYERS_10, 8)
+
+
+@pytest.mark.parametrize('size', [96, 128, 200])
+def test_any_input_size(size):
+    y1, y2 = MultiOutputCNN_Early()(torch.randn(2, 1, size, size))
+    assert y1.shape == (2, 4)
+    assert y2.shape == (2, 11)
+
+
+def test_branch_point_shares_trunk():
+    late = MultiOutputCNN(LAYERS_10)
+    early = MultiOutputCNN(LAYERS_10, branch_point=2)
+    assert len(late.trunk) == 9 and all(len(branch) == 0 for branch in late.branches)
+    assert len(early.trunk) == 2 and all(len(branch) == 7 for branch in early.branches)
+    assert sum(p.numel() for p in early.parameters()) > sum(p.numel() for p in late.parameters())
+
+
+def test_legacy_checkpoint_keys():
+    """ Checkpoints of the former hand-unrolled classes use conv{i}, conv{i}_b{k}, fc1/fc2 and fc1_b{k}. """
+    torch.manual_seed(0)
+    model = MultiOutputCNN_Early().eval()
+    legacy = {}
+    for key, value in model.state_dict().items():
+        parts = key.split('.')
+        if parts[0] == 'trunk':
+            legacy['conv{}.{}'.format(int(parts[1]) + 1, parts[2])] = value
+        elif parts[0] == 'branches':
+            legacy['conv{}_b{}.{}'.format(int(parts[2]) + 3, int(parts[1]) + 1, parts[3])] = value
+        else:
+            legacy['fc1_b{}.{}'.format(int(parts[1]) + 1, parts[2])] = value
+
+    restored = MultiOutputCNN_Early().eval()
+    restored.load_state_dict(legacy)
+    x = torch.randn(2, 1, 128, 128)
+    for a, b in zip(model(x), restored(x)):
+        assert torch.equal(a, b)
+
+    late = MultiOutputCNN_5Layer()
+    legacy = {}
+    for key, value in late.state_dict().items():
+        parts = key.split('.')
+        if parts[0] == 'trunk':
+            legacy['conv{}.{}'.format(int(parts[1]) + 1, parts[2])] = value
+        else:
+            legacy['fc{}.{}'.format(int(parts[1]) + 1, parts[2])] = value
+    MultiOutputCNN_5Layer().load_state_dict(legacy)
+
+
+def test_load_model(tmp_path):
+    model = MultiOutputCNN_10Layer()
+    path = str(tmp_path / 'ckpt.pth')
+    torch.save({'model_state_dict': model.state_dict()}, path)
+    restored = load_model('multi_output_cnn_10_layers', checkpoint=path)
+    assert not restored.training
+    for a, b in zip(model.state_dict().values(), restored.state_dict().values()):
+        assert torch.equal(a, b)
+    with pytest.raises(ValueError):
+        load_model('multi_output_cnn_4_layers')
+
+
+def test_custom_resnet18_model():
+    from multioutput_cnns import CustomResNet18Model
+    model = CustomResNet18Model(num_counts=4, num_particles=11)
+    assert isinstance(model.model_resnet.conv1, torch.nn.Conv2d)
+    y1, y2 = model(torch.randn(2, 1, 128, 128))
+    assert y1.shape == (2, 4) and y2.shape == (2, 11)
+
+    # Dropout on the features is active in training mode only.
+    model.eval()
+    x = torch.randn(2, 1, 128, 128)
+    assert torch.equal(model(x)[1], model(x)[1])
+    model.train()
+    torch.manual_seed(0)
+    assert not torch.equal(model(x)[1], model(x)[1])
+
+
+def test_thumbnail_resnet18():
+    from multioutput_cnns import thumbnail_resnet18
+    model = thumbnail_resnet18().eval()
+    assert model.conv1.kernel_size == (3, 3)
+    assert model.conv1.weight.is_contiguous(memory_format=torch.channels_last)
+
+    x = torch.randn(2, 1, 128, 128)
+    reference = thumbnail_resnet18(channels_last=False).eval()
+    reference.load_state_dict(model.state_dict())
+    for a, b in zip(model(x), reference(x)):
+        assert torch.allclose(a, b, atol=1e-5)
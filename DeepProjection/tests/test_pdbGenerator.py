@@ -1,5 +1,6 @@
 import pytest
-from pdbGenerator import PDBGenerator
+import pdbGenerator
+from pdbGenerator import PDBGenerator, load_pdb_ids, processed_pdb_ids
 
 @pytest.fixture
 def empty_pdbgenerator():
@@ -13,6 +14,46 @@ def test_getting_pdb(empty_pdbgenerator):
     pdbID, pdbFile = empty_pdbgenerator.get_random_pdb()
     assert empty_pdbgenerator.pdbID is not None
 
+def test_sample_pdb_ids_without_replacement():
+    ids = ['{}abc'.format(i) for i in range(1, 10)]
+    generator = PDBGenerator(ids, seed=0, exclude=['1ABC', '2abc'])
+    first = generator.sample_pdb_ids(3)
+    rest = generator.sample_pdb_ids(10)
+    assert len(first) == 3 and len(rest) == 4
+    assert sorted(first + rest) == ids[2:]
+    assert generator.sample_pdb_ids(1) == []
+
+    # The same seed draws the same order; exclusions added later are skipped too.
+    again = PDBGenerator(ids, seed=0, exclude=['1abc', '2abc'])
+    again.exclude([first[1].upper()])
+    assert again.sample_pdb_ids(7) == [first[0], first[2]] + rest
+    assert PDBGenerator(ids, seed=1).sample_pdb_ids(9) != PDBGenerator(ids, seed=0).sample_pdb_ids(9)
+
+def test_get_random_pdb_fetches_each_id_once(monkeypatch):
+    fetched = []
+
+    def get_pdb_file(pdb_id, filetype='pdb', compression=False):
+        fetched.append(pdb_id)
+        if pdb_id == '2abc':
+            raise ValueError('not found')
+        return 'ATOM ' + pdb_id
+
+    monkeypatch.setattr(pdbGenerator.pypdb, 'get_pdb_file', get_pdb_file)
+    generator = PDBGenerator(['1abc', '2abc', '3abc', '4abc'], seed=0)
+    pdbs = generator.get_random_pdbs(2) + [generator.get_random_pdb(), generator.get_random_pdb()]
+    assert generator.get_random_pdb() == (None, None)
+    assert sorted(fetched) == ['1abc', '2abc', '3abc', '4abc']
+    found = [pdb for pdb in pdbs if pdb[0] is not None]
+    assert sorted(found) == [('1abc', 'ATOM 1abc'), ('3abc', 'ATOM 3abc'), ('4abc', 'ATOM 4abc')]
+
+def test_local_id_list_and_processed_ids(tmp_path):
+    ids = tmp_path / 'pdb_entry_type.txt'
+    ids.write_text('# holdings\n101M prot diffraction\n\n1fpv\tprot\tEM\n')
+    assert load_pdb_ids(str(ids)) == ['101m', '1fpv']
+    (tmp_path / '1FPV.npz').write_bytes(b'')
+    assert processed_pdb_ids(str(tmp_path)) == ['1fpv']
+    assert processed_pdb_ids(str(tmp_path / 'missing')) == []
+
 def test_download_pdb_in_range(empty_pdbgenerator):
     '''download_pdb_in_range() can be run using an "empty" PDBGenerator'''
     '''download_pdb_in_range() returns True when it encounters no input errors; does not mean it successfully downloaded a file'''
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+sk = pytest.importorskip('skopi')
+
+from pdb_cache import PDBCache, read_pdb, ARRAYS, STRINGS, SCALARS
+
+
+@pytest.fixture
+def pdb_file(tmp_path):
+    rng = np.random.RandomState(0)
+    lines = []
+    for i, (name, element) in enumerate([('CA', 'C'), ('N', 'N'), ('O', 'O')] * 20):
+        x, y, z = rng.randn(3) * 10
+        lines.append('ATOM  {:5d}  {:<3} ALA A{:4d}    {:8.3f}{:8.3f}{:8.3f}  1.00  0.00          {:>2}  '
+                     .format(i + 1, name, i + 1, x, y, z, element))
+    path = tmp_path / 'test.pdb'
+    path.write_text('\n'.join(lines) + '\nEND\n')
+    return str(path)
+
+
+def test_cached_particle_matches_parsed(tmp_path, pdb_file):
+    parsed = sk.Particle()
+    parsed.read_pdb(pdb_file, ff='WK')
+
+    cache = PDBCache(str(tmp_path / 'cache'))
+    first, second = cache.read_pdb(pdb_file), cache.read_pdb(pdb_file)
+    assert (cache.misses, cache.hits) == (1, 1)
+    for name in ARRAYS:
+        np.testing.assert_array_equal(getattr(second, name), getattr(parsed, name))
+    for name in STRINGS + SCALARS:
+        assert getattr(second, name) == getattr(parsed, name)
+    assert second.get_num_atoms() == parsed.get_num_atoms() == 60
+    # Memory-mapped copy-on-write: moving a cached particle leaves the cache untouched.
+    second.atom_pos += 1
+    np.testing.assert_array_equal(cache.read_pdb(pdb_file).atom_pos, parsed.atom_pos)
+
+
+def test_cache_is_keyed_by_content_and_force_field(tmp_path, pdb_file, monkeypatch):
+    cache = PDBCache(str(tmp_path / 'cache'))
+    cache.read_pdb(pdb_file, ff='WK')
+    cache.read_pdb(pdb_file, ff='CM')
+    assert cache.misses == 2
+
+    # A hit never parses the file.
+    monkeypatch.setattr(sk.Particle, 'read_pdb', lambda *args, **kwargs: pytest.fail('parsed a cached file'))
+    read_pdb(pdb_file, ff='CM', cache=cache)
+
+    with open(pdb_file, 'a') as f:
+        f.write('\n')
+    with pytest.raises(pytest.fail.Exception):
+        cache.read_pdb(pdb_file, ff='WK')
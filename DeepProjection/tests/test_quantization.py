@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from torch.utils.data import DataLoader
+from multioutput_cnns import MultiOutputCNN_5Layer
+from resnet import resnet18
+from training import ThumbnailDataset
+from quantization import quantize_static, quantize_aware_finetune, compare, model_size_mb, quantized_engine
+
+
+@pytest.fixture
+def loader():
+    rng = np.random.RandomState(0)
+    dataset = ThumbnailDataset(rng.rand(16, 128, 128), rng.randint(0, 4, 16), rng.randint(0, 11, 16))
+    return DataLoader(dataset, batch_size=8)
+
+
+@pytest.mark.parametrize('make_model', [MultiOutputCNN_5Layer, resnet18])
+def test_quantize_static(loader, make_model):
+    torch.manual_seed(0)
+    model = make_model().eval()
+    quantized = quantize_static(model, loader, num_batches=2)
+
+    inputs = next(iter(loader))[0]
+    with torch.no_grad():
+        y1, y2 = model(inputs)
+        q1, q2 = quantized(inputs)
+    assert q1.shape == y1.shape and q2.shape == y2.shape
+    assert model_size_mb(quantized) < model_size_mb(model) / 2
+
+
+def test_quantize_aware_finetune_and_compare(loader):
+    torch.manual_seed(0)
+    model = MultiOutputCNN_5Layer().eval()
+    quantized = quantize_aware_finetune(model, loader, epochs=1)
+
+    report = compare(model, quantized, loader, batch_size=8, repeats=1)
+    assert set(report) == {'float', 'int8', 'delta'}
+    assert report['delta']['size_reduction'] > 2
+    assert report['delta']['accuracy'] == report['int8']['accuracy'] - report['float']['accuracy']
+
+
+def test_quantization_restores_engine(loader):
+    previous = torch.backends.quantized.engine
+    try:
+        torch.backends.quantized.engine = 'qnnpack'
+        quantized = quantize_static(MultiOutputCNN_5Layer().eval(), loader, num_batches=1, backend='x86')
+        assert torch.backends.quantized.engine == 'qnnpack'
+        with quantized_engine('x86'), torch.no_grad():
+            assert torch.backends.quantized.engine == 'x86'
+            quantized(next(iter(loader))[0])
+        assert torch.backends.quantized.engine == 'qnnpack'
+    finally:
+        torch.backends.quantized.engine = previous
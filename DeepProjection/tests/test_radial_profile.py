@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('skopi')
+
+from radial_profile import RadialProfile, SAXS_BIN_WIDTH
+
+
+def _q_map(shape=(24, 20)):
+    rows, cols = np.indices(shape)
+    return np.hypot(rows - 11.5, cols - 9.5) * 0.7 * SAXS_BIN_WIDTH
+
+
+def test_profile_matches_per_bin_means():
+    q_map = _q_map()
+    frames = np.random.RandomState(0).rand(5, *q_map.shape)
+    profile = RadialProfile(q_map)
+    bins = np.rint(q_map / SAXS_BIN_WIDTH).astype(int)
+
+    expected = np.full((5, profile.num_bins), np.nan)
+    for k in np.unique(bins):
+        expected[:, k] = frames[:, bins == k].mean(axis=1)
+        assert profile.qs[k] == pytest.approx(q_map[bins == k].mean())
+
+    np.testing.assert_allclose(profile(frames), expected)
+    np.testing.assert_allclose(profile(frames[2]), expected[2])
+    pytest.importorskip('scipy')
+    np.testing.assert_allclose(profile(frames, method='sparse'), expected)
+
+
+def test_mask_and_on_grid():
+    q_map = _q_map()
+    mask = np.ones(q_map.shape)
+    mask[:, :3] = 0
+    frames = np.ones((2,) + q_map.shape)
+    frames[:, :, :3] = 100
+    profile = RadialProfile(q_map, mask=mask)
+    curves = profile(frames)
+    valid = ~np.isnan(curves)
+    np.testing.assert_allclose(curves[valid], 1)
+
+    # A stored SAXS grid: mean q of bins 0.. beyond the detector's range.
+    qs = (np.arange(profile.num_bins + 3) + 0.1) * SAXS_BIN_WIDTH
+    on_grid = profile.on_grid(curves, qs)
+    assert on_grid.shape == (2, len(qs))
+    np.testing.assert_array_equal(on_grid[:, :profile.num_bins], curves)
+    assert np.isnan(on_grid[:, profile.num_bins:]).all()
+
+
+def test_from_geometry(tmp_path):
+    beam_file = tmp_path / 'test.beam'
+    beam_file.write_text('beam/photon_energy = 4600\nbeam/photonsPerShot = 1e12\nbeam/radius = 5e-7\n')
+    profile = RadialProfile.from_geometry(str(beam_file), (128, 0.1, 0.2), (32, 32))
+    assert profile.shape == (32, 32)
+    assert RadialProfile.from_geometry(str(beam_file), (128, 0.1, 0.2), (32, 32)) is profile
+    full = RadialProfile.from_geometry(str(beam_file), (128, 0.1, 0.2))
+    assert full.shape == (128, 128)
+    # Same grid; binning averages q over each block, so thumbnails reach slightly lower q at the corners.
+    assert 0.95 * full.num_bins <= profile.num_bins <= full.num_bins
+    # Thumbnail pixels span several q bins, so some bins are empty; the others have their mean q in the same bin.
+    qs, full_qs = profile.qs, full.qs[:profile.num_bins]
+    both = ~np.isnan(qs) & ~np.isnan(full_qs)
+    np.testing.assert_allclose(qs[both], full_qs[both], atol=SAXS_BIN_WIDTH)
+    np.testing.assert_array_equal(np.rint(qs[both] / SAXS_BIN_WIDTH), np.flatnonzero(both))
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from saxs_index import SAXSIndex, log_q_grid, resample
+
+
+def _sphere(radius, qs=np.arange(101) * 1e7, scale=1.0):
+    """ SAXS curve of a uniform sphere, radius in m, on the sk.SAXS bin centers. """
+    x = 2 * np.pi * np.maximum(qs, 1e3) * radius
+    return qs, scale * ((3 * (np.sin(x) - x * np.cos(x)) / x ** 3) ** 2 + 1e-6)
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    for i, radius in enumerate(np.linspace(2e-9, 6e-9, 40)):
+        qs, saxs = _sphere(radius, scale=10 ** (i % 3))
+        np.savez(str(tmp_path / 'p{:03d}.npz'.format(i)), qs=qs, saxs=saxs, qmax=1e9)
+    np.savez(str(tmp_path / 'broken.npz'), qs=np.zeros(3), saxs=np.zeros(3), qmax=1e9)
+    return tmp_path
+
+
+def test_resample_is_scale_invariant():
+    grid = log_q_grid(size=64)
+    a = resample(*_sphere(3e-9), grid)
+    b = resample(*_sphere(3e-9, scale=1000), grid)
+    assert a.dtype == np.float32 and abs(a.mean()) < 1e-5
+    np.testing.assert_allclose(a, b, atol=1e-4)
+
+
+def test_search_finds_nearest_radius(data_dir, tmp_path):
+    index = SAXSIndex.from_directory(str(data_dir))
+    assert len(index) == 40 and 'broken' not in index.ids
+
+    ids, scores = index.search_curves([_sphere(4.05e-9)], k=3)
+    assert ids[0][0] in ('p019', 'p020')
+    assert scores[0][0] >= scores[0][1] >= scores[0][2]
+    chi2_ids, chi2 = index.search_curves([dict(zip(('qs', 'saxs'), _sphere(4.05e-9)))], k=3, metric='chi2')
+    assert chi2_ids[0][0] == ids[0][0] and chi2[0][0] <= chi2[0][1]
+
+    index.save(str(tmp_path / 'index'))
+    loaded = SAXSIndex.load(str(tmp_path / 'index'))
+    assert loaded.ids == index.ids
+    np.testing.assert_array_equal(loaded.curves, index.curves)
+
+
+def test_approximate_search_and_knn_graph(data_dir):
+    index = SAXSIndex.from_directory(str(data_dir)).fit_pca(n_components=8)
+    queries = index.curves[[5, 17, 33]]
+    exact, exact_scores = index.search(queries, k=4)
+    approx, approx_scores = index.search(queries, k=4, approximate=True)
+    np.testing.assert_array_equal(approx[:, 0], [5, 17, 33])
+    assert np.mean([len(set(a) & set(e)) for a, e in zip(approx, exact)]) >= 3
+
+    neighbours, scores = index.knn_graph(k=2, chunk_size=7)
+    assert neighbours.shape == (40, 2)
+    assert not (neighbours == np.arange(40)[:, None]).any()
+    # The nearest neighbour of a sphere is one of the adjacent radii.
+    assert (np.abs(neighbours[:, 0] - np.arange(40)) == 1).mean() > 0.9
+    chi2_neighbours, _ = index.knn_graph(k=2, metric='chi2', chunk_size=7)
+    assert (chi2_neighbours[:, 0] == neighbours[:, 0]).mean() > 0.9
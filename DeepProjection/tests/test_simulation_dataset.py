@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('skopi')
+
+from torch.utils.data import DataLoader
+
+from simulation_dataset import SimulatedThumbnailDataset
+from tests.simulators import RandomSimulator
+
+
+def _dataset(**kwargs):
+    simulator_kwargs = {'pdb_files': {'1fpv': None, '1ss8': None}, 'beam_file': None,
+                        'detector_dimensions': (128, 0.1, 0.2), 'thumbnail_shape': (8, 8), 'increase_factor': 1}
+    return SimulatedThumbnailDataset(simulator_kwargs, chunk_size=4, queue_size=2, simulator_cls=RandomSimulator,
+                                     **kwargs)
+
+
+def test_samples_and_labels():
+    dataset = _dataset(frames_per_epoch=10)
+    samples = list(dataset)
+    assert len(samples) == len(dataset) == 10
+    X, count, particle = samples[0]
+    assert X.shape == (1, 8, 8) and X.dtype == torch.float32
+    assert 0 <= count < 4 and 0 <= particle < 2
+    # RandomSimulator draws Poisson(n_part_per_shot) pixels, so the mean reveals the count label.
+    for X, count, particle in samples:
+        assert X.mean().item() == pytest.approx(count + 1, abs=0.6)
+
+
+def test_main_process_stream_ignores_callers_global_rng():
+    expected = torch.stack([X for X, _, _ in _dataset(frames_per_epoch=40)])
+    frames = []
+    for X, _, _ in _dataset(frames_per_epoch=40):
+        np.random.seed(len(frames))
+        np.random.rand(100)
+        frames.append(X)
+    assert torch.equal(torch.stack(frames), expected)
+
+
+def test_main_process_stream_leaves_callers_global_rng_unchanged():
+    np.random.seed(123)
+    expected = np.random.rand(40)
+    np.random.seed(123)
+    draws = [np.random.rand() for _ in _dataset(frames_per_epoch=40)]
+    np.testing.assert_array_equal(draws, expected)
+
+
+def test_workers_epochs_and_stats():
+    dataset = _dataset(frames_per_epoch=24)
+    def epoch(persistent_workers=False):
+        loader = DataLoader(dataset, batch_size=6, num_workers=2, persistent_workers=persistent_workers)
+        return torch.cat([X for X, _, _ in loader]), loader
+
+    first, _ = epoch()
+    assert first.shape == (24, 1, 8, 8)
+    # Restarted workers repeat an epoch unless set_epoch() is called; persistent workers move on.
+    assert torch.equal(first, epoch()[0])
+    dataset.set_epoch(1)
+    second, loader = epoch(persistent_workers=True)
+    assert not torch.equal(first, second)
+    assert not torch.equal(second, torch.cat([X for X, _, _ in loader]))
+    rates = dataset.frames_per_sec()
+    assert set(rates) == {0, 1} and all(rate > 0 for rate in rates.values())
+
+
+def test_endless_stream_stops_cleanly():
+    dataset = _dataset()
+    iterator = iter(dataset)
+    frames = [next(iterator) for _ in range(50)]
+    iterator.close()
+    assert len(frames) == 50
+    with pytest.raises(TypeError):
+        len(dataset)
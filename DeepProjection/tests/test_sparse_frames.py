@@ -0,0 +1,79 @@
+import h5py
+import numpy as np
+import pytest
+
+from sparse_frames import encode, decode, SparseFrameWriter, SparseFrameReader, convert, benchmark
+
+
+def _frames(n=20, shape=(16, 12), seed=0):
+    rng = np.random.RandomState(seed)
+    return (rng.poisson(0.05, (n,) + shape) * (rng.rand(n, 1, 1) > 0.2)).astype(np.float32)
+
+
+def test_encode_decode_roundtrip():
+    frames = _frames()
+    indptr, indices, values = encode(frames)
+    assert indptr[0] == 0 and indptr[-1] == len(values) == np.count_nonzero(frames)
+    assert values.dtype == np.uint16
+    np.testing.assert_array_equal(decode(indptr, indices, values, frames.shape[1:]), frames)
+
+    out = np.full(frames.shape, 7, dtype=np.float32)
+    decode(indptr, indices, values, frames.shape[1:], out=out)
+    np.testing.assert_array_equal(out, frames)
+
+    with pytest.raises(ValueError):
+        encode(frames - 1)
+
+
+def test_float_thumbnails_roundtrip_or_are_rejected(tmp_path):
+    thumbnails = _frames() / 4 + _frames(seed=1) * 0.3
+    assert not np.array_equal(thumbnails, np.round(thumbnails))
+    with pytest.raises(ValueError):
+        encode(thumbnails)
+    np.testing.assert_array_equal(decode(*encode(thumbnails, np.float32), thumbnails.shape[1:]), thumbnails)
+
+    dense, sparse = str(tmp_path / 'thumbnail.h5'), str(tmp_path / 'sparse.h5')
+    with h5py.File(dense, 'w') as f:
+        f.create_dataset('imgs', data=thumbnails)
+    with pytest.raises(ValueError):
+        convert(dense, sparse)
+    assert not (tmp_path / 'sparse.h5').exists()
+    convert(dense, sparse, dtype=np.float32)
+    with SparseFrameReader(sparse) as reader:
+        np.testing.assert_array_equal(reader.read(), thumbnails)
+
+
+def test_decode_into_torch_batch():
+    torch = pytest.importorskip('torch')
+    frames = _frames()
+    out = torch.ones(len(frames), 1, *frames.shape[1:])
+    decode(*encode(frames), frames.shape[1:], out=out)
+    np.testing.assert_array_equal(out[:, 0].numpy(), frames)
+
+
+def test_writer_reader(tmp_path):
+    frames = _frames(50)
+    path = str(tmp_path / 'sparse.h5')
+    with SparseFrameWriter(path, frames.shape[1:], chunk_size=64) as writer:
+        writer.append(frames[:17])
+        writer.append(frames[17:])
+    with SparseFrameReader(path) as reader:
+        assert len(reader) == 50
+        np.testing.assert_array_equal(reader.read(), frames)
+        np.testing.assert_array_equal(reader.read(10, 30), frames[10:30])
+        rows = [40, 3, 4, 5, 40, 0]
+        np.testing.assert_array_equal(reader.read_rows(rows), frames[rows])
+
+
+def test_convert_and_benchmark(tmp_path):
+    frames = _frames(300, (64, 64))
+    dense, sparse = str(tmp_path / 'dense.h5'), str(tmp_path / 'sparse.h5')
+    with h5py.File(dense, 'w') as f:
+        f.create_dataset('photons', data=frames)
+    assert convert(dense, sparse, batch_size=64) == 300
+    with SparseFrameReader(sparse) as reader:
+        np.testing.assert_array_equal(reader.read(), frames)
+    result = benchmark(dense, sparse, batch_size=64)
+    assert result['frames'] == 300
+    assert result['compression_ratio'] > 5
+    assert result['decode_frames_per_sec'] > 0
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from structure_descriptors import shape_descriptors, descriptor_vector, similarity_graph
+
+
+def sphere(rng, n, radius):
+    points = rng.randn(n, 3)
+    return points / np.linalg.norm(points, axis=1, keepdims=True) * radius * rng.uniform(0, 1, (n, 1)) ** (1 / 3.)
+
+
+def test_shape_descriptors_of_a_rod():
+    rng = np.random.RandomState(0)
+    coords = np.c_[rng.uniform(-50, 50, 500), rng.randn(500), rng.randn(500)] + 7
+    d = shape_descriptors(coords, bins=20, r_max=200.0)
+    # Uniform rod of length 100: Rg^2 = 100^2 / 12 (+ 2 from the unit-variance cross-section).
+    assert d['rg'] == pytest.approx(np.sqrt(100 ** 2 / 12. + 2), rel=0.05)
+    assert d['inertia'][0] > 50 * d['inertia'][1]
+    assert d['p_r'].sum() == pytest.approx(1)
+    # No pair of a 100 A rod is longer than ~105 A.
+    assert d['p_r'][11:].sum() == 0
+
+
+def test_p_r_subsampling_and_blocking_agree():
+    rng = np.random.RandomState(1)
+    coords = sphere(rng, 3000, 40)
+    weights = rng.randint(1, 9, 3000)
+    full = shape_descriptors(coords, weights, max_atoms=3000, block_size=3000)
+    blocked = shape_descriptors(coords, weights, max_atoms=3000, block_size=257)
+    sampled = shape_descriptors(coords, weights, max_atoms=1000)
+    np.testing.assert_allclose(blocked['p_r'], full['p_r'], atol=1e-12)
+    np.testing.assert_allclose(sampled['p_r'], full['p_r'], atol=0.01)
+    assert sampled['rg'] == full['rg']
+
+
+def test_similarity_graph_groups_shapes_and_feeds_load_to_dataframe():
+    pd = pytest.importorskip('pandas')
+    pytest.importorskip('pyvis')
+    from visualize_similarity_network import load_to_dataframe
+
+    rng = np.random.RandomState(2)
+    ids, rows = [], []
+    for i in range(6):
+        ids.append('sph{}'.format(i))
+        rows.append(descriptor_vector(shape_descriptors(sphere(rng, 400, 30 + i))))
+        ids.append('rod{}'.format(i))
+        rod = np.c_[rng.uniform(-60 - i, 60 + i, 400), rng.randn(400) * 3, rng.randn(400) * 3]
+        rows.append(descriptor_vector(shape_descriptors(rod)))
+    descriptors = np.array(rows)
+
+    graph = similarity_graph(ids, descriptors, num_neighbors=3, block_size=5)
+    assert [source for source, _ in graph] == ids
+    for source, neighbours in graph:
+        assert len(neighbours) == 3 and source not in [t for t, _ in neighbours]
+        assert all(t[:3] == source[:3] for t, _ in neighbours)
+        scores = [s for _, s in neighbours]
+        assert scores == sorted(scores, reverse=True) and 0 < scores[-1] <= 1
+    assert similarity_graph(ids, descriptors, num_neighbors=3) == graph
+
+    df = load_to_dataframe(graph)
+    assert list(df.columns) == ['Source', 'Target', 'Weight'] and len(df) == 3 * len(ids)
+
+
+def test_offline_similarity_from_pdb_files(tmp_path):
+    pytest.importorskip('skopi')
+    pytest.importorskip('pyvis')
+    from pdb_cache import PDBCache
+    from visualize_similarity_network import get_structure_similarity_data_offline
+
+    rng = np.random.RandomState(3)
+    for k, scale in enumerate([10, 11, 30, 32]):
+        lines = []
+        for i, (x, y, z) in enumerate(rng.randn(100, 3) * scale):
+            lines.append('ATOM  {:5d}  CA  ALA A{:4d}    {:8.3f}{:8.3f}{:8.3f}  1.00  0.00           C  '
+                         .format(i + 1, i + 1, x, y, z))
+        (tmp_path / '{}ABC.pdb'.format(k)).write_text('\n'.join(lines) + '\nEND\n')
+
+    graph = get_structure_similarity_data_offline(str(tmp_path), num_neighbors=1,
+                                                  cache=PDBCache(str(tmp_path / 'cache')))
+    assert dict((source, neighbours[0][0]) for source, neighbours in graph) == \
+        {'0abc': '1abc', '1abc': '0abc', '2abc': '3abc', '3abc': '2abc'}
+    assert get_structure_similarity_data_offline(str(tmp_path), num_neighbors=-1) is None
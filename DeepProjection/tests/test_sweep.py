@@ -0,0 +1,74 @@
+import functools
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from sweep import ASHA, rung_epochs, sweep, load_results, results_grid, plot_heatmap
+from training import random_dataset
+
+
+def test_rung_epochs():
+    assert rung_epochs(1, 9, 3) == [1, 3, 9]
+    assert rung_epochs(1, 10, 3) == [1, 3, 9, 10]
+    assert rung_epochs(4, 4, 2) == [4]
+
+
+def test_asha_promotes_top_fraction():
+    asha = ASHA(num_trials=6, rungs=[1, 3, 9], eta=3)
+    jobs = [asha.next_job() for _ in range(3)]
+    assert jobs == [(0, 0), (1, 0), (2, 0)]
+    for trial, metric in ((0, 50.0), (1, 70.0), (2, 60.0)):
+        asha.report(trial, 0, metric)
+    # One of three results may be promoted: the best one, before new trials start.
+    assert asha.next_job() == (1, 1)
+    assert asha.next_job() == (3, 0)
+    asha.report(1, 1, 80.0)
+    assert asha.status(1) == 'pruned'
+
+
+def test_asha_failed_trial_is_not_promoted():
+    asha = ASHA(num_trials=3, rungs=[1, 3], eta=3)
+    assert [asha.next_job() for _ in range(3)] == [(0, 0), (1, 0), (2, 0)]
+    asha.report(0, 0, 50.0)
+    asha.report(1, 0, 70.0)
+    asha.fail(2)
+    # Only the two reported trials are ranked, too few to promote one.
+    assert asha.next_job() is None
+    assert [asha.status(trial) for trial in range(3)] == ['pruned', 'pruned', 'failed']
+
+
+def test_sweep(tmp_path):
+    results_path = str(tmp_path / 'sweep.jsonl')
+    records = sweep(functools.partial(random_dataset, 4), results_path, learning_rates=[0.001, 0.0001],
+                    weight_decays=[0.01, 0.001], model_name='multi_output_cnn_3_layers', min_epochs=1,
+                    max_epochs=3, eta=3, workers=2, batch_size=8)
+    assert load_results(results_path) == records
+
+    status = {r['trial']: r for r in records if 'status' in r}
+    assert len(status) == 4
+    assert sorted(r['epochs'] for r in status.values()) == [1, 1, 1, 3]
+    assert sum(r['status'] == 'completed' for r in status.values()) == 1
+    epochs = [r for r in records if 'epoch' in r]
+    assert len(epochs) == 6 and all('wall_time' in r and 'config' in r for r in epochs)
+
+    learning_rates, weight_decays, values, trained = results_grid(records, 'particle_accuracy')
+    assert learning_rates == [0.001, 0.0001] and weight_decays == [0.01, 0.001]
+    assert not np.isnan(values).any() and trained.max() == 3
+
+    pytest.importorskip('matplotlib')
+    import matplotlib
+    matplotlib.use('Agg')
+    plot_heatmap(results_path, 'accuracy', path=str(tmp_path / 'heatmap.png'))
+    assert (tmp_path / 'heatmap.png').exists()
+
+
+def test_sweep_replaces_earlier_results(tmp_path):
+    results_path = str(tmp_path / 'sweep.jsonl')
+    kwargs = dict(weight_decays=[0.001], model_name='multi_output_cnn_3_layers', scheduler='grid', min_epochs=1,
+                  max_epochs=1, workers=1, batch_size=8)
+    sweep(functools.partial(random_dataset, 2), results_path, learning_rates=[0.001], **kwargs)
+    records = sweep(functools.partial(random_dataset, 2), results_path, learning_rates=[0.01], **kwargs)
+    assert load_results(results_path) == records
+    assert results_grid(records)[0] == [0.01]
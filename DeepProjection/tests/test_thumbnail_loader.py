@@ -0,0 +1,51 @@
+import h5py
+import numpy as np
+import pytest
+from thumbnail_loader import hit_label, load_data, read_rows
+
+
+@pytest.fixture
+def files(tmp_path):
+    # Frame r of file i is filled with 1000 * i + r.
+    names = ['1fpv_5k_single_pps_1e14_thumbnail.h5', '1fpv_5k_double_pps_1e14_thumbnail.h5',
+             '6ody_5k_quadruple_pps_1e14_thumbnail.h5']
+    for i, name in enumerate(names):
+        frames = (1000 * i + np.arange(300))[:, None, None] * np.ones((1, 4, 5))
+        with h5py.File(tmp_path / name, 'w') as f:
+            f.create_dataset('photons', data=frames, chunks=(16, 4, 5) if i != 1 else None)
+    return tmp_path
+
+
+@pytest.mark.parametrize('chunked', [True, False])
+def test_read_rows(files, chunked):
+    fname = files / ('1fpv_5k_single_pps_1e14_thumbnail.h5' if chunked else '1fpv_5k_double_pps_1e14_thumbnail.h5')
+    offset = 0 if chunked else 1000
+    rows = np.array([299, 3, 17, 16, 3, 150, 151, 0])
+    x = read_rows(str(fname), rows)
+    assert x.dtype == np.float32 and x.shape == (8, 4, 5)
+    np.testing.assert_array_equal(x[:, 0, 0], rows + offset)
+
+
+@pytest.mark.parametrize('parallel', ['thread', 'process'])
+def test_load_data(files, parallel):
+    (x_train, y_train), (x_test, y_test) = load_data(str(files / '*_thumbnail.h5'), 400, 100, seed=0,
+                                                     parallel=parallel, max_workers=2)
+    assert x_train.shape == (400, 4, 5) and x_test.shape == (100, 4, 5)
+    assert x_train.dtype == np.float32 and x_train.flags['C_CONTIGUOUS']
+    file_of = lambda x: (x[:, 0, 0] // 1000).astype(int)
+    np.testing.assert_array_equal(y_train, np.array([0, 1, 1])[file_of(x_train)])
+    np.testing.assert_array_equal(y_test, np.array([0, 1, 1])[file_of(x_test)])
+    # Frames are distinct within and across the splits.
+    frames = np.concatenate([x_train[:, 0, 0], x_test[:, 0, 0]])
+    assert len(np.unique(frames)) == 500
+    (x_again, _), _ = load_data(str(files / '*_thumbnail.h5'), 400, 100, seed=0, max_workers=2)
+    np.testing.assert_array_equal(x_again, x_train)
+
+
+def test_load_data_errors(files):
+    with pytest.raises(FileNotFoundError):
+        load_data(str(files / 'missing_*.h5'))
+    with pytest.raises(ValueError):
+        load_data(str(files / '*_thumbnail.h5'), num_train_samples=2000, seed=0)
+    with pytest.raises(ValueError):
+        hit_label('1fpv_5k_pps_1e14_thumbnail.h5')
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from torch.utils.data import DataLoader
+from multioutput_cnns import MultiOutputCNN_3Layer
+from training import (ThumbnailDataset, thumbnail_file, train_one_epoch, evaluate, count2idx, particle2idx,
+                      to_channels_last, checkpoint_state_dict, load_dataset, split, held_out, get_dataloaders)
+
+
+def random_dataset(n=32, seed=0):
+    rng = np.random.RandomState(seed)
+    return ThumbnailDataset(rng.rand(n, 128, 128), rng.randint(0, 4, n), rng.randint(0, 11, n))
+
+
+def test_thumbnail_dataset_item():
+    dataset = random_dataset()
+    X, count, particle = dataset[3]
+    assert X.shape == (1, 128, 128)
+    assert X.dtype == torch.float32
+    assert count == dataset.count_labels[3]
+    assert particle == dataset.particle_labels[3]
+
+
+def test_thumbnail_dataset_from_h5(tmp_path):
+    h5py = pytest.importorskip('h5py')
+    for count, n in (('single', 8), ('double', 2)):
+        with h5py.File(thumbnail_file(str(tmp_path), '1fpv', count), 'w') as f:
+            f.create_dataset('photons', data=np.full((n, 4, 4), count2idx[count], dtype=np.float32))
+
+    dataset = ThumbnailDataset.from_h5(str(tmp_path), particles=['1fpv'], counts=['single', 'double'], length=2)
+    assert len(dataset) == 10
+    assert (dataset.particle_labels == particle2idx['1fpv']).all()
+    # Images keep their labels through the shuffle.
+    np.testing.assert_array_equal(dataset.images[:, 0, 0], dataset.count_labels)
+
+
+def test_thumbnail_file_names():
+    assert thumbnail_file('out', '1fpv', 'single') == 'out/SPI_1fpv_4k_single_thumbnail.h5'
+    assert thumbnail_file('out', '1fpv', 'double') == 'out/SPI_1fpv_1k_double_thumbnail.h5'
+    assert thumbnail_file('out', '1fpv', 'double', 1500) == 'out/SPI_1fpv_1500_double_thumbnail.h5'
+
+
+def test_load_dataset_split_and_dataloaders():
+    dataset = load_dataset(length=10)
+    assert len(dataset) == 70 and dataset.images.shape[1:] == (128, 128)
+    np.testing.assert_array_equal(load_dataset(length=10).images, dataset.images)
+
+    train_set, valid_set = split(dataset)
+    assert list(train_set.indices) == list(range(49)) and list(valid_set.indices) == list(range(49, 56))
+    assert list(held_out(dataset).indices) == list(range(56, 70))
+
+    train_loader, valid_loader = get_dataloaders(dataset, batch_size=8, generator=torch.Generator().manual_seed(0))
+    assert len(train_loader.dataset) == 49 and len(valid_loader.dataset) == 7
+    assert sum(len(batch[0]) for batch in train_loader) == 49
+
+
+def test_train_and_evaluate():
+    torch.manual_seed(0)
+    model = MultiOutputCNN_3Layer()
+    loader = DataLoader(random_dataset(), batch_size=8)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+
+    stats = train_one_epoch(model, optimizer, loader)
+    assert stats['samples'] == 32
+    assert stats['loss'] > 0
+
+    accuracy, count_accuracy, particle_accuracy, loss = evaluate(model, loader)
+    assert 0 <= accuracy <= min(count_accuracy, particle_accuracy) <= 100
+    assert loss > 0
+
+
+def test_bfloat16_channels_last_checkpoint_compatible():
+    torch.manual_seed(0)
+    model = to_channels_last(MultiOutputCNN_3Layer())
+    loader = DataLoader(random_dataset(), batch_size=8)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    stats = train_one_epoch(model, optimizer, loader, amp_dtype=torch.bfloat16, channels_last=True)
+    assert stats['samples'] == 32 and np.isfinite(stats['loss'])
+    assert all(p.dtype == torch.float32 for p in model.parameters())
+
+    state_dict = checkpoint_state_dict(model)
+    assert all(v.is_contiguous() for v in state_dict.values())
+    plain = MultiOutputCNN_3Layer()
+    plain.load_state_dict(state_dict)
+    assert evaluate(plain, loader) == pytest.approx(evaluate(model, loader, channels_last=True), abs=1e-3)
+    # bfloat16 evaluation agrees with float32 up to a few predictions.
+    assert evaluate(model, loader, amp_dtype=torch.bfloat16)[1] == pytest.approx(evaluate(plain, loader)[1], abs=10)
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+from triplets import (TripletSampler, MiningTripletSampler, MINING_MODES, prefetch, triplet_generator,
+                      pairwise_distances, mine_triplets, online_triplet_loss)
+
+
+@pytest.fixture
+def sampler():
+    rng = np.random.RandomState(0)
+    y = rng.randint(0, 3, 500)
+    x = np.repeat(y[:, None], 8, axis=1).astype(np.float32)  # Each sample stores its own label.
+    return TripletSampler(x, y, seed=0)
+
+
+def test_triplet_labels(sampler):
+    anchors, positives, negatives = sampler.sample_indices(1000)
+    assert (sampler.y[anchors] == sampler.y[positives]).all()
+    assert (sampler.y[anchors] != sampler.y[negatives]).all()
+    # Every sample of the other classes can be drawn as a negative, including the last one.
+    _, _, negatives = sampler.sample_indices(20000, anchor_label=0)
+    assert set(negatives) == set(np.where(sampler.y != 0)[0])
+
+
+def test_create_batch(sampler):
+    (anc, pos, neg), (y_anc, y_pos, y_neg) = sampler.create_batch(64, anchor_label=2)
+    assert anc.shape == pos.shape == neg.shape == (64, 8)
+    assert (y_anc == 2).all() and (y_pos == 2).all() and (y_neg != 2).all()
+    assert (anc[:, 0] == y_anc).all() and (neg[:, 0] == y_neg).all()
+    with pytest.raises(ValueError):
+        sampler.create_batch(4, anchor_label=7)
+
+
+def test_seed_is_reproducible(sampler):
+    first = TripletSampler(sampler.x, sampler.y, seed=5).sample_indices(16)
+    second = TripletSampler(sampler.x, sampler.y, seed=5).sample_indices(16)
+    for a, b in zip(first, second):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_single_class_is_rejected():
+    with pytest.raises(ValueError):
+        TripletSampler(np.zeros((4, 2)), np.zeros(4))
+
+
+@pytest.mark.parametrize('prefetch_batches', [0, 2])
+def test_triplet_generator(sampler, prefetch_batches):
+    generator = triplet_generator(sampler, batch_size=32, emb_dim=4, prefetch_batches=prefetch_batches)
+    for _ in range(3):
+        x, y = next(generator)
+        assert len(x) == 3 and x[0].shape == (32, 8)
+        assert y.shape == (32, 12)
+    generator.close()
+
+
+def test_prefetch_reraises():
+    def failing():
+        yield 1
+        raise KeyError('boom')
+
+    generator = prefetch(failing())
+    assert next(generator) == 1
+    with pytest.raises(KeyError):
+        next(generator)
+
+
+def test_pairwise_distances():
+    e = np.random.RandomState(0).rand(20, 5)
+    expected = np.mean(np.square(e[:, None] - e[None, :]), axis=2)
+    np.testing.assert_allclose(pairwise_distances(e), expected, atol=1e-6)
+
+
+@pytest.mark.parametrize('mode', MINING_MODES)
+def test_mine_triplets(mode):
+    rng = np.random.RandomState(1)
+    labels = rng.randint(0, 3, 40)
+    labels[0] = 3  # An anchor without positives is skipped.
+    d = pairwise_distances(rng.rand(40, 4))
+    a, p, n = mine_triplets(d, labels, margin=0.05, mode=mode, rng=np.random.default_rng(0))
+    assert len(a) > 0 and 0 not in a
+    assert (labels[a] == labels[p]).all() and (a != p).all() and (labels[a] != labels[n]).all()
+    if mode == 'batch_hard':
+        for i, j, k in zip(a, p, n):
+            assert d[i, j] == d[i, (labels == labels[i]) & (np.arange(40) != i)].max()
+            assert d[i, k] == d[i, labels != labels[i]].min()
+    if mode == 'batch_all':
+        assert (d[a, p] - d[a, n] + 0.05 > 0).all()
+
+
+def test_mining_sampler(sampler):
+    # Embedding is the label plus noise: mined negatives are still of another class.
+    embed = lambda x: x[:, :2] + np.random.RandomState(0).rand(len(x), 2)
+    mining = MiningTripletSampler(sampler, embed, mode='semi_hard', pool_size=100)
+    (anc, pos, neg), (y_anc, y_pos, y_neg) = mining.create_batch(64)
+    assert anc.shape == (64, 8)
+    assert (y_anc == y_pos).all() and (y_anc != y_neg).all()
+    x, y = next(triplet_generator(mining, 16, 4, prefetch_batches=0))
+    assert len(x) == 3 and y.shape == (16, 12)
+
+
+def test_online_triplet_loss():
+    tf = pytest.importorskip('tensorflow')
+    rng = np.random.RandomState(2)
+    emb = rng.rand(30, 6).astype(np.float32)
+    labels = rng.randint(0, 3, 30)
+    d = pairwise_distances(emb)
+    a, p, n = mine_triplets(d, labels, 0.1, 'batch_hard')
+    expected = np.maximum(d[a, p] - d[a, n] + 0.1, 0)
+    loss = online_triplet_loss(0.1)(tf.constant(labels.astype(np.float32)), tf.constant(emb)).numpy()
+    np.testing.assert_allclose(loss[a], expected, atol=1e-5)
+    a, p, n = mine_triplets(d, labels, 0.1, 'batch_all')
+    loss = online_triplet_loss(0.1, 'batch_all')(tf.constant(labels.astype(np.float32)), tf.constant(emb)).numpy()
+    np.testing.assert_allclose(loss, np.mean(d[a, p] - d[a, n] + 0.1), atol=1e-5)
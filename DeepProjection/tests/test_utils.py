@@ -1,4 +1,4 @@
-from utils import equal_float, check_img_for_nan, check_for_blank_img, check_img_for_right_shape
+from utils import equal_float, check_img_for_nan, check_for_blank_img, blank_frames, check_img_for_right_shape
 import numpy as np
 
 
@@ -45,6 +45,17 @@ def test_check_for_blank_img():
     assert check_for_blank_img(test_2_img) == False
 
 
+def test_blank_frames():
+    """ Tests blank_frames() in utils.py """
+
+    # 1. Blank, non-blank and zero-sum frames in one stack. Only the first should be blank.
+    imgs = np.zeros(shape=(3, 32, 32), dtype=np.float64)
+    imgs[1, 4, 4] = 1.0
+    imgs[2, 0, 0], imgs[2, 0, 1] = 1.0, -1.0
+    assert blank_frames(imgs).tolist() == [True, False, False]
+    assert [check_for_blank_img(img) for img in imgs] == [True, False, False]
+
+
 def test_check_img_for_right_shape():
     """ Tests check_img_for_right_shape() in utils.py """
 
@@ -0,0 +1,102 @@
+import pytest
+
+pytest.importorskip('pyvis')
+nx = pytest.importorskip('networkx')
+
+import visualize_similarity_network as vsn
+
+
+@pytest.fixture
+def fake_query(monkeypatch):
+    results = {'1a00': [('1A00', 1.0), ('2B00', 0.9), ('3C00', 0.8)],
+               '1a01': [('1A01', 1.0), ('2B00', 0.7)],
+               '1a02': None}
+    queried = []
+
+    def query(pdb_id, mode='strict_shape_match'):
+        queried.append(pdb_id)
+        return results.get(pdb_id)
+
+    monkeypatch.setattr(vsn, 'query_structure_similarity_pdbs', query)
+    return results, queried
+
+
+def test_delta_crawl_queries_only_new_and_stale_ids(tmp_path, fake_query):
+    results, queried = fake_query
+    path = str(tmp_path / 'state.json')
+
+    state = vsn.load_crawl_state(path)
+    changed = vsn.get_structure_similarity_data_delta(state, '1a00', '1a02', num_neighbors=1, now=0)
+    assert queried == ['1a00', '1a01', '1a02'] and changed == ['1a00', '1a01']
+    assert state['entries']['1a02'] == {'fetched': None, 'hash': None, 'neighbors': None, 'failed': 0}
+    assert vsn.crawl_state_to_similarity_data(state) == [('1a00', [('2B00', 0.9)]), ('1a01', [('2B00', 0.7)])]
+    vsn.save_crawl_state(state, path)
+
+    # Nothing is stale yet and the failed ID is not due for a retry: no queries.
+    state = vsn.load_crawl_state(path)
+    del queried[:]
+    assert vsn.get_structure_similarity_data_delta(state, '1a00', '1a02', num_neighbors=1, now=10, max_age=100,
+                                                   retry_age=100) == []
+    assert queried == []
+
+    # A new ID in the range is queried alone.
+    results['1a03'] = [('1A03', 1.0), ('1A00', 0.95)]
+    assert vsn.get_structure_similarity_data_delta(state, '1a00', '1a03', num_neighbors=1, now=20, max_age=100,
+                                                   retry_age=100) == ['1a03']
+    assert queried == ['1a03']
+
+    # Stale IDs are queried again, but only those whose results differ are changed.
+    del queried[:]
+    results['1a01'] = [('1A01', 1.0), ('3C00', 0.6)]
+    assert vsn.get_structure_similarity_data_delta(state, '1a00', '1a03', num_neighbors=1, now=110, max_age=100) == ['1a01']
+    assert queried == ['1a00', '1a01', '1a02']
+    assert state['entries']['1a01']['neighbors'] == [['3C00', 0.6]]
+    assert state['entries']['1a01']['fetched'] == 110 and state['entries']['1a03']['fetched'] == 20
+
+
+def test_update_layout_moves_only_changed_part():
+    graph = nx.Graph([('a', 'b'), ('c', 'd'), ('d', 'e')])
+    positions = {node: list(xy) for node, xy in vsn.update_layout(graph, {}, [], seed=0).items()}
+    assert set(positions) == set(graph)
+
+    # Unchanged network: the stored layout is returned as is.
+    assert vsn.update_layout(graph, positions, []) == {node: tuple(xy) for node, xy in positions.items()}
+
+    graph.add_edge('a', 'f')
+    pos = vsn.update_layout(graph, positions, ['a'], seed=0)
+    for node in 'cde':
+        assert tuple(pos[node]) == pytest.approx(positions[node])
+    assert set(pos) == set(graph) and tuple(pos['b']) != pytest.approx(positions['b'])
+
+
+def test_trim_similarity_data():
+    data = [('1A00', 1.0)] + [('X{}'.format(i), 1 - i / 20.) for i in range(12)]
+    assert vsn.trim_similarity_data(data, 5) == data[1:6]
+    assert vsn.trim_similarity_data(data, 20) == data[1:]
+    assert len(data) == 13
+
+
+def test_failed_requery_keeps_neighbors_and_is_retried(tmp_path, fake_query):
+    results, queried = fake_query
+    state = vsn.load_crawl_state(str(tmp_path / 'state.json'))
+    vsn.get_structure_similarity_data_delta(state, '1a00', '1a00', num_neighbors=1, now=0)
+    entry = dict(state['entries']['1a00'])
+
+    # The stale re-query fails (e.g. rate limited): the old neighbors stay and nothing changed.
+    results['1a00'] = None
+    assert vsn.get_structure_similarity_data_delta(state, '1a00', '1a00', num_neighbors=1, now=200, max_age=100) == []
+    assert state['entries']['1a00'] == dict(entry, failed=200)
+    assert vsn.crawl_state_to_similarity_data(state) == [('1a00', [('2B00', 0.9)])]
+
+    # The next run queries it again.
+    del queried[:]
+    results['1a00'] = [('1A00', 1.0), ('2B00', 0.9)]
+    assert vsn.get_structure_similarity_data_delta(state, '1a00', '1a00', num_neighbors=1, now=210, max_age=100) == []
+    assert queried == ['1a00'] and state['entries']['1a00'] == dict(entry, fetched=210)
+
+
+def test_delta_crawl_of_invalid_range_is_empty(tmp_path, fake_query):
+    results, queried = fake_query
+    state = vsn.load_crawl_state(str(tmp_path / 'state.json'))
+    assert vsn.get_structure_similarity_data_delta(state, 'AAAA', num_neighbors=1) == []
+    assert queried == [] and state['entries'] == {}
@@ -0,0 +1,240 @@
+"""
+
+Loads a random sample of diffraction thumbnails from many HDF5 files.
+
+load_data() replaces load_data() in examples/twin_network_for_diffraction.ipynb.
+Instead of a hardcoded list of files read in full, the files are found with a
+glob pattern and only the sampled frames are read: the rows wanted from each
+file are sorted and fetched chunk by chunk, so a frame costs one chunk read at
+most, and the files are read concurrently into one preallocated float32 array.
+
+    (x_train, y_train), (x_test, y_test) = load_data('/data/*_5k_*_pps_1e14_thumbnail.h5',
+                                                     num_train_samples=2000, seed=0)
+
+"""
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import h5py
+import numpy as np
+
+
+hit2idx = {
+    'single_hit': 0,
+    'multi_hit': 1
+}
+
+
+def hit_label(fname):
+    """ Returns the hit2idx label of a dataset from the particle count in its file name. """
+    name = os.path.basename(fname)
+    if 'single' in name:
+        return hit2idx['single_hit']
+    if ('double' in name) or ('triple' in name) or ('quadruple' in name):
+        return hit2idx['multi_hit']
+    raise ValueError('Unknown file being processed. Be sure that one of the following count types are in the '
+                     'file name: "single", "double", "triple", or "quadruple": {}'.format(fname))
+
+
+def discover(pattern):
+    """ Returns the files matching a glob pattern, sorted so the file order (and hence sampling) is reproducible. """
+    files = sorted(glob.glob(pattern))
+    if not files:
+        raise FileNotFoundError('No files match {}'.format(pattern))
+    return files
+
+
+def _dataset_shape(fname, dataset):
+    with h5py.File(fname, 'r') as f:
+        return f[dataset].shape
+
+
+def _row_blocks(rows, chunk_rows):
+    """
+    Splits sorted unique rows into blocks that are each read with one slice.
+
+    With chunked storage a block covers the requested rows inside one chunk; with contiguous
+    storage (chunk_rows None) a block is a run of consecutive rows.
+    """
+    if chunk_rows is None:
+        breaks = np.nonzero(np.diff(rows) != 1)[0] + 1
+    else:
+        breaks = np.nonzero(np.diff(rows // chunk_rows))[0] + 1
+    return np.split(rows, breaks)
+
+
+def read_rows(fname, rows, dataset='photons', out=None):
+    """
+    Reads the frames at the given row indices of an HDF5 dataset.
+
+    Parameters
+    ----------
+    fname: str
+        HDF5 file.
+    rows: numpy.array
+        Row indices, in any order and possibly repeated.
+    dataset: str
+        Name of the (N, H, W) dataset.
+    out: numpy.array (optional)
+        float32 array of shape (len(rows), H, W) to write the frames into.
+
+    Return
+    ------
+    float32 numpy.array with the frames in the order of rows.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    unique, inverse = np.unique(rows, return_inverse=True)
+    with h5py.File(fname, 'r') as f:
+        d = f[dataset]
+        if out is None:
+            out = np.empty((len(rows),) + d.shape[1:], dtype=np.float32)
+        frames = np.empty((len(unique),) + d.shape[1:], dtype=np.float32)
+        chunk_rows = d.chunks[0] if d.chunks is not None else None
+        start = 0
+        for block in _row_blocks(unique, chunk_rows):
+            data = d[block[0]:block[-1] + 1]
+            frames[start:start + len(block)] = data[block - block[0]]
+            start += len(block)
+    out[...] = frames[inverse]
+    return out
+
+
+def _read_file(args):
+    fname, rows, dataset = args
+    return read_rows(fname, rows, dataset)
+
+
+def sample_rows(files, num_samples, dataset='photons', exclude=None, rng=None, max_workers=8):
+    """
+    Draws num_samples (file, row) pairs: a file uniformly at random per sample, as load_data() in the
+    notebook does, then distinct rows of that file uniformly at random.
+
+    Parameters
+    ----------
+    files: list(str)
+        HDF5 files.
+    num_samples: int
+        Number of frames to draw.
+    dataset: str
+        Name of the frames' dataset.
+    exclude: list(numpy.array) (optional)
+        Rows already drawn from each file, which are not drawn again.
+    rng: numpy.random.Generator or int (optional)
+        Source of randomness, or a seed for one.
+    max_workers: int
+        Files whose shapes are read concurrently.
+
+    Return
+    ------
+    file_index: numpy.array
+        File of each sample, shape (num_samples,).
+    rows: list(numpy.array)
+        Sampled rows of each file, in the order the samples of that file appear in file_index.
+    """
+    rng = rng if isinstance(rng, np.random.Generator) else np.random.default_rng(rng)
+    with ThreadPoolExecutor(max_workers) as pool:
+        lengths = [shape[0] for shape in pool.map(lambda fname: _dataset_shape(fname, dataset), files)]
+    file_index = rng.integers(0, len(files), num_samples)
+    counts = np.bincount(file_index, minlength=len(files))
+
+    rows = []
+    for i, n in enumerate(counts):
+        available = np.arange(lengths[i])
+        if exclude is not None:
+            available = np.setdiff1d(available, exclude[i], assume_unique=True)
+        if n > len(available):
+            raise ValueError('{} frames requested from {}, which has {} left'.format(n, files[i], len(available)))
+        rows.append(rng.choice(available, n, replace=False))
+    return file_index, rows
+
+
+def read_samples(files, file_index, rows, dataset='photons', parallel='thread', max_workers=8):
+    """
+    Reads the frames chosen by sample_rows() into one contiguous float32 array.
+
+    Parameters
+    ----------
+    files: list(str)
+        HDF5 files.
+    file_index, rows:
+        Output of sample_rows().
+    dataset: str
+        Name of the frames' dataset.
+    parallel: str
+        'thread' reads files on a thread pool, writing directly into the output. h5py serializes
+        calls within a process, so 'process' (a process pool) is faster for compressed datasets.
+    max_workers: int
+        Files read concurrently.
+
+    Return
+    ------
+    float32 numpy.array of shape (len(file_index), H, W).
+    """
+    if parallel not in ('thread', 'process'):
+        raise ValueError("parallel must be 'thread' or 'process', got {}".format(parallel))
+    shape = _dataset_shape(files[0], dataset)[1:]
+    x = np.empty((len(file_index),) + shape, dtype=np.float32)
+    positions = [np.nonzero(file_index == i)[0] for i in range(len(files))]
+    jobs = [i for i in range(len(files)) if len(rows[i]) > 0]
+
+    if parallel == 'thread':
+        def read(i):
+            x[positions[i]] = read_rows(files[i], rows[i], dataset)
+        with ThreadPoolExecutor(max_workers) as pool:
+            list(pool.map(read, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers) as pool:
+            for i, frames in zip(jobs, pool.map(_read_file, [(files[i], rows[i], dataset) for i in jobs])):
+                x[positions[i]] = frames
+    return x
+
+
+def load_data(pattern, num_train_samples=200, num_test_samples=50, dataset='photons', transform=None,
+              label_fn=hit_label, seed=None, parallel='thread', max_workers=8):
+    """
+    Loads the data that will be used for model training. Labels diffraction images
+    by their respective particle count.
+
+    Parameters
+    ----------
+    pattern: str or list(str)
+        Glob pattern of the thumbnail files, e.g. '/data/*_5k_*_pps_1e14_thumbnail.h5', or a list of files.
+    num_train_samples: int
+        Number of training samples to include in training dataset.
+    num_test_samples: int
+        Number of test samples to include in test dataset. Test frames are distinct from training frames.
+    dataset: str
+        Name of the frames' dataset in each file.
+    transform: callable (optional)
+        Applied to each of x_train and x_test, e.g. functools.partial(augmentation.add_noise, rng=seed).
+    label_fn: callable
+        Maps a file name to the label of its frames.
+    seed: int (optional)
+        Seed used to randomly sample the data.
+    parallel: str
+        See read_samples().
+    max_workers: int
+        Files read concurrently.
+
+    Return
+    ------
+    (x_train, y_train): diffraction images and their labels, with a size of num_train_samples.
+
+    (x_test, y_test): diffraction images and their labels, with a size of num_test_samples.
+    """
+    files = discover(pattern) if isinstance(pattern, str) else list(pattern)
+    labels = np.array([label_fn(fname) for fname in files], dtype=np.uint8)
+    rng = np.random.default_rng(seed)
+
+    train_index, train_rows = sample_rows(files, num_train_samples, dataset, rng=rng, max_workers=max_workers)
+    test_index, test_rows = sample_rows(files, num_test_samples, dataset, exclude=train_rows, rng=rng,
+                                        max_workers=max_workers)
+
+    splits = []
+    for file_index, rows in ((train_index, train_rows), (test_index, test_rows)):
+        x = read_samples(files, file_index, rows, dataset, parallel, max_workers)
+        if transform is not None:
+            x = np.ascontiguousarray(transform(x), dtype=np.float32)
+        splits.append((x, labels[file_index]))
+    return tuple(splits)
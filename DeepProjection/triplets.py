@@ -0,0 +1,480 @@
+"""
+
+Triplet sampling for the twin (Siamese) network in examples/twin_network_*.ipynb.
+
+TripletSampler groups the training set by label once, so anchors, positives
+and negatives for a whole batch are drawn with a few vectorized index
+operations instead of two np.where() scans of y_train per triplet.
+triplet_generator() is a drop-in replacement for the notebooks'
+data_generator() that builds batches on a background thread:
+
+    sampler = TripletSampler(x_train, y_train, seed=0)
+    net.fit(triplet_generator(sampler, batch_size, emb_dim), ...)
+
+Online mining picks the informative triplets from the current embedding
+instead: MiningTripletSampler feeds semi-hard (or batch-hard/batch-all)
+triplets to the same twin network, and online_triplet_loss() trains the
+embedding model directly on labelled batches. compare_convergence()
+measures test triplet accuracy per second of training for each strategy.
+
+"""
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class TripletSampler:
+    """
+    Draws (anchor, positive, negative) triplets from a labelled dataset.
+    """
+
+    def __init__(self, x, y, seed=None):
+        """
+        Parameters
+        ----------
+        x: numpy.array
+            Images or vectorized images; the first axis indexes samples.
+        y: numpy.array
+            Label of each sample, shape (N,). At least two distinct labels are required.
+        seed: int or numpy.random.Generator (optional)
+            Seed for the sampler's own random number generator.
+        """
+        self.x = x
+        self.y = np.asarray(y)
+        if len(self.x) != len(self.y):
+            raise ValueError('x and y must have the same length.')
+
+        self.classes, self.class_of = np.unique(self.y, return_inverse=True)
+        if len(self.classes) < 2:
+            raise ValueError('Triplets need at least two classes, got {}'.format(len(self.classes)))
+
+        # Sample indices grouped by class: class c occupies by_class[starts[c]:starts[c] + counts[c]].
+        self.by_class = np.argsort(self.class_of, kind='stable')
+        self.counts = np.bincount(self.class_of)
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1]))
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return len(self.y)
+
+    def sample_indices(self, batch_size, anchor_label=None):
+        """
+        Draws the sample indices of batch_size triplets.
+
+        Anchors are drawn uniformly from the dataset (or from anchor_label's samples),
+        positives uniformly from the anchor's class and negatives uniformly from all other classes.
+
+        Return
+        ------
+        anchors, positives, negatives: numpy.array
+            Index arrays of shape (batch_size,).
+        """
+        n = len(self.y)
+        if anchor_label is None:
+            anchors = self.rng.integers(0, n, batch_size)
+            c = self.class_of[anchors]
+        else:
+            label = np.searchsorted(self.classes, anchor_label)
+            if label >= len(self.classes) or self.classes[label] != anchor_label:
+                raise ValueError('Unknown anchor_label {}'.format(anchor_label))
+            c = np.full(batch_size, label)
+            anchors = self.by_class[self.starts[c] + self.rng.integers(0, self.counts[c])]
+
+        positives = self.by_class[self.starts[c] + self.rng.integers(0, self.counts[c])]
+
+        # Draw a position among the n - counts[c] samples outside the anchor's class,
+        # then skip over the anchor's block in the grouped order.
+        r = self.rng.integers(0, n - self.counts[c])
+        negatives = self.by_class[r + (r >= self.starts[c]) * self.counts[c]]
+        return anchors, positives, negatives
+
+    def create_batch(self, batch_size, anchor_label=None):
+        """
+        Same output as create_batch() in the twin network notebooks.
+
+        Return
+        ------
+        [anchors, positives, negatives]: list(numpy.array)
+            Samples of the batch, each of shape (batch_size,) + x.shape[1:].
+        [anchor_labels, positive_labels, negative_labels]: list(numpy.array)
+            Their labels.
+        """
+        indices = self.sample_indices(batch_size, anchor_label)
+        return [self.x[i] for i in indices], [self.y[i] for i in indices]
+
+
+# Markers passed from the prefetch thread to the consumer.
+_END = object()
+
+
+class _Error:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def prefetch(iterable, size=2):
+    """
+    Iterates over iterable on a background thread, keeping up to size items ready.
+
+    Exceptions raised by iterable are re-raised in the consumer. Closing the returned
+    generator (or letting it be garbage-collected) stops the background thread.
+    """
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def worker():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_Error(e))
+            return
+        put(_END)
+
+    threading.Thread(target=worker, name='prefetch', daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                return
+            if isinstance(item, _Error):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+
+
+def triplet_generator(sampler, batch_size, emb_dim, prefetch_batches=2):
+    """
+    Generates triplet batches for the twin network during model training.
+
+    Parameters
+    ----------
+    sampler: TripletSampler
+        Sampler over the training set.
+    batch_size: int
+        How many triplets are in a batch.
+    emb_dim: int
+        The number of features in the embedding vector.
+    prefetch_batches: int
+        Number of batches prepared ahead on a background thread. 0 builds them on demand.
+
+    Yields
+    ------
+    x: [anchors, positives, negatives]
+    y: numpy.array of zeros with shape (batch_size, 3 * emb_dim), ignored by the triplet loss.
+    """
+    def batches():
+        y = np.zeros((batch_size, 3 * emb_dim), dtype=np.float32)
+        while True:
+            x, _ = sampler.create_batch(batch_size)
+            yield x, y
+
+    if prefetch_batches > 0:
+        return prefetch(batches(), prefetch_batches)
+    return batches()
+
+
+############################################################ Online triplet mining ############################################################
+
+MINING_MODES = ('batch_all', 'batch_hard', 'semi_hard')
+
+
+def pairwise_distances(embeddings):
+    """
+    Distances between all pairs of embeddings, computed with a single matrix product.
+
+    The distance is the mean squared difference over the embedding dimensions,
+    the same distance triplet_loss() in the notebooks uses.
+
+    Parameters
+    ----------
+    embeddings: numpy.array
+        Shape (N, emb_dim).
+
+    Return
+    ------
+    numpy.array of shape (N, N).
+    """
+    e = np.asarray(embeddings, dtype=np.float32)
+    sq = np.einsum('ij,ij->i', e, e)
+    d = sq[:, None] + sq[None, :] - 2 * (e @ e.T)
+    np.maximum(d, 0, out=d)
+    return d / e.shape[1]
+
+
+def mine_triplets(distances, labels, margin, mode='batch_hard', rng=None, chunk_size=64):
+    """
+    Selects informative triplets from the distances between the embeddings of a batch.
+
+    Parameters
+    ----------
+    distances: numpy.array
+        (N, N) distances from pairwise_distances().
+    labels: numpy.array
+        Label of each embedding, shape (N,).
+    margin: float
+        Triplet loss margin (alpha).
+    mode: str
+        'batch_hard': for every anchor, its farthest positive and closest negative.
+        'semi_hard': for every anchor and a random positive, the closest negative farther away than the
+                     positive but within the margin (FaceNet); the closest negative if there is none.
+        'batch_all': every triplet with a non-zero loss.
+    rng: numpy.random.Generator (optional)
+        Used to draw the positives in 'semi_hard' mode.
+    chunk_size: int
+        Anchors processed at once in 'batch_all' mode, which bounds memory to chunk_size * N * N.
+
+    Return
+    ------
+    anchors, positives, negatives: numpy.array
+        Indices into the batch. Anchors without a positive or a negative in the batch are skipped.
+    """
+    if mode not in MINING_MODES:
+        raise ValueError('mode must be one of {}, got {}'.format(MINING_MODES, mode))
+    labels = np.asarray(labels)
+    same = labels[:, None] == labels[None, :]
+    positive = same & ~np.eye(len(labels), dtype=bool)
+    negative = ~same
+    valid = positive.any(axis=1) & negative.any(axis=1)
+    anchors = np.nonzero(valid)[0]
+
+    if mode == 'batch_hard':
+        positives = np.where(positive, distances, -np.inf)[anchors].argmax(axis=1)
+        negatives = np.where(negative, distances, np.inf)[anchors].argmin(axis=1)
+        return anchors, positives, negatives
+
+    if mode == 'semi_hard':
+        rng = np.random.default_rng() if rng is None else rng
+        # A uniformly random positive per anchor: the argmax of random keys restricted to positives.
+        keys = np.where(positive[anchors], rng.random((len(anchors), len(labels))), -1.0)
+        positives = keys.argmax(axis=1)
+        d_ap = distances[anchors, positives][:, None]
+        d_an = np.where(negative[anchors], distances[anchors], np.inf)
+        semi_hard = np.where((d_an > d_ap) & (d_an < d_ap + margin), d_an, np.inf)
+        negatives = np.where(np.isfinite(semi_hard).any(axis=1), semi_hard.argmin(axis=1), d_an.argmin(axis=1))
+        return anchors, positives, negatives
+
+    triplets = []
+    for start in range(0, len(anchors), chunk_size):
+        a = anchors[start:start + chunk_size]
+        loss = distances[a][:, :, None] - distances[a][:, None, :] + margin
+        mask = positive[a][:, :, None] & negative[a][:, None, :] & (loss > 0)
+        i, p, n = np.nonzero(mask)
+        triplets.append((a[i], p, n))
+    if not triplets:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty
+    return tuple(np.concatenate(t) for t in zip(*triplets))
+
+
+class MiningTripletSampler:
+    """
+    Draws triplets mined online from the current embedding, in the format of TripletSampler.create_batch().
+
+    Each batch embeds a random pool of samples with the current embedding model, computes the
+    pool's distance matrix once and keeps the triplets selected by mine_triplets(). Use it with
+    triplet_generator() in place of a TripletSampler:
+
+        sampler = MiningTripletSampler(TripletSampler(x_train, y_train), embedding_model.predict)
+        net.fit(triplet_generator(sampler, batch_size, emb_dim, prefetch_batches=0), ...)
+
+    Prefetching is best disabled, since batches built ahead are mined with stale weights.
+    """
+
+    def __init__(self, sampler, embed, mode='semi_hard', margin=0.5, pool_size=None):
+        """
+        Parameters
+        ----------
+        sampler: TripletSampler
+            Sampler over the training set; provides the data and random number generator.
+        embed: callable
+            Maps an array of samples to an (N, emb_dim) array, e.g. embedding_model.predict.
+        mode: str
+            See mine_triplets().
+        margin: float
+            Triplet loss margin (alpha).
+        pool_size: int (optional)
+            Samples embedded per batch. Defaults to the batch size.
+        """
+        if mode not in MINING_MODES:
+            raise ValueError('mode must be one of {}, got {}'.format(MINING_MODES, mode))
+        self.sampler = sampler
+        self.embed = embed
+        self.mode = mode
+        self.margin = margin
+        self.pool_size = pool_size
+
+    def sample_indices(self, batch_size):
+        rng = self.sampler.rng
+        pool = rng.integers(0, len(self.sampler), self.pool_size or batch_size)
+        distances = pairwise_distances(self.embed(self.sampler.x[pool]))
+        anchors, positives, negatives = mine_triplets(distances, self.sampler.y[pool], self.margin, self.mode, rng)
+        if len(anchors) == 0:
+            return self.sampler.sample_indices(batch_size)
+        keep = rng.choice(len(anchors), batch_size, replace=len(anchors) < batch_size)
+        return pool[anchors[keep]], pool[positives[keep]], pool[negatives[keep]]
+
+    def create_batch(self, batch_size):
+        indices = self.sample_indices(batch_size)
+        return [self.sampler.x[i] for i in indices], [self.sampler.y[i] for i in indices]
+
+
+def online_triplet_loss(alpha, mode='batch_hard'):
+    """
+    Keras loss that mines triplets inside each batch of embeddings.
+
+    Unlike triplet_loss() in the notebooks, the model being trained is the embedding model itself,
+    fed with (images, labels) batches: y_true holds the labels and y_pred the embeddings.
+
+    Parameters
+    ----------
+    alpha: float
+        Triplet loss margin.
+    mode: str
+        'batch_hard' (per-anchor hardest positive and negative) or 'batch_all'
+        (mean over all triplets with a non-zero loss). 'batch_hard' can collapse the embedding
+        when training from scratch; see compare_convergence().
+    """
+    import tensorflow as tf
+
+    if mode not in ('batch_hard', 'batch_all'):
+        raise ValueError("mode must be 'batch_hard' or 'batch_all', got {}".format(mode))
+
+    def loss(y_true, y_pred):
+        labels = tf.reshape(y_true, [-1])
+        sq = tf.reduce_sum(tf.square(y_pred), axis=1)
+        d = sq[:, None] + sq[None, :] - 2.0 * tf.matmul(y_pred, y_pred, transpose_b=True)
+        d = tf.maximum(d, 0.0) / tf.cast(tf.shape(y_pred)[1], y_pred.dtype)
+
+        same = tf.equal(labels[:, None], labels[None, :])
+        positive = tf.logical_and(same, tf.logical_not(tf.eye(tf.shape(labels)[0], dtype=tf.bool)))
+        negative = tf.logical_not(same)
+
+        if mode == 'batch_hard':
+            d_max = tf.reduce_max(d)
+            hardest_positive = tf.reduce_max(tf.where(positive, d, tf.zeros_like(d)), axis=1)
+            hardest_negative = tf.reduce_min(tf.where(negative, d, d + d_max + alpha), axis=1)
+            return tf.maximum(hardest_positive - hardest_negative + alpha, 0.)
+
+        triplet = d[:, :, None] - d[:, None, :] + alpha
+        mask = tf.logical_and(positive[:, :, None], negative[:, None, :])
+        triplet = tf.where(mask, tf.maximum(triplet, 0.), tf.zeros_like(triplet))
+        num_active = tf.reduce_sum(tf.cast(triplet > 0, y_pred.dtype))
+        return tf.reduce_sum(triplet) / tf.maximum(num_active, 1.0)
+
+    return loss
+
+
+def triplet_accuracy(embed, x, triplets):
+    """ Fraction of (anchor, positive, negative) index triplets into x whose negative is farther from the anchor. """
+    emb = np.asarray(embed(x), dtype=np.float32)
+    a, p, n = triplets
+    d_ap = np.mean(np.square(emb[a] - emb[p]), axis=1)
+    d_an = np.mean(np.square(emb[a] - emb[n]), axis=1)
+    return float(np.mean(d_an > d_ap))
+
+
+def compare_convergence(x_train, y_train, x_test, y_test, seconds=60, batch_size=200, emb_dim=32, alpha=0.5,
+                        modes=('random', 'semi_hard', 'batch_all'), eval_every=10, seed=0):
+    """
+    Trains the notebooks' embedding model with random and with mined triplets for the same wall-clock budget.
+
+    'random' trains the twin network on TripletSampler batches, 'batch_hard' and 'batch_all' train the
+    embedding model with online_triplet_loss(), and 'semi_hard' trains the twin network on
+    MiningTripletSampler batches. 'batch_hard' from randomly initialised weights tends to collapse all
+    embeddings to a point (the loss settles at alpha), so it is left out by default; it is better
+    used to fine-tune an embedding trained with one of the other modes.
+
+    Parameters
+    ----------
+    x_train, y_train, x_test, y_test: numpy.array
+        Vectorized images and labels, as produced in the notebooks after load_data().
+    seconds: float
+        Training time per mode.
+    batch_size: int
+        Triplets (or images, for the online loss) per step.
+    emb_dim: int
+        Embedding size.
+    alpha: float
+        Triplet loss margin.
+    modes: iterable(str)
+        Modes to compare.
+    eval_every: int
+        Steps between evaluations.
+    seed: int
+        Seed for weights and sampling.
+
+    Return
+    ------
+    dict mapping mode to a list of (elapsed seconds, test triplet accuracy) pairs.
+    """
+    import tensorflow as tf
+
+    img_dim = x_train.shape[1]
+    test_triplets = TripletSampler(x_test, y_test, seed=seed).sample_indices(2000)
+
+    def embedding_model():
+        tf.keras.utils.set_random_seed(seed)
+        return tf.keras.models.Sequential([
+            tf.keras.Input(shape=(img_dim,)),
+            tf.keras.layers.Dense(emb_dim, activation='relu'),
+            tf.keras.layers.Dense(emb_dim, activation='sigmoid')
+        ])
+
+    def twin_network(model):
+        inputs = [tf.keras.layers.Input(shape=(img_dim,)) for _ in range(3)]
+        out = tf.keras.layers.concatenate([model(i) for i in inputs], axis=1)
+        net = tf.keras.models.Model(inputs, out)
+
+        def loss(y_true, y_pred):
+            anc, pos, neg = y_pred[:, :emb_dim], y_pred[:, emb_dim:2*emb_dim], y_pred[:, 2*emb_dim:]
+            dp = tf.reduce_mean(tf.square(anc - pos), axis=1)
+            dn = tf.reduce_mean(tf.square(anc - neg), axis=1)
+            return tf.maximum(dp - dn + alpha, 0.)
+
+        net.compile(loss=loss, optimizer='adam')
+        return net
+
+    results = {}
+    for mode in modes:
+        model = embedding_model()
+        embed = lambda x: model(x, training=False).numpy()
+        sampler = TripletSampler(x_train, y_train, seed=seed)
+        if mode in ('batch_hard', 'batch_all'):
+            model.compile(loss=online_triplet_loss(alpha, mode), optimizer='adam')
+
+            def step():
+                i = sampler.rng.integers(0, len(sampler), batch_size)
+                return model.train_on_batch(x_train[i], y_train[i].astype(np.float32))
+        else:
+            net = twin_network(model)
+            if mode == 'semi_hard':
+                sampler = MiningTripletSampler(sampler, embed, 'semi_hard', alpha, pool_size=2 * batch_size)
+            y = np.zeros((batch_size, 3 * emb_dim), dtype=np.float32)
+            step = lambda: net.train_on_batch(sampler.create_batch(batch_size)[0], y)
+
+        curve = [(0.0, triplet_accuracy(embed, x_test, test_triplets))]
+        elapsed = 0.0
+        steps = 0
+        while elapsed < seconds:
+            start = time.perf_counter()
+            step()
+            elapsed += time.perf_counter() - start
+            steps += 1
+            if steps % eval_every == 0:
+                curve.append((elapsed, triplet_accuracy(embed, x_test, test_triplets)))
+        results[mode] = curve
+    return results
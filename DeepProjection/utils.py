@@ -5,6 +5,8 @@ import skopi as sk
 import skimage.measure as sm
 from numba import jit
 
+from pdb_cache import read_pdb
+
 
 ############################################ From calculate_diffraction_image_resolution.ipynb ############################################
 
@@ -45,8 +47,7 @@ def calculate_maximum_diffraction_resolution(beam_file, pdb_file, detector_dimen
     beam = sk.Beam(beam_file)
     if increase_factor != 1:
         beam.set_photons_per_pulse(increase_factor * beam.get_photons_per_pulse())
-    particle = sk.Particle()
-    particle.read_pdb(pdb_file, ff = 'WK')
+    particle = read_pdb(pdb_file, ff='WK')
     det = sk.SimpleSquareDetector(int(n_pixels), float(det_size), float(det_dist), beam=beam)
     
     # Calculate the maximum resolution for a diffraction image
@@ -103,13 +104,28 @@ def check_for_blank_img(img):
     False, if image is not blank.
     """
 
-    # Take absolute of img before taking the sum in order to
+    return bool(blank_frames(np.asarray(img)[np.newaxis])[0])
+
+
+def blank_frames(imgs):
+    """
+    Vectorized check_for_blank_img() over a stack of images.
+    
+    Parameters
+    ----------
+    imgs: numpy.array
+        Images of shape (N, row, col).
+    
+    Return
+    ------
+    numpy.array of N booleans, True where the image is blank.
+    """
+
+    # Take absolute of imgs before taking the sum in order to
     # prevent corner case of negative and positive values resulting in
     # a sum of zero.
-    if equal_float(np.sum(np.absolute(img)), 0):
-        return True
-    else:
-        return False
+    sums = np.absolute(imgs).reshape(len(imgs), -1).sum(axis=1)
+    return np.abs(sums) <= sys.float_info.epsilon
 
 
 # From check_for_nan_values.ipynb
@@ -220,9 +236,8 @@ def img_to_thumbnail(img, beam_file, pdb_file, detector_dimensions, n_part_per_s
     beam = sk.Beam(beam_file)
     beam.set_photons_per_pulse(increase_factor * beam.get_photons_per_pulse())
 
-    # Setup particle file.
-    particle = sk.Particle()
-    particle.read_pdb(pdb_file, ff='WK')
+    # Setup particle file, parsed once and then loaded from the PDB cache.
+    particle = read_pdb(pdb_file, ff='WK')
     
     # Setup detector.
     det = sk.SimpleSquareDetector(int(n_pixels), float(det_size), float(det_dist), beam=beam)
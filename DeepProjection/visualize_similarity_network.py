@@ -3,9 +3,21 @@
 This script allows for the creation of networks that visualizes similarity
 of different PDB structures.
 
+The similarity data comes from the RCSB structure search API, one query per
+PDB ID, or, with get_structure_similarity_data_offline(), from shape
+descriptors of PDB files on disk (see structure_descriptors.py).
+
+With a crawl state file (see get_structure_similarity_data_delta()), a
+refresh only re-queries the IDs that are new or older than max_age, and
+patches the stored edge list and node layout instead of rebuilding them.
+
 """
 import requests     # To make REST API calls to Protein Data Bank API.
 import json         # To interact with JSON response from Protein Data Bank.
+import glob         # To list local PDB files for offline similarity.
+import hashlib      # To detect changed search results in delta crawls.
+import os
+import time
 
 import pandas as pd
 import matplotlib.pyplot as plt     # Used to plot node positions returned by NetworkX spring_layout
@@ -39,8 +51,8 @@ def load_to_dataframe(similar_pdbs):
     else:
         pass
     
-    # Initialize DataFrame
-    df = pd.DataFrame(data=None, index=None, columns=['Source', 'Target', 'Weight'], copy=None)
+    # Rows of the DataFrame, created at once at the end
+    rows = []
 
     for tup in similar_pdbs:
         source_id = tup[0]         # The PDB ID that was use in the search is consider the source
@@ -52,9 +64,9 @@ def load_to_dataframe(similar_pdbs):
             target_sim_score = target[1]
 
             new_row = {'Source': source_id, 'Target': target_id, 'Weight': target_sim_score}
-            df = df.append(new_row, ignore_index=True)
+            rows.append(new_row)
 
-    return df
+    return pd.DataFrame(rows, columns=['Source', 'Target', 'Weight'])
 
 # Helper function for get_structure_similarity_data_from_range()
 # Returns a list of PDB IDs in a given range
@@ -401,6 +413,23 @@ def get_structure_similarity_data_by_seed(seed_id, mode='strict_shape_match', ma
     
     return results
 
+# Helper function for the search functions
+# Drops the queried ID from the search results and keeps the num_neighbors best
+def trim_similarity_data(data, num_neighbors):
+    """
+    Returns the list of (PDB ID, Structure Similarity Score) tuples of similar structures
+    from the result of query_structure_similarity_pdbs(), without the queried ID itself
+    (the first element) and with at most num_neighbors elements.
+    """
+    data = list(data[1:])     # Remember to drop the first element as it is the ID that was queried
+
+    if len(data) >= num_neighbors:
+        data = data[:num_neighbors]
+    else:
+        pass
+
+    return data
+
 # Uses a range of PDBs to get structure similarity data
 def get_structure_similarity_data_from_range(lower, upper=None, mode='strict_shape_match', num_neighbors=10):
     
@@ -455,13 +484,7 @@ def get_structure_similarity_data_from_range(lower, upper=None, mode='strict_sha
 
         # Trim data array based on num_neighbors
         # and create the tuple to append to "results" list
-
-        data.pop(0)     # Remember to pop the first element as it is the ID that was queried
-
-        if len(data) >= num_neighbors:
-            data = data[:10]
-        else:
-            pass
+        data = trim_similarity_data(data, num_neighbors)
 
         tup = (id, data)
         results.append(tup)
@@ -469,6 +492,217 @@ def get_structure_similarity_data_from_range(lower, upper=None, mode='strict_sha
     return results
 
 
+# Uses shape descriptors of local PDB files instead of the RCSB search API
+def get_structure_similarity_data_offline(pdb_dir, lower=None, upper=None, num_neighbors=10, cache=None):
+    """
+    Computes structure similarity for the PDB files in pdb_dir without querying the Protein Data Bank.
+
+    Structures are compared by radius of gyration, inertia tensor eigenvalues and pair-distance
+    distribution (see structure_descriptors.py); scores lie in (0, 1], higher is more similar.
+
+    Parameters
+    ----------
+    pdb_dir: str
+        Directory containing {PDB ID}.pdb files.
+
+    lower: str
+        Lower end PDB ID for range. If None, all files in pdb_dir are used.
+
+    upper: str
+        Upper end PDB ID for range.
+
+    num_neighbors: int
+        Maximum number of similar structures to include in graph for each ID.
+
+    cache: pdb_cache.PDBCache
+        Cache of parsed structures. If None, the default cache is used.
+
+    Return
+    ------
+    A list of tuples with the following structure: (PDB ID searched, list of similar PDBS of searched ID)
+    If num_neighbors is not an int or it is less than 0, it will return None.
+    """
+    from structure_descriptors import descriptor_matrix, similarity_graph
+
+    if (isinstance(num_neighbors, int) == False) or (num_neighbors < 0):
+        return None
+
+    pdb_files = {os.path.splitext(os.path.basename(path))[0].lower(): path
+                 for path in sorted(glob.glob(os.path.join(pdb_dir, '*.pdb')))}
+    if lower is not None:
+        in_range = set(get_pdb_ids_in_range(lower=lower, upper=upper) or [])
+        pdb_files = {pdb_id: path for pdb_id, path in pdb_files.items() if pdb_id in in_range}
+
+    ids, descriptors = descriptor_matrix(pdb_files, cache=cache)
+    if len(ids) == 0:
+        return []
+    return similarity_graph(ids, descriptors, num_neighbors=num_neighbors)
+
+
+""" CRAWL STATE FUNCTIONS """
+
+# Loads the crawl state written by save_crawl_state()
+def load_crawl_state(path):
+    """
+    Returns the crawl state stored at path, or an empty state if the file does not exist.
+
+    The state is a dictionary with:
+        'entries': {PDB ID: {'fetched': time of the last successful query (seconds since the epoch), or None,
+                             'hash': hash of the query result,
+                             'neighbors': list of [similar PDB ID, score], or None if no query succeeded yet,
+                             'failed': time of the last query that returned nothing, if any}}
+        'positions': {PDB ID: [x, y]} node positions of the last layout
+    """
+    if os.path.exists(path):
+        with open(path) as f:
+            state = json.load(f)
+    else:
+        state = {}
+
+    state.setdefault('entries', {})
+    state.setdefault('positions', {})
+    return state
+
+# Writes the crawl state; a crash mid-write leaves the previous state intact
+def save_crawl_state(state, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+# Hash of a query result, used to tell whether the result of a re-query changed
+def result_hash(data):
+    return hashlib.sha1(json.dumps(data).encode()).hexdigest()
+
+# Re-queries only the PDB IDs that are new or stale, updating the crawl state in place
+def get_structure_similarity_data_delta(state, lower, upper=None, mode='strict_shape_match', num_neighbors=10,
+                                        max_age=7 * 24 * 3600, retry_age=0, now=None):
+    """
+    Searches for structure similarity for the PDB IDs in the range [lower, upper] that
+    are not in the crawl state yet or were last queried more than max_age seconds ago.
+
+    Parameters
+    ----------
+    state: dictionary
+        Crawl state from load_crawl_state(); its entries are updated in place.
+
+    lower, upper, mode, num_neighbors:
+        See get_structure_similarity_data_from_range().
+
+    max_age: float
+        Seconds after which a result is stale and queried again.
+
+    retry_age: float
+        Seconds after which an ID whose last query returned nothing is queried again;
+        0 retries it on the next run. A failed query keeps the ID's earlier neighbors.
+
+    now: float
+        Current time in seconds since the epoch; time.time() if None.
+
+    Return
+    ------
+    A list of the PDB IDs whose similar structures changed (including new IDs).
+    If lower and upper are not a valid range, the list is empty.
+    If num_neighbors is not an int or it is less than 0, it will return None.
+    """
+    if (isinstance(num_neighbors, int) == False) or (num_neighbors < 0):
+        return None
+    elif isinstance(mode, str) == False:
+        return None
+    else:
+        pass
+
+    if now == None:
+        now = time.time()
+
+    entries = state['entries']
+    changed = []
+
+    for id in get_pdb_ids_in_range(lower=lower, upper=upper) or []:
+        entry = entries.get(id)
+
+        # Skip IDs queried recently, and failed IDs until retry_age has passed
+        if entry != None:
+            fresh = (entry['fetched'] != None) and (now - entry['fetched'] < max_age)
+            retry_later = (entry.get('failed') != None) and (now - entry['failed'] < retry_age)
+            if fresh or retry_later:
+                continue
+
+        data = query_structure_similarity_pdbs(id, mode=mode)
+
+        # No result: the ID does not exist, or the request failed (e.g. rate limit or server error).
+        # Keep the neighbors and fetch time of the last successful query and record the failure.
+        if data == None:
+            entry = dict(entry) if entry != None else {'fetched': None, 'hash': None, 'neighbors': None}
+            entry['failed'] = now
+            entries[id] = entry
+            continue
+
+        data = [[target, score] for target, score in trim_similarity_data(data, num_neighbors)]
+        data_hash = result_hash(data)
+        if (entry == None) or (entry['hash'] != data_hash):
+            changed.append(id)
+
+        entries[id] = {'fetched': now, 'hash': data_hash, 'neighbors': data}
+
+    return changed
+
+# Turns the crawl state into the input of load_to_dataframe()
+def crawl_state_to_similarity_data(state):
+    """
+    Returns the stored search results as a list of tuples (PDB ID searched, list of similar PDBS of searched ID),
+    the structure returned by get_structure_similarity_data_from_range().
+    """
+    results = []
+
+    for id, entry in sorted(state['entries'].items()):
+        if entry['neighbors'] == None:
+            continue
+        results.append((id, [(target, score) for target, score in entry['neighbors']]))
+
+    return results
+
+# Lays out a graph starting from the stored positions, moving only the changed part of the network
+def update_layout(graph, positions, changed, **kwargs):
+    """
+    Returns a dictionary of node positions of graph, computed with NetworkX spring_layout.
+
+    Nodes with a stored position that are neither changed nor neighbors of a changed node
+    keep their position; new and changed nodes are placed around them.
+
+    Parameters
+    ----------
+    graph: networkx.Graph
+        Similarity network.
+
+    positions: dictionary
+        Stored positions {PDB ID: [x, y]} of an earlier layout.
+
+    changed: list
+        PDB IDs whose similar structures changed since that layout.
+
+    kwargs:
+        Other arguments of networkx.spring_layout.
+    """
+    pos = {node: tuple(positions[node]) for node in graph if node in positions}
+
+    moving = set(node for node in changed if node in graph)
+    for node in list(moving):
+        moving.update(graph.neighbors(node))
+    moving.update(node for node in graph if node not in pos)
+
+    fixed = [node for node in pos if node not in moving]
+
+    # Nothing changed: keep the stored layout.
+    if len(moving) == 0:
+        return pos
+    # No stored layout: compute one from scratch.
+    if len(fixed) == 0:
+        return nx.spring_layout(graph, pos=pos or None, **kwargs)
+
+    return nx.spring_layout(graph, pos=pos, fixed=fixed, **kwargs)
+
+
 """ Node Position Data Functions """
 def get_node_positions_df(node_pos):
     """
@@ -485,8 +719,8 @@ def get_node_positions_df(node_pos):
             ...
         }
     """
-    # DataFrame to return
-    dataframe = pd.DataFrame(columns=['id', 'x', 'y'])
+    # Rows of the DataFrame to return
+    rows = []
 
     # Get items in dictionary
     nodes = node_pos.items()
@@ -497,9 +731,9 @@ def get_node_positions_df(node_pos):
         y = node[1][1]
 
         new_row = {'id': key, 'x': x, 'y': y}
-        dataframe = dataframe.append(new_row, ignore_index=True)
+        rows.append(new_row)
 
-    return dataframe
+    return pd.DataFrame(rows, columns=['id', 'x', 'y'])
 
 
 """ MAIN FUNCTION """
@@ -513,9 +747,20 @@ def main():
     num_neighbors = 10                      # Maximum number of similar PDB structures to include in graph.
     html_directory = ''                     # Directory to store HTML file with pyvis graph.
     node_pos_directory = ''                 # Directory to store an h5 file containing the position of nodes.
+    offline_pdb_dir = None                  # Directory of local PDB files; if set, similarity is computed offline.
+    crawl_state_file = None                 # JSON file of the crawl state; if set, only new or stale IDs are queried.
+    max_age = 7 * 24 * 3600                 # Seconds after which a stored search result is queried again.
 
     # Step 1: Retrieve structure similarity data used for graph.
-    similar_pdbs = get_structure_similarity_data_from_range(lower=lower, upper=upper, mode=search_mode, num_neighbors=num_neighbors)
+    if crawl_state_file is not None:
+        state = load_crawl_state(crawl_state_file)
+        changed = get_structure_similarity_data_delta(state, lower=lower, upper=upper, mode=search_mode,
+                                                      num_neighbors=num_neighbors, max_age=max_age)
+        similar_pdbs = crawl_state_to_similarity_data(state)
+    elif offline_pdb_dir is not None:
+        similar_pdbs = get_structure_similarity_data_offline(offline_pdb_dir, lower=lower, upper=upper, num_neighbors=num_neighbors)
+    else:
+        similar_pdbs = get_structure_similarity_data_from_range(lower=lower, upper=upper, mode=search_mode, num_neighbors=num_neighbors)
     
     # Step 2: Load the data into a pandas DataFrame to create network.
     df = load_to_dataframe(similar_pdbs)
@@ -524,7 +769,13 @@ def main():
     graph = nx.from_pandas_edgelist(df, source='Source', target='Target', edge_attr='Weight')
     
     # Step 4: Apply a spring_layout to NetworkX graph to prevent node overlap.
-    node_pos = nx.spring_layout(graph)  # Stores a dictionary of initial node positions for later data analysis.
+    if crawl_state_file is not None:
+        # Only the changed part of the network moves; the rest keeps the stored layout.
+        node_pos = update_layout(graph, state['positions'], changed)
+        state['positions'] = {node: [float(x), float(y)] for node, (x, y) in node_pos.items()}
+        save_crawl_state(state, crawl_state_file)
+    else:
+        node_pos = nx.spring_layout(graph)  # Stores a dictionary of initial node positions for later data analysis.
 
     # Step 5: Load the NetworkX graph into pyvis
     net = Network(height='1000px', width='1000px')